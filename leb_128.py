@@ -10,6 +10,8 @@ class BaseLEB128:
     """
     base class for DRY
     """
+    _signed = False
+
     def __init__(self, base_byte_number):
         """
         base_byte_number: base byte encoding number
@@ -151,6 +153,63 @@ class BaseLEB128:
         return  self.decode(out)
 
 
+    def encode_minimal(self, number_to_encode):
+        """
+        Encode number into the shortest byte sequence,
+        base_byte_number is not used
+        """
+        if not isinstance(number_to_encode, int):
+            msg = 'Number to encode should be integer'
+            raise TypeError(msg)
+
+        if number_to_encode < 0 and not self._signed:
+            msg = 'Unsigned LEB128 can`t encode negative number {}'.format(number_to_encode)
+            raise OverflowError(msg)
+
+        out = bytearray()
+        while True:
+            byte = number_to_encode & 127
+            number_to_encode >>= 7
+            if self._signed:
+                done = number_to_encode == -(byte >> 6)
+            else:
+                done = number_to_encode == 0
+
+            if done:
+                out.append(byte)
+                return bytes(out)
+            out.append(byte | 128)
+
+
+    def decode_from_buffer(self, buffer, offset=0):
+        """
+        Decode number directly from bytes-like object without any copy
+        buffer: bytes, bytearray, memoryview or mmap
+        offset: position of first byte of the number
+        return: (number, offset of the next byte)
+        """
+        out = 0
+        shift = 0
+
+        while True:
+            try:
+                byte = buffer[offset]
+            except IndexError:
+                raise StopIteration
+
+            offset += 1
+            out |= (byte & 127) << shift
+            shift += 7
+
+            if byte < 128:
+                break
+
+        if self._signed and (byte & 64):
+            out -= 1 << shift
+
+        return out, offset
+
+
 class Uleb128(BaseLEB128):
     """
     Unsigned LEB128 encode/decode class
@@ -166,6 +225,8 @@ class Sleb128(BaseLEB128):
     Signed LEB128 encode/decode class
     sleb128 - https://en.wikipedia.org/wiki/LEB128
     """
+    _signed = True
+
     def __init__(self, base_byte_number):
         super().__init__(base_byte_number)
 
@@ -194,6 +255,21 @@ class TestUleb128EncodeDecode(unittest.TestCase):
         """
         self.assertEqual(self.number, self.uleb128.decode(self.bytes))
 
+    def test_encode_minimal(self):
+        """
+        shortest encoding
+        """
+        self.assertEqual(self.bytes, self.uleb128.encode_minimal(self.number))
+        self.assertEqual(b'\x00', self.uleb128.encode_minimal(0))
+        self.assertRaises(OverflowError, self.uleb128.encode_minimal, -1)
+
+    def test_decode_buffer(self):
+        """
+        decode from buffer with offset
+        """
+        self.assertEqual((self.number, 4),\
+            self.uleb128.decode_from_buffer(b'\x00' + self.bytes, 1))
+
 
 class TestSleb128EncodeDecode(unittest.TestCase):
     """
@@ -229,5 +305,21 @@ class TestSleb128EncodeDecode(unittest.TestCase):
         self.assertEqual(self.number, self.sleb128.decode_from_stream(
             self.stream, '__next__'))
 
+    def test_encode_minimal(self):
+        """
+        shortest encoding round trip
+        """
+        self.assertEqual(self.bytes, self.sleb128.encode_minimal(self.number))
+        for number in [0, 1, -1, 63, 64, -64, -65, 1 << 40, -(1 << 40)]:
+            self.assertEqual((number, len(self.sleb128.encode_minimal(number))),\
+                self.sleb128.decode_from_buffer(self.sleb128.encode_minimal(number)))
+
+    def test_decode_buffer(self):
+        """
+        Test for buffer decoding
+        """
+        self.assertEqual((self.number, 3),\
+            self.sleb128.decode_from_buffer(memoryview(self.bytes)))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,250 @@
+"""
+    Восстановление биржевого стакана по кадрам потока котировок (Stock).
+
+    Кадр потока содержит только изменения стакана:
+        - объем > 0 - котировка на продажу (ask),
+        - объем < 0 - котировка на покупку (bid),
+        - объем = 0 - котировка удаляется.
+"""
+import unittest
+from bisect import bisect_left, insort
+
+from qsh_parser import QSHParser, Stocks, FileSignatureError, np
+
+
+class OrderBook:
+    """
+    Bid and ask ladders as sorted price lists plus price -> volume dicts:
+    level lookup and volume change are O(1), best prices are O(1).
+    Level insert and remove are O(log n) search plus list memmove -
+    O(n) worst case, cheap for usual depth of hundreds of levels.
+    """
+    def __init__(self):
+        """
+        _bid_prices, _ask_prices: ascending prices of each side
+        _bids, _asks: price -> volume (always positive)
+        """
+        self._bid_prices = []
+        self._ask_prices = []
+        self._bids = {}
+        self._asks = {}
+        self.timestamp = None
+        self.frames = 0
+
+    def clear(self):
+        """
+        remove all levels
+        """
+        self.__init__()
+
+    @staticmethod
+    def _remove(prices, levels, price):
+        """
+        remove level from one side
+        """
+        if levels.pop(price, None) is not None:
+            del prices[bisect_left(prices, price)]
+
+    def update(self, price, volume):
+        """
+        Apply one quote delta
+        """
+        if volume > 0:
+            prices, levels = self._ask_prices, self._asks
+            self._remove(self._bid_prices, self._bids, price)
+        elif volume < 0:
+            prices, levels = self._bid_prices, self._bids
+            self._remove(self._ask_prices, self._asks, price)
+            volume = -volume
+        else:
+            self._remove(self._bid_prices, self._bids, price)
+            self._remove(self._ask_prices, self._asks, price)
+            return
+
+        if price not in levels:
+            insort(prices, price)
+        levels[price] = volume
+
+    def apply(self, prices, volumes, timestamp=None):
+        """
+        Apply one frame
+        prices, volumes: quote deltas of the frame
+        timestamp: frame time
+        """
+        update = self.update
+        for price, volume in zip(prices, volumes):
+            update(price, volume)
+
+        self.timestamp = timestamp
+        self.frames += 1
+
+    @property
+    def best_bid(self):
+        """
+        (price, volume) of best bid or None
+        """
+        if self._bid_prices:
+            price = self._bid_prices[-1]
+            return price, self._bids[price]
+        return None
+
+    @property
+    def best_ask(self):
+        """
+        (price, volume) of best ask or None
+        """
+        if self._ask_prices:
+            price = self._ask_prices[0]
+            return price, self._asks[price]
+        return None
+
+    def top_n(self, depth):
+        """
+        Best levels of each side, best first
+        return: (bids, asks) - lists of (price, volume)
+        """
+        bids = [(price, self._bids[price]) for price in\
+            reversed(self._bid_prices[-depth:])] if depth > 0 else []
+        asks = [(price, self._asks[price]) for price in self._ask_prices[:depth]]
+        return bids, asks
+
+    def snapshot(self):
+        """
+        Full depth copy of book
+        """
+        bids, asks = self.top_n(max(len(self._bid_prices), len(self._ask_prices)))
+        return {'timestamp': self.timestamp, 'bids': bids, 'asks': asks}
+
+    def __len__(self):
+        """
+        levels number
+        """
+        return len(self._bids) + len(self._asks)
+
+    def __repr__(self):
+        """
+        print format
+        """
+        return 'OrderBook(timestamp={}, bid={}, ask={}, levels={})'.format(\
+            self.timestamp, self.best_bid, self.best_ask, len(self))
+
+
+def iter_books(parser, every=1, batch_size=65536):
+    """
+    Rebuild order book frame by frame
+    parser: QSHParser of Stock stream, touch is called if required
+    every: yield book after every N frames
+    batch_size: frames number decoded at once in columnar mode
+    return: generator of the same OrderBook object, timestamp is frame time
+        as unix epoch milliseconds (with numpy and without it)
+    """
+    if parser._stream_dt is None:
+        parser.touch()
+
+    if not isinstance(parser._pyload, Stocks):
+        msg = 'File {} is not an order book stream'.format(parser._io_stream.name)
+        raise FileSignatureError(msg)
+
+    book = OrderBook()
+
+    if np is None:
+        _frame_ms = parser._stream_dt._base
+        for data in parser:
+            quotes = data['quotes']
+            book.apply([quote['rate'] for quote in quotes],\
+                [quote['volume'] for quote in quotes], parser._frame_time(_frame_ms._last))
+            if book.frames % every == 0:
+                yield book
+        return
+
+    for batch in parser.read_stocks_columnar(batch_size):
+        offsets = batch['offsets'].tolist()
+        prices = batch['price'].tolist()
+        volumes = batch['volume'].tolist()
+
+        for i, timestamp in enumerate(batch['timestamp'].tolist()):
+            book.apply(prices[offsets[i]:offsets[i + 1]],\
+                volumes[offsets[i]:offsets[i + 1]], timestamp)
+            if book.frames % every == 0:
+                yield book
+
+
+class TestOrderBook(unittest.TestCase):
+    """
+    order book tests
+    """
+    def setUp(self):
+        """
+        simple book
+        """
+        self.book = OrderBook()
+        self.book.apply([100, 101, 102, 99, 98], [-5, 3, 7, -2, -1], 1)
+
+    def test_levels(self):
+        """
+        add, change, remove and move level to other side
+        """
+        self.assertEqual(self.book.best_bid, (100, 5))
+        self.assertEqual(self.book.best_ask, (101, 3))
+        self.assertEqual(self.book.top_n(2), ([(100, 5), (99, 2)], [(101, 3), (102, 7)]))
+
+        self.book.apply([101, 100, 99], [0, 4, -1], 2)
+        self.assertEqual(self.book.best_bid, (99, 1))
+        self.assertEqual(self.book.best_ask, (100, 4))
+        self.assertEqual(self.book.snapshot(), {'timestamp': 2,\
+            'bids': [(99, 1), (98, 1)], 'asks': [(100, 4), (102, 7)]})
+
+    def test_file(self):
+        """
+        book from file is the same as dict rebuilt book
+        """
+        import os
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            '20150302', 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+        etalon = QSHParser(path)
+        etalon.touch()
+        self.addCleanup(etalon._io_stream.close)
+        parser = QSHParser(path)
+        self.addCleanup(parser._io_stream.close)
+        levels = {}
+        frames = 0
+
+        for book in iter_books(parser, every=100):
+            if book.frames > 5000:
+                break
+
+            while frames < book.frames:
+                frames += 1
+                for quote in etalon.read()['quotes']:
+                    if quote['volume']:
+                        levels[quote['rate']] = quote['volume']
+                    else:
+                        levels.pop(quote['rate'], None)
+
+            snapshot = book.snapshot()
+            self.assertListEqual(sorted(snapshot['bids']), sorted(\
+                (price, -volume) for price, volume in levels.items() if volume < 0))
+            self.assertListEqual(snapshot['asks'], sorted(\
+                (price, volume) for price, volume in levels.items() if volume > 0))
+
+    def test_timestamp(self):
+        """
+        book timestamp is epoch ms with numpy and without it
+        """
+        import os
+        from unittest import mock
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            '20150302', 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+        times = []
+        for module_np in [np, None]:
+            parser = QSHParser(path)
+            self.addCleanup(parser._io_stream.close)
+            with mock.patch(__name__ + '.np', module_np):
+                times.append([book.timestamp for book, _ in zip(iter_books(parser,\
+                    batch_size=100), range(500))])
+        self.assertIsInstance(times[1][0], int)
+        self.assertListEqual(times[0], times[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,248 @@
+"""
+    Соединение сделок с состоянием стакана "на момент" (as-of join).
+
+    Файлы сделок (Deals) и котировок (Stock) одного инструмента читаются
+    одновременно колоночными пачками: стакан (order_book.OrderBook)
+    догоняет время очередной сделки, к сделке добавляются лучшие цены
+    и N лучших уровней каждой стороны. Ни один файл не читается целиком.
+
+    Время сделки для сравнения со временем кадров котировок:
+        - exchange - биржевое время сделки (exchange_date_time);
+        - frame - время кадра сделки.
+    Применяются кадры котировок со временем <= времени сделки
+    (< при allow_exact=False). Стакан не откатывается назад: сделка
+    с меньшим временем, чем у предыдущей, получает текущее состояние.
+"""
+import os
+import unittest
+from bisect import bisect_left, bisect_right
+
+from qsh_parser import QSHParser, Trades, Stocks, FileSignatureError, TRADES_DTYPE, np
+from order_book import OrderBook, iter_books
+
+TRADES_DTYPE_NAMES = [name for name, _ in TRADES_DTYPE]
+
+
+def join_dtype(depth=5):
+    """
+    Structured dtype of joined trades: TRADES_DTYPE and
+        frame_time - trade frame time;
+        quote_time - time of last applied quotes frame, -1 before first one;
+        bid, bid_volume, ask, ask_volume - best levels, 0 for empty side;
+        bid_prices, bid_volumes, ask_prices, ask_volumes - depth best levels,
+            best first, 0 for absent levels (if depth > 0).
+    Times are milliseconds since 1970-01-01 UTC.
+    """
+    out = TRADES_DTYPE + [('frame_time', 'i8'), ('quote_time', 'i8'), ('bid', 'i8'),\
+        ('bid_volume', 'i8'), ('ask', 'i8'), ('ask_volume', 'i8')]
+    if depth > 0:
+        out += [(name, 'i8', (depth,)) for name in ['bid_prices', 'bid_volumes',\
+            'ask_prices', 'ask_volumes']]
+    return np.dtype(out)
+
+
+class _QuotesCursor:
+    """
+    Order book moved forward by columnar batches of quotes frames
+    """
+    def __init__(self, parser, batch_size):
+        """
+        parser: touched QSHParser of Stock stream
+        """
+        self.book = OrderBook()
+        self.time = -1
+        self._stream = parser._io_stream
+        self._batches = parser.read_stocks_columnar(batch_size)
+        self._times = []
+        self._index = 0
+        self._done = False
+
+    def _load(self):
+        """
+        next batch, False at end of file
+        """
+        for batch in self._batches:
+            self._times = batch['timestamp'].tolist()
+            self._offsets = batch['offsets'].tolist()
+            self._prices = batch['price'].tolist()
+            self._volumes = batch['volume'].tolist()
+            self._index = 0
+            return True
+        self._done = True
+        return False
+
+    def advance(self, until, allow_exact=True):
+        """
+        Apply frames with time <= until (< if not allow_exact)
+        """
+        apply = self.book.apply
+        while not self._done:
+            if self._index >= len(self._times) and not self._load():
+                return
+            times, offsets, index = self._times, self._offsets, self._index
+            stop = (bisect_right if allow_exact else bisect_left)(times, until, index)
+            if stop == index:
+                return
+            for i in range(index, stop):
+                apply(self._prices[offsets[i]:offsets[i + 1]],\
+                    self._volumes[offsets[i]:offsets[i + 1]], times[i])
+            self._index = stop
+            self.time = times[stop - 1]
+            if stop < len(times):
+                return
+
+    def close(self):
+        """
+        stop reading quotes
+        """
+        self._batches.close()
+        self._stream.close()
+
+
+def _state(cursor, depth):
+    """
+    quote_time, bid, bid_volume, ask, ask_volume and depth levels of book
+    """
+    bids, asks = cursor.book.top_n(max(depth, 1))
+    best_bid = bids[0] if bids else (0, 0)
+    best_ask = asks[0] if asks else (0, 0)
+    out = (cursor.time,) + best_bid + best_ask
+    if depth > 0:
+        pad = [0] * depth
+        out += ((([price for price, _ in bids] + pad)[:depth]),\
+            (([volume for _, volume in bids] + pad)[:depth]),\
+            (([price for price, _ in asks] + pad)[:depth]),\
+            (([volume for _, volume in asks] + pad)[:depth]))
+    return out
+
+
+def asof_join(trades, quotes, depth=5, on='exchange', allow_exact=True,\
+    batch_size=65536):
+    """
+    Trades with prevailing quotes state
+    trades: QSHParser of Deals stream
+    quotes: QSHParser of Stock stream of the same instrument,
+        touch is called if required
+    depth: best levels number of each side, 0 - best prices only
+    on: exchange or frame - trade time to compare with quotes frame time
+    allow_exact: quotes frame with time equal to trade time is applied
+    batch_size: trades and quotes frames decoded at once
+    return: generator of structured arrays with join_dtype(depth)
+    """
+    if np is None:
+        raise ImportError('numpy is required for as-of join')
+
+    if on not in ['exchange', 'frame']:
+        msg = 'Unknown join time {}, use exchange or frame'.format(on)
+        raise ValueError(msg)
+
+    for parser, _class in [(trades, Trades), (quotes, Stocks)]:
+        if parser._stream_dt is None:
+            parser.touch()
+        if not isinstance(parser._pyload, _class):
+            msg = 'File {} is not a {} stream'.format(parser._io_stream.name,\
+                _class.__name__)
+            raise FileSignatureError(msg)
+
+    dtype = join_dtype(depth)
+    _book = [name for name in dtype.names if name not in TRADES_DTYPE_NAMES and\
+        name != 'frame_time']
+    _book_dtype = np.dtype([(name, dtype.fields[name][0]) for name in _book])
+    cursor = _QuotesCursor(quotes, batch_size)
+
+    try:
+        for batch, frame_time in trades.read_trades_columnar(batch_size, frame_time=True):
+            states, index = [], []
+            frames = -1
+            times = batch['timestamp'] if on == 'exchange' else frame_time
+            for timestamp in times.tolist():
+                cursor.advance(timestamp, allow_exact)
+                if cursor.book.frames != frames:
+                    frames = cursor.book.frames
+                    states.append(_state(cursor, depth))
+                index.append(len(states) - 1)
+
+            out = np.empty(len(batch), dtype=dtype)
+            for name in TRADES_DTYPE_NAMES:
+                out[name] = batch[name]
+            out['frame_time'] = frame_time
+            book = np.array(states, dtype=_book_dtype)[np.array(index, dtype='i8')]
+            for name in _book:
+                out[name] = book[name]
+            yield out
+    finally:
+        cursor.close()
+        trades._io_stream.close()
+
+
+@unittest.skipIf(np is None, 'numpy is required')
+class TestAsofJoin(unittest.TestCase):
+    """
+    as-of join tests
+    """
+    def setUp(self):
+        """
+        bundled pair of files
+        """
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+        self.trades, self.quotes = [os.path.join(source,\
+            'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name)) for name in ['Trades', 'Quotes']]
+
+    def _check(self, on, allow_exact):
+        """
+        join of first trades is the same as bisect over all book states
+        """
+        joined = asof_join(QSHParser(self.trades), QSHParser(self.quotes), 3, on,\
+            allow_exact, batch_size=500)
+        rows = np.concatenate([next(joined) for _ in range(6)])
+        joined.close()
+        key = rows['timestamp'] if on == 'exchange' else rows['frame_time']
+
+        times, states = [], []
+        quotes = QSHParser(self.quotes)
+        for book in iter_books(quotes):
+            times.append(book.timestamp)
+            bids, asks = book.top_n(3)
+            states.append((bids[0], asks[0], bids, asks))
+            if book.timestamp > key[-1]:
+                break
+        quotes._io_stream.close()
+
+        search = bisect_right if allow_exact else bisect_left
+        for row, time in zip(rows, key.tolist()):
+            state = search(times, time) - 1
+            self.assertEqual(row['quote_time'], times[state])
+            bid, ask, bids, asks = states[state]
+            self.assertEqual((row['bid'], row['bid_volume']), bid)
+            self.assertEqual((row['ask'], row['ask_volume']), ask)
+            self.assertListEqual(row['bid_prices'].tolist(), [price for price, _ in bids])
+            self.assertListEqual(row['ask_volumes'].tolist(), [volume for _, volume in asks])
+
+    def test_exchange(self):
+        """
+        exchange time join
+        """
+        self._check('exchange', True)
+
+    def test_frame(self):
+        """
+        frame time join without exact matches
+        """
+        self._check('frame', False)
+
+    def test_whole_file(self):
+        """
+        all trades are joined, trade columns are kept
+        """
+        rows = np.concatenate(list(asof_join(QSHParser(self.trades),\
+            QSHParser(self.quotes), 0)))
+        parser = QSHParser(self.trades)
+        parser.touch()
+        etalon = np.concatenate(list(parser.read_trades_columnar()))
+        self.assertEqual(len(rows), len(etalon))
+        self.assertTrue(np.array_equal(rows['price'], etalon['price']))
+        self.assertGreater(np.mean(rows['bid'] > 0), 0.99)
+
+
+if __name__ == "__main__":
+    unittest.main()
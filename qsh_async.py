@@ -0,0 +1,281 @@
+"""
+    Асинхронное чтение файлов qsh для сервисов на asyncio.
+
+    Разбор идет в рабочем потоке (или в процессах по участкам индекса),
+    кадры передаются в цикл событий пачками через ограниченную очередь:
+    если потребитель не успевает, разбор останавливается до освобождения
+    места, цикл событий не блокируется на время разбора файла.
+"""
+import os
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from qsh_parser import QSHParser, FrameIndex
+
+#конец файла в очереди
+_DONE = object()
+
+
+class AsyncQSHParser:
+    """
+    async for data in AsyncQSHParser(path): ...
+    """
+    _executors = ['thread', 'process']
+
+    def __init__(self, path_to_file, backend='file', timestamps='datetime',\
+        batch_size=1024, max_batches=8, executor='thread', streams=None, workers=None):
+        """
+        path_to_file, backend, timestamps - see QSHParser
+        batch_size: frames decoded and passed to event loop at once
+        max_batches: queue size in batches, decoding waits when it is full
+        executor: thread - decoding in one worker thread,
+            process - index ranges are decoded in worker processes
+        streams: stream numbers or types to subscribe, see QSHParser.subscribe
+        workers: processes number for process executor
+        """
+        if executor not in self._executors:
+            msg = 'Unknown executor {}, use one of {}'.format(executor, self._executors)
+            raise ValueError(msg)
+
+        if executor == 'process' and streams:
+            msg = 'Streams subscription is supported by thread executor only'
+            raise ValueError(msg)
+
+        self._parser = QSHParser(path_to_file, backend, timestamps)
+        self._batch_size = batch_size
+        self._max_batches = max(max_batches, 1)
+        self._executor = executor
+        self._streams = streams or []
+        self._workers = workers
+        self._stop = threading.Event()
+
+    @property
+    def parser(self):
+        """
+        underlying QSHParser, header and streams are read on first iteration
+        """
+        return self._parser
+
+    async def touch(self):
+        """
+        Read header and streams without blocking loop
+        """
+        if self._parser._stream_dt is None:
+            await asyncio.get_running_loop().run_in_executor(None, self._touch)
+        return self._parser
+
+    def _touch(self):
+        """
+        touch and subscribe in worker thread
+        """
+        self._parser.touch()
+        if self._streams:
+            self._parser.subscribe(*self._streams)
+
+    def _produce(self, loop, queue):
+        """
+        Decode batches in worker thread and put them into queue,
+        put waits for free space - backpressure
+        """
+        try:
+            if self._parser._stream_dt is None:
+                self._touch()
+
+            read = self._parser.read
+            while not self._stop.is_set():
+                batch = []
+                try:
+                    for _ in range(self._batch_size):
+                        batch.append(read())
+                except StopIteration:
+                    self._parser._io_stream.close()
+                    if batch:
+                        self._put(loop, queue, batch)
+                    break
+                self._put(loop, queue, batch)
+
+            self._put(loop, queue, _DONE)
+        except BaseException as error:
+            self._put(loop, queue, error)
+
+    def _put(self, loop, queue, item):
+        """
+        put item from worker thread, wait while queue is full
+        """
+        if self._stop.is_set():
+            #consumer has gone, nobody waits for items
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+        except RuntimeError:
+            #loop is closed
+            self._stop.set()
+
+    async def batches(self):
+        """
+        Async generator of frame data lists
+        """
+        if self._executor == 'process':
+            async for batch in self._process_batches():
+                yield batch
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self._max_batches)
+        self._stop.clear()
+        worker = threading.Thread(target=self._produce, args=(loop, queue),\
+            name='qsh-decoder', daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+            #free worker waiting on full queue
+            while not queue.empty():
+                queue.get_nowait()
+            await loop.run_in_executor(None, worker.join)
+
+    def _range_index(self):
+        """
+        Index of parser if it is set, else sidecar one if it is fresh, else
+        new one kept in memory only - nothing is written near file
+        """
+        parser = self._parser
+        if parser._index is None:
+            parser._index = FrameIndex.load(parser._path + FrameIndex.suffix,\
+                *parser._file_stamp())
+        if parser._index is None:
+            parser.build_index(self._batch_size, save=False)
+        return parser._index
+
+    async def _process_batches(self):
+        """
+        Decode index ranges in worker processes, at most max_batches
+        ranges are decoded or waiting for consumer at once
+        """
+        from qsh_pool import decode_range, frames_from_json
+
+        loop = asyncio.get_running_loop()
+        path = self._parser._path
+        _timestamps = 'ms' if self._parser._epoch_mode else 'datetime'
+        #ranges are decoded by workers, own stream is not needed
+        self._parser._io_stream.close()
+        index = await loop.run_in_executor(None, self._range_index)
+        starts = index.checkpoints
+        stops = [checkpoint[0] for checkpoint in starts[1:]] + [index.frames]
+
+        with ProcessPoolExecutor(self._workers) as pool:
+            pending = []
+            calls = iter(zip(starts, stops))
+            try:
+                while True:
+                    for start, stop in calls:
+                        pending.append(loop.run_in_executor(pool, decode_range, path,\
+                            start, stop, _timestamps))
+                        if len(pending) >= self._max_batches:
+                            break
+                    if not pending:
+                        return
+                    text = await pending.pop(0)
+                    if text:
+                        yield list(frames_from_json(text, _timestamps))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    async def __aiter__(self):
+        """
+        async for data in parser
+        """
+        async for batch in self.batches():
+            for data in batch:
+                yield data
+
+
+class TestAsyncParser(unittest.TestCase):
+    """
+    async parser tests
+    """
+    def setUp(self):
+        """
+        bundled file and its frames
+        """
+        self.path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        etalon = QSHParser(self.path)
+        etalon.touch()
+        self.frames = list(etalon)
+
+    def test_thread(self):
+        """
+        frames are the same as sync ones, loop is not blocked
+        """
+        async def ticker(ticks):
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0.001)
+
+        async def collect():
+            ticks = []
+            task = asyncio.ensure_future(ticker(ticks))
+            parser = AsyncQSHParser(self.path, batch_size=500, max_batches=2)
+            out = [data async for data in parser]
+            task.cancel()
+            return out, len(ticks)
+
+        out, ticks = asyncio.run(collect())
+        self.assertListEqual(out, self.frames)
+        self.assertGreater(ticks, 10)
+
+    def test_break(self):
+        """
+        consumer stops early, worker is stopped
+        """
+        async def first():
+            parser = AsyncQSHParser(self.path, batch_size=100, max_batches=1)
+            batches = parser.batches()
+            async for batch in batches:
+                await batches.aclose()
+                #stream is kept for next iteration, test closes it
+                parser.parser._io_stream.close()
+                return batch, parser._stop.is_set()
+
+        batch, stopped = asyncio.run(first())
+        self.assertListEqual(batch, self.frames[:100])
+        self.assertTrue(stopped)
+
+    def test_process(self):
+        """
+        process executor keeps frames order
+        """
+        import shutil
+        import tempfile
+
+        async def collect(path, every=None):
+            parser = AsyncQSHParser(path, batch_size=5000, executor='process',\
+                workers=2)
+            index = every and parser.parser.build_index(every, save=False)
+            out = [data async for data in parser]
+            if index:
+                self.assertIs(parser.parser._index, index)
+            return out
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trades.qsh')
+            shutil.copyfile(self.path, path)
+            self.assertListEqual(asyncio.run(collect(path)), self.frames)
+            self.assertListEqual(asyncio.run(collect(path, 3000)), self.frames)
+            self.assertListEqual(os.listdir(tmp), ['trades.qsh'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,374 @@
+"""
+    Потоковое построение баров (OHLCV), VWAP и профиля объема по цене
+    из потока сделок (Deals) за один проход.
+
+    Сделки читаются колоночно пачками (QSHParser.read_trades_columnar),
+    бары считаются векторно по пачке, словари сделок не строятся, память
+    не зависит от длины файла. Бары строятся:
+        - по времени: size - длина бара в миллисекундах, границы кратны size
+          от 1970-01-01 UTC;
+        - по числу сделок: size сделок в баре;
+        - по объему: сделка попадает в бар по накопленному до нее объему,
+          бар k содержит сделки с накопленным объемом в [k*size, (k+1)*size),
+          сделки не делятся между барами.
+    Объем бара разделен по направлению сделки: UNKNOWN, ASK, BID.
+"""
+import os
+import unittest
+
+from qsh_parser import QSHParser, Trades, FileSignatureError, EPOCH_MS, MISSING_I8, np
+
+SIDES = ('UNKNOWN', 'ASK', 'BID')
+
+
+class Bar:
+    """
+    One bar, prices are in ticks as in file
+    key: bar number - time // size, trade number // size or volume // size
+    time: bar start - grid time for time bars, first trade time otherwise
+    first_ms, last_ms: first and last trade times (epoch ms)
+    side_volume: volumes of UNKNOWN, ASK, BID trades
+    turnover: sum of price * volume
+    profile: price -> [UNKNOWN, ASK, BID] volumes or None
+    """
+    __slots__ = ('key', 'time', 'first_ms', 'last_ms', 'open', 'high', 'low', 'close',\
+        'volume', 'trades', 'turnover', 'side_volume', 'profile')
+
+    def __init__(self, key, time, time_ms, price, profile=False):
+        """
+        empty bar opened by trade time and price
+        """
+        self.key = key
+        self.time = time
+        self.first_ms = self.last_ms = time_ms
+        self.open = self.high = self.low = self.close = price
+        self.volume = self.trades = self.turnover = 0
+        self.side_volume = [0, 0, 0]
+        self.profile = {} if profile else None
+
+    def add(self, time_ms, price, volume, side):
+        """
+        Add one trade
+        """
+        self.last_ms = time_ms
+        if price > self.high:
+            self.high = price
+        if price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += volume
+        self.trades += 1
+        self.turnover += price * volume
+        self.side_volume[side] += volume
+        if self.profile is not None:
+            level = self.profile.get(price)
+            if level is None:
+                level = self.profile[price] = [0, 0, 0]
+            level[side] += volume
+
+    def merge(self, other):
+        """
+        Add later part of the same bar
+        """
+        self.last_ms = other.last_ms
+        self.high = max(self.high, other.high)
+        self.low = min(self.low, other.low)
+        self.close = other.close
+        self.volume += other.volume
+        self.trades += other.trades
+        self.turnover += other.turnover
+        for side in range(3):
+            self.side_volume[side] += other.side_volume[side]
+        if self.profile is not None:
+            for price, volumes in other.profile.items():
+                level = self.profile.get(price)
+                if level is None:
+                    self.profile[price] = volumes
+                else:
+                    for side in range(3):
+                        level[side] += volumes[side]
+
+    @property
+    def vwap(self):
+        """
+        volume weighted average price, None for zero volume
+        """
+        return self.turnover / self.volume if self.volume else None
+
+    @property
+    def data(self):
+        """
+        bar as dict
+        """
+        out = {key: getattr(self, key) for key in self.__slots__}
+        out['side_volume'] = dict(zip(SIDES, self.side_volume))
+        out['vwap'] = self.vwap
+        return out
+
+    def __repr__(self):
+        """
+        print format
+        """
+        return 'Bar(time={}, o={}, h={}, l={}, c={}, v={}, vwap={})'.format(\
+            self.time, self.open, self.high, self.low, self.close, self.volume, self.vwap)
+
+
+class BarAggregator:
+    """
+    Incremental bars builder, keeps only current bar
+    """
+    _kinds = ['time', 'trades', 'volume']
+
+    def __init__(self, by='time', size=60000, profile=False):
+        """
+        by: time, trades or volume
+        size: bar length in ms, trades number or volume
+        profile: collect volume at price for every bar
+        """
+        if by not in self._kinds:
+            msg = 'Unknown bar kind {}, use one of {}'.format(by, self._kinds)
+            raise ValueError(msg)
+
+        if size <= 0:
+            msg = 'Bar size should be positive, got {}'.format(size)
+            raise ValueError(msg)
+
+        self.by = by
+        self.size = size
+        self.profile = profile
+        self._bar = None
+        self._trades = 0
+        self._volume = 0
+
+    def _key(self, time_ms, volume):
+        """
+        bar key of next trade, counters are moved
+        """
+        if self.by == 'time':
+            return time_ms // self.size
+        if self.by == 'trades':
+            key = self._trades // self.size
+        else:
+            key = self._volume // self.size
+        self._trades += 1
+        self._volume += volume
+        return key
+
+    def _open(self, key, time_ms, price):
+        """
+        new bar
+        """
+        return Bar(key, key * self.size if self.by == 'time' else time_ms, time_ms,\
+            price, self.profile)
+
+    def update(self, time_ms, price, volume, side=0):
+        """
+        Add one trade
+        side: 0 - UNKNOWN, 1 - ASK, 2 - BID
+        return: closed bar or None
+        """
+        key = self._key(time_ms, volume)
+        closed = None
+        if self._bar is None or key != self._bar.key:
+            closed = self._bar
+            self._bar = self._open(key, time_ms, price)
+        self._bar.add(time_ms, price, volume, side)
+        return closed
+
+    def update_batch(self, timestamp, price, volume, side):
+        """
+        Add trades of numpy arrays, bars are reduced vectorized
+        return: list of closed bars
+        """
+        if not len(timestamp):
+            return []
+
+        if self.by == 'time':
+            keys = timestamp // self.size
+        elif self.by == 'trades':
+            keys = (self._trades + np.arange(len(timestamp), dtype='i8')) // self.size
+        else:
+            before = self._volume + np.cumsum(volume) - volume
+            keys = before // self.size
+        self._trades += len(timestamp)
+        self._volume += int(volume.sum())
+
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        ends = np.append(starts[1:], len(keys)) - 1
+        turnover = price * volume
+
+        columns = [keys[starts], timestamp[starts], timestamp[ends], price[starts],\
+            np.maximum.reduceat(price, starts), np.minimum.reduceat(price, starts),\
+            price[ends], np.add.reduceat(volume, starts), ends - starts + 1,\
+            np.add.reduceat(turnover, starts)] + [np.add.reduceat(\
+            np.where(side == number, volume, 0), starts) for number in range(3)]
+
+        out = []
+        for index, (key, first_ms, last_ms, _open, high, low, close, _volume, trades,\
+            _turnover, unknown, ask, bid) in enumerate(zip(*[column.tolist()\
+            for column in columns])):
+            bar = self._open(key, first_ms, _open)
+            bar.last_ms = last_ms
+            bar.high, bar.low, bar.close = high, low, close
+            bar.volume, bar.trades, bar.turnover = _volume, trades, _turnover
+            bar.side_volume = [unknown, ask, bid]
+            if self.profile:
+                bar.profile = _profile(price[starts[index]:ends[index] + 1],\
+                    volume[starts[index]:ends[index] + 1], side[starts[index]:ends[index] + 1])
+
+            if self._bar is not None and self._bar.key == key:
+                self._bar.merge(bar)
+                continue
+            if self._bar is not None:
+                out.append(self._bar)
+            self._bar = bar
+
+        return out
+
+    def flush(self):
+        """
+        Close current bar
+        return: bar or None
+        """
+        bar, self._bar = self._bar, None
+        return bar
+
+
+def _profile(price, volume, side):
+    """
+    volume at price split by side of numpy trades
+    """
+    levels, inverse = np.unique(price, return_inverse=True)
+    out = np.zeros((len(levels), 3), dtype='i8')
+    np.add.at(out, (inverse, side.astype('i8')), volume)
+    return dict(zip(levels.tolist(), out.tolist()))
+
+
+def iter_bars(parser, by='time', size=60000, profile=False, batch_size=65536):
+    """
+    Bars of trades stream in one pass
+    parser: QSHParser of Deals stream, touch is called if required
+    by, size, profile: see BarAggregator
+    batch_size: trades decoded at once
+    return: generator of Bar, times are epoch ms; trades with no price
+        or exchange time yet are skipped
+    """
+    if parser._stream_dt is None:
+        parser.touch()
+
+    if not isinstance(parser._pyload, Trades):
+        msg = 'File {} is not a trades stream'.format(parser._io_stream.name)
+        raise FileSignatureError(msg)
+
+    aggregator = BarAggregator(by, size, profile)
+
+    if np is None:
+        _offset = parser._offset_ms
+        for record in parser.iter_records(reuse=True):
+            if record.transaction_price is None or record.time_ms is None:
+                continue
+            closed = aggregator.update(record.time_ms - EPOCH_MS - _offset,\
+                record.transaction_price, record.transaction_volume or 0, record.mask & 3)
+            if closed is not None:
+                yield closed
+    else:
+        for batch in parser.read_trades_columnar(batch_size):
+            #values are MISSING_I8 till first ones, presence is kept by decoder
+            if batch['timestamp'][0] == MISSING_I8 or batch['price'][0] == MISSING_I8:
+                batch = batch[(batch['timestamp'] != MISSING_I8) &\
+                    (batch['price'] != MISSING_I8)]
+            if len(batch):
+                yield from aggregator.update_batch(batch['timestamp'], batch['price'],\
+                    batch['volume'], batch['side'])
+
+    last = aggregator.flush()
+    if last is not None:
+        yield last
+
+
+class TestBars(unittest.TestCase):
+    """
+    bars tests
+    """
+    def setUp(self):
+        """
+        bundled trades
+        """
+        self.path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        qsh = QSHParser(self.path)
+        qsh.touch()
+        self.trades = [(record.time_ms - EPOCH_MS - qsh._offset_ms,\
+            record.transaction_price, record.transaction_volume, record.mask & 3)\
+            for record in qsh.iter_records()]
+
+    def _etalon(self, by, size):
+        """
+        bars by one trade updates
+        """
+        aggregator = BarAggregator(by, size, profile=True)
+        out = [aggregator.update(*trade) for trade in self.trades]
+        return [bar.data for bar in out if bar is not None] + [aggregator.flush().data]
+
+    @unittest.skipIf(np is None, 'numpy is required')
+    def test_batches(self):
+        """
+        vectorized bars across batches are the same as one by one
+        """
+        for by, size in [('time', 60000), ('trades', 100), ('volume', 5000)]:
+            bars = [bar.data for bar in iter_bars(QSHParser(self.path), by, size,\
+                profile=True, batch_size=1000)]
+            self.assertListEqual(bars, self._etalon(by, size))
+
+    def test_bar(self):
+        """
+        bar values
+        """
+        bars = self._etalon('trades', 100)
+        self.assertEqual(sum(bar['trades'] for bar in bars), len(self.trades))
+        self.assertEqual(bars[0]['volume'], sum(trade[2] for trade in self.trades[:100]))
+        self.assertEqual(bars[0]['high'], max(trade[1] for trade in self.trades[:100]))
+        self.assertEqual(sum(sum(level) for level in bars[0]['profile'].values()),\
+            bars[0]['volume'])
+        self.assertEqual(bars[0]['side_volume']['ASK'], sum(trade[2] for trade in\
+            self.trades[:100] if trade[3] == 1))
+        self.assertAlmostEqual(bars[0]['vwap'], sum(trade[1] * trade[2] for trade in\
+            self.trades[:100]) / bars[0]['volume'])
+
+    def test_no_numpy(self):
+        """
+        bars without numpy are the same
+        """
+        from unittest import mock
+        with mock.patch(__name__ + '.np', None):
+            bars = [bar.data for bar in iter_bars(QSHParser(self.path), 'trades', 100,\
+                profile=True)]
+        self.assertListEqual(bars, self._etalon('trades', 100))
+
+    def test_missing(self):
+        """
+        trades before first price or exchange time are skipped
+        with and without numpy
+        """
+        import tempfile
+        from unittest import mock
+        from qsh_writer import QSHWriter
+
+        start = self.trades[0][0]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trades.qsh')
+            with QSHWriter(path, [('Deals', 'TEST')], start) as writer:
+                writer.write_trade(start, volume=5)
+                writer.write_trade(start + 5, 14990, 1, 'ASK')
+                writer.write_trade(start + 10, 15000, 3, 'ASK', start + 10)
+                writer.write_trade(start + 20, 15010, 2, 'BID', start + 20)
+            for numpy in [np, None]:
+                with mock.patch(__name__ + '.np', numpy):
+                    bars = list(iter_bars(QSHParser(path), 'time', 60000, batch_size=3))
+                self.assertEqual(len(bars), 1)
+                self.assertEqual((bars[0].first_ms, bars[0].trades, bars[0].volume,\
+                    bars[0].open, bars[0].close), (start + 10, 2, 5, 15000, 15010))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,391 @@
+"""
+    Замеры скорости и памяти разбора на файлах из 20150302.
+
+    Для каждого замера (case) считаются: записей в секунду, МБ в секунду,
+    процентили задержки на запись (по единицам замера - кадр или пачка,
+    деленным на число записей в ней) и пиковая память процесса (RSS).
+    Каждый замер выполняется в отдельном процессе (spawn), чтобы пиковая
+    память не накапливалась между замерами. Повторы - лучший по времени.
+
+    Масштабирование: файл копируется со всеми кадрами, повторенными
+    scale раз (значения в кадрах - приращения, поэтому файл остается
+    корректным, только цены и время продолжают расти).
+
+    Результаты сохраняются в json, режим сравнения отмечает регрессии:
+    падение скорости, рост задержки p50 или памяти больше порога.
+
+        python qsh_bench.py --run [out_json] [scale] [cases] [repeat]
+        python qsh_bench.py --compare baseline_json [scale] [threshold] [cases]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import unittest
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from leb_128 import Uleb128, Sleb128
+from qsh_parser import QSHParser, np
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+FILES = {'trades': 'GAZP.Qscalp.Trades.2015-03-02.qsh',\
+    'quotes': 'GAZP.Qscalp.Quotes.2015-03-02.qsh'}
+
+#метрики сравнения: имя -> True, если больше - лучше
+METRICS = {'records_per_s': True, 'p50_us': False, 'peak_rss_kb': False}
+
+#значений leb128 в синтетическом буфере при scale 1
+LEB_VALUES = 1 << 20
+
+
+def _leb_buffer(scale):
+    """
+    uleb and sleb values of typical deltas as one buffer
+    """
+    uleb, sleb = Uleb128(4), Sleb128(8)
+    rnd = random.Random(42)
+    out = bytearray()
+    for _ in range(LEB_VALUES // 2):
+        out += uleb.encode_minimal(rnd.getrandbits(rnd.choice([6, 13, 20])))
+        out += sleb.encode_minimal(rnd.randint(-5000, 5000))
+    return bytes(out) * scale
+
+
+def case_leb128(path, scale=1):
+    """
+    raw decode_from_buffer of uleb and sleb pairs
+    """
+    buf = _leb_buffer(scale)
+    yield 0, len(buf)
+    uleb = Uleb128(4).decode_from_buffer
+    sleb = Sleb128(8).decode_from_buffer
+    offset, end = 0, len(buf)
+    while offset < end:
+        for _ in range(2048):
+            _, offset = uleb(buf, offset)
+            _, offset = sleb(buf, offset)
+        yield 4096, 0
+
+
+def case_iterate(path, scale=1):
+    """
+    QSHParser iteration, frame dicts with datetime
+    """
+    qsh = QSHParser(path)
+    qsh.touch()
+    for _ in qsh:
+        yield 1, 0
+
+
+def case_records(path, scale=1):
+    """
+    QSHParser.iter_records with reused record
+    """
+    qsh = QSHParser(path)
+    qsh.touch()
+    for _ in qsh.iter_records(reuse=True):
+        yield 1, 0
+
+
+def case_json(path, scale=1):
+    """
+    --read_file output (_read_mode): json line per frame to /dev/null
+    """
+    from qsh_export import JsonLinesWriter
+    qsh = QSHParser(path)
+    qsh.touch()
+    frames = iter(qsh)
+    with JsonLinesWriter(os.devnull) as writer:
+        writer.write_text(str(qsh) + '\n\n' + '-'*50 + '\n\n')
+        while True:
+            written = writer.write_many(frame for _, frame in zip(range(256), frames))
+            if not written:
+                return
+            yield written, 0
+
+
+def case_columnar(path, scale=1):
+    """
+    read_trades_columnar or read_stocks_columnar by batches of 4096
+    """
+    qsh = QSHParser(path)
+    qsh.touch()
+    if 'Trades' in os.path.basename(path):
+        for batch in qsh.read_trades_columnar(4096):
+            yield len(batch), 0
+    else:
+        for batch in qsh.read_stocks_columnar(4096):
+            yield len(batch['timestamp']), 0
+
+
+CASES = {'leb128': (case_leb128, None),\
+    'iterate_trades': (case_iterate, 'trades'), 'iterate_quotes': (case_iterate, 'quotes'),\
+    'records_trades': (case_records, 'trades'), 'records_quotes': (case_records, 'quotes'),\
+    'json_trades': (case_json, 'trades'), 'json_quotes': (case_json, 'quotes'),\
+    'columnar_trades': (case_columnar, 'trades'), 'columnar_quotes': (case_columnar, 'quotes')}
+
+
+def scale_file(path, scale, out_dir):
+    """
+    Copy of qsh file with frames repeated scale times
+    return: path of copy
+    """
+    qsh = QSHParser(path)
+    qsh.touch()
+    header_size = qsh._io_stream.tell()
+    qsh._io_stream.close()
+
+    out_path = os.path.join(out_dir, '{}x{}'.format(scale, os.path.basename(path)))
+    with open(path, 'rb') as src, open(out_path, 'wb') as out:
+        out.write(src.read(header_size))
+        frames = src.read()
+        for _ in range(scale):
+            out.write(frames)
+    return out_path
+
+
+def _peak_rss_kb():
+    """
+    peak resident memory of process in KiB, None if it is unknown
+    """
+    if resource is None:
+        return None
+    out = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return out // 1024 if sys.platform == 'darwin' else out
+
+
+def _percentile_us(values, share):
+    """
+    nearest rank percentile of sorted nanoseconds in microseconds
+    """
+    if not values:
+        return None
+    return values[min(int(share * len(values)), len(values) - 1)] / 1000
+
+
+def measure(name, path=None, scale=1):
+    """
+    Run case once in this process
+    return: dict of metrics
+    """
+    function = CASES[name][0]
+    rss_before = _peak_rss_kb()
+    latencies = []
+    records = 0
+    size = os.path.getsize(path) if path else 0
+
+    clock = time.perf_counter_ns
+    units = function(path, scale)
+    began = last = clock()
+    for count, extra_bytes in units:
+        now = clock()
+        if count:
+            records += count
+            latencies.append((now - last) / count)
+        else:
+            #preparation, it is not measured
+            size += extra_bytes
+            began = now
+        last = clock()
+    elapsed = max(last - began, 1) / 1e9
+
+    latencies.sort()
+    peak = _peak_rss_kb()
+    return {'records': records, 'bytes': size, 'seconds': elapsed,\
+        'records_per_s': records / elapsed, 'mb_per_s': size / elapsed / (1 << 20),\
+        'p50_us': _percentile_us(latencies, 0.5), 'p90_us': _percentile_us(latencies, 0.9),\
+        'p99_us': _percentile_us(latencies, 0.99), 'max_us': _percentile_us(latencies, 1),\
+        'peak_rss_kb': peak, 'rss_growth_kb': peak - rss_before if peak else None}
+
+
+def run(cases=None, scale=1, repeat=3, isolate=True):
+    """
+    Run cases on bundled files, scaled copies are made in temp directory
+    cases: case names, all by default
+    repeat: runs of each case, the fastest one is kept
+    isolate: every run in fresh spawned process for clean peak memory
+    return: dict of meta and results
+    """
+    cases = cases or list(CASES)
+    for name in cases:
+        if name not in CASES:
+            msg = 'Unknown case {}, use some of {}'.format(name, list(CASES))
+            raise ValueError(msg)
+
+    tmp = tempfile.mkdtemp(prefix='qsh-bench-') if scale > 1 else None
+    try:
+        paths = {kind: os.path.join(SOURCE, name) for kind, name in FILES.items()}
+        if tmp:
+            paths = {kind: scale_file(path, scale, tmp) for kind, path in paths.items()}
+
+        results = {}
+        context = multiprocessing.get_context('spawn')
+        for name in cases:
+            kind = CASES[name][1]
+            args = (name, paths[kind] if kind else None, scale)
+            runs = []
+            for _ in range(max(repeat, 1)):
+                if isolate:
+                    with context.Pool(1) as pool:
+                        runs.append(pool.apply(measure, args))
+                else:
+                    runs.append(measure(*args))
+            results[name] = min(runs, key=lambda item: item['seconds'])
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    meta = {'scale': scale, 'repeat': repeat, 'python': platform.python_version(),\
+        'implementation': platform.python_implementation(), 'machine': platform.machine(),\
+        'system': platform.system(), 'cpus': os.cpu_count(),\
+        'numpy': np and np.__version__, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Regressions of current results against baseline
+    threshold: allowed relative change
+    return: list of (case, metric, baseline value, current value)
+    """
+    out = []
+    for name, metrics in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for metric, higher_better in METRICS.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_better and change < -threshold) or\
+                (not higher_better and change > threshold):
+                out.append((name, metric, old, new))
+    return out
+
+
+def format_results(data, baseline=None):
+    """
+    results table text
+    """
+    lines = ['{:<16}{:>12}{:>14}{:>9}{:>9}{:>9}{:>9}{:>11}'.format('case', 'records',\
+        'records/s', 'MB/s', 'p50 us', 'p99 us', 'max us', 'rss KiB')]
+    for name, item in data['results'].items():
+        line = '{:<16}{:>12}{:>14.0f}{:>9.2f}{:>9.2f}{:>9.2f}{:>9.0f}{:>11}'.format(name,\
+            item['records'], item['records_per_s'], item['mb_per_s'], item['p50_us'] or 0,\
+            item['p99_us'] or 0, item['max_us'] or 0, item['peak_rss_kb'] or '-')
+        base = baseline and baseline['results'].get(name)
+        if base:
+            line += '  {:+.1%}'.format(item['records_per_s'] / base['records_per_s'] - 1)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _run_mode(out_json=None, scale=1, cases=None, repeat=3):
+    """
+    run and save results
+    """
+    data = run(cases and cases.split(','), int(scale), int(repeat))
+    print(format_results(data))
+    if out_json and out_json != '-':
+        with open(out_json, 'w') as out:
+            json.dump(data, out, indent=2)
+
+def _compare_mode(baseline_json, scale=None, threshold=0.1, cases=None):
+    """
+    run with baseline parameters and compare, exit code 1 on regression
+    """
+    with open(baseline_json) as src:
+        baseline = json.load(src)
+    scale = int(scale or baseline['meta']['scale'])
+    data = run(cases and cases.split(',') or list(baseline['results']), scale,\
+        baseline['meta']['repeat'])
+    print(format_results(data, baseline))
+
+    regressions = compare(data, baseline, float(threshold))
+    for name, metric, old, new in regressions:
+        print('REGRESSION {} {}: {:.2f} -> {:.2f}'.format(name, metric, old, new))
+    sys.exit(1 if regressions else 0)
+
+
+class TestBench(unittest.TestCase):
+    """
+    benchmark tests
+    """
+    def test_scale(self):
+        """
+        scaled file has all frames repeated
+        """
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(SOURCE, FILES['trades'])
+            scaled = QSHParser(scale_file(path, 3, tmp))
+            scaled.touch()
+            etalon = QSHParser(path)
+            etalon.touch()
+            self.assertEqual(len(list(scaled.iter_records())),\
+                3 * len(list(etalon.iter_records())))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_measure(self):
+        """
+        metrics of one case in process
+        """
+        data = run(['records_trades'], repeat=1, isolate=False)
+        item = data['results']['records_trades']
+        self.assertEqual(item['records'], 41425)
+        self.assertEqual(item['bytes'], os.path.getsize(os.path.join(SOURCE, FILES['trades'])))
+        self.assertLessEqual(item['p50_us'], item['p99_us'])
+        self.assertGreater(item['records_per_s'], 0)
+        self.assertIn('records_trades', format_results(data))
+
+    def test_compare(self):
+        """
+        slower, higher latency or bigger memory is regression
+        """
+        base = {'results': {'a': {'records_per_s': 100.0, 'p50_us': 1.0, 'peak_rss_kb': 1000}}}
+        same = {'results': {'a': {'records_per_s': 95.0, 'p50_us': 1.05, 'peak_rss_kb': 1050}}}
+        worse = {'results': {'a': {'records_per_s': 80.0, 'p50_us': 1.0, 'peak_rss_kb': 2000},\
+            'b': {'records_per_s': 1.0}}}
+        self.assertListEqual(compare(same, base), [])
+        self.assertListEqual(compare(worse, base), [('a', 'records_per_s', 100.0, 80.0),\
+            ('a', 'peak_rss_kb', 1000, 2000)])
+
+
+def _if__name__is__main():
+    """
+    main func
+    """
+    arg = sys.argv
+    help_msg = """Input next arguments:\n
+        --run_self_test - for run unittests;\n
+        --run [out_json|-] [scale] [case,case] [repeat] - for run benchmarks,
+            scale - frames of bundled files are repeated scale times;\n
+        --compare baseline_json [scale] [threshold] [case,case] - for run and
+            compare with baseline, exit code is 1 on regression.\n
+        Cases: {}\n""".format(', '.join(CASES))
+
+    if len(arg) == 1:
+        print(help_msg)
+    elif '--run_self_test' in arg[1]:
+        unittest.main(argv=arg[:1])
+    elif '--run' in arg[1]:
+        _run_mode(*arg[2:6])
+    elif '--compare' in arg[1]:
+        _compare_mode(*arg[2:6])
+    else:
+        print(help_msg)
+
+
+if __name__ == "__main__":
+    _if__name__is__main()
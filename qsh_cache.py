@@ -0,0 +1,277 @@
+"""
+    Кэш разобранных файлов qsh на диске.
+
+    Колонки файла (QSHParser.read_columns) сохраняются в каталоге кэша
+    файлами .npy, повторное открытие того же файла отображает их в память
+    (np.load с mmap_mode) вместо разбора. Ключ - путь, размер и время
+    изменения файла, он считается без чтения файла. Хеш содержимого
+    считается один раз при сохранении и хранится в meta.json, get с
+    verify=True сверяет его с файлом. При превышении размера кэша удаляются
+    записи, к которым дольше всего не обращались (LRU).
+"""
+import os
+import json
+import shutil
+import hashlib
+import unittest
+
+from qsh_parser import QSHParser, np
+
+
+class DecodeCache:
+    """
+    Directory of decoded files, one subdirectory per file:
+        <key>/<column>.npy - column arrays,
+        <key>/meta.json - stream info, its mtime is the last use time.
+    """
+    _version = 3
+    _meta = 'meta.json'
+
+    def __init__(self, cache_dir=None, max_bytes=4 << 30):
+        """
+        cache_dir: cache directory, QSH_CACHE_DIR or ~/.cache/qsh by default
+        max_bytes: total size of cache, least recently used entries
+            are removed above it
+        """
+        if np is None:
+            raise ImportError('numpy is required for decode cache')
+
+        self.cache_dir = cache_dir or os.environ.get('QSH_CACHE_DIR') or\
+            os.path.join(os.path.expanduser('~'), '.cache', 'qsh')
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, path):
+        """
+        Cache key of file: hash of path, size and mtime, file is not read
+        """
+        _stat = os.stat(path)
+        _hash = hashlib.blake2b(digest_size=20)
+        _hash.update('{}:{}:{}:{}'.format(self._version, os.path.abspath(path),\
+            _stat.st_size, _stat.st_mtime_ns).encode())
+        return _hash.hexdigest()
+
+    @staticmethod
+    def content_hash(path):
+        """
+        hash of file content
+        """
+        _hash = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as src:
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                _hash.update(chunk)
+        return _hash.hexdigest()
+
+    def get(self, path, backend='file', verify=False):
+        """
+        Columns of file: memory mapped from cache, decoded and stored on miss
+        verify: compare content hash of file with stored one, entry of
+            changed file (e.g. with restored mtime) is decoded again
+        return: dict of numpy arrays (read only memmap)
+        """
+        key = self.key(path)
+        if verify:
+            meta = self.meta(key)
+            if meta is not None and meta.get('content_hash') != self.content_hash(path):
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+        out = self.load(key)
+        if out is not None:
+            return out
+
+        qsh = QSHParser(path, backend)
+        qsh.touch()
+        meta = {'version': self._version, 'source': os.path.abspath(path),\
+            'stream': qsh._stream.data, 'frames': None,\
+            'content_hash': self.content_hash(path)}
+        columns = qsh.read_columns()
+        meta['frames'] = qsh._frame_count
+
+        self.store(key, columns, meta)
+        return self.load(key) or columns
+
+    def meta(self, key):
+        """
+        meta.json of entry, None if it is absent
+        """
+        try:
+            with open(os.path.join(self.cache_dir, key, self._meta)) as src:
+                return json.load(src)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, key):
+        """
+        Memory map entry and mark it as used, None if it is absent
+        """
+        entry = os.path.join(self.cache_dir, key)
+        meta = self.meta(key)
+        try:
+            out = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')\
+                for name in meta['columns']}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        try:
+            os.utime(os.path.join(entry, self._meta))
+        except OSError:
+            pass
+        return out
+
+    def store(self, key, columns, meta):
+        """
+        Write entry atomically and evict old entries
+        """
+        entry = os.path.join(self.cache_dir, key)
+        tmp = os.path.join(self.cache_dir, '.tmp-{}-{}'.format(key, os.getpid()))
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            for name, column in columns.items():
+                np.save(os.path.join(tmp, name + '.npy'), column, allow_pickle=False)
+            meta = dict(meta, columns=list(columns))
+            with open(os.path.join(tmp, self._meta), 'w') as out:
+                json.dump(meta, out)
+            os.rename(tmp, entry)
+        except OSError:
+            #other process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Cache entries, least recently used first
+        return: list of (last use time, size in bytes, key)
+        """
+        out = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                used = os.stat(os.path.join(entry, self._meta)).st_mtime
+                size = sum(item.stat().st_size for item in os.scandir(entry))
+            except OSError:
+                continue
+            out.append((used, size, key))
+        return sorted(out)
+
+    @property
+    def size(self):
+        """
+        total size of entries
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries above max_bytes
+        keep: key that is not removed
+        return: removed keys
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        """
+        remove all entries
+        """
+        for _, _, key in self.entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+
+@unittest.skipIf(np is None, 'numpy is required')
+class TestDecodeCache(unittest.TestCase):
+    """
+    decode cache tests
+    """
+    def setUp(self):
+        """
+        temporary cache
+        """
+        import tempfile
+        self.source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        remove cache
+        """
+        shutil.rmtree(self.cache_dir)
+
+    def test_hit(self):
+        """
+        second read is memory mapped and equal to decoded one
+        """
+        cache = DecodeCache(self.cache_dir)
+        path = os.path.join(self.source, 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        first = QSHParser(path).read_columns(cache)
+        second = QSHParser(path).read_columns(self.cache_dir)
+
+        self.assertIsInstance(second['trades'], np.memmap)
+        self.assertEqual(len(second['trades']), 41425)
+        self.assertTrue(np.array_equal(first['trades'], second['trades']))
+        self.assertTrue(np.array_equal(QSHParser(path).read_columns()['trades'],\
+            second['trades']))
+        self.assertEqual(len(cache.entries()), 1)
+
+    def test_lru(self):
+        """
+        least recently used entry is removed
+        """
+        cache = DecodeCache(self.cache_dir)
+        trades = os.path.join(self.source, 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        quotes = os.path.join(self.source, 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+        cache.get(trades)
+        trades_size = cache.size
+
+        os.utime(os.path.join(self.cache_dir, cache.key(trades), 'meta.json'), (0, 0))
+        cache.max_bytes = trades_size + 1
+        cache.get(quotes)
+        self.assertListEqual([key for _, _, key in cache.entries()], [cache.key(quotes)])
+
+    def test_verify(self):
+        """
+        content hash is stored once, file changed with the same size and
+        mtime is decoded again only with verify
+        """
+        from qsh_writer import QSHWriter
+        path = os.path.join(self.cache_dir, 'file.qsh')
+        start = 1425279600000
+
+        def write(price):
+            with QSHWriter(path, [('Deals', 'A')], start) as writer:
+                writer.write_trade(start, price, 1, 'ASK', start)
+            os.utime(path, ns=(0, 0))
+
+        cache = DecodeCache(os.path.join(self.cache_dir, 'cache'))
+        write(15000)
+        key = cache.key(path)
+        self.assertListEqual(cache.get(path)['trades']['price'].tolist(), [15000])
+        self.assertEqual(cache.meta(key)['content_hash'], DecodeCache.content_hash(path))
+
+        write(15001)
+        self.assertEqual(cache.key(path), key)
+        self.assertListEqual(cache.get(path)['trades']['price'].tolist(), [15000])
+        self.assertListEqual(cache.get(path, verify=True)['trades']['price'].tolist(),\
+            [15001])
+        self.assertEqual(cache.meta(key)['content_hash'], DecodeCache.content_hash(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,472 @@
+"""
+    Вывод разобранных кадров qsh.
+
+    JsonLinesWriter - поток JSON Lines: записи кодируются без промежуточных
+    копий словарей, строки копятся в буфере и пишутся крупными блоками
+    одним вызовом write(). По умолчанию записи кодируются C-кодировщиком
+    стандартного json в формате QSHParser.frame_to_json, orjson (если
+    установлен) включается явно - encoder='orjson' или 'auto'.
+
+    write_parquet - перевод файла в Parquet (нужен pyarrow): файл
+    разбирается колоночным чтением, каждая пачка записывается отдельной
+    группой строк, память ограничена размером пачки.
+"""
+import os
+import sys
+import json
+import unittest
+from datetime import datetime, date
+from functools import partial
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from qsh_parser import QSHParser, Trades, Stocks, FileSignatureError, MISSING_I8, np
+
+TRADE_SIDES = ['UNKNOWN', 'ASK', 'BID']
+#объем > 0 - продажа, < 0 - покупка, 0 - уровень удален
+QUOTE_SIDES = ['REMOVE', 'ASK', 'BID']
+
+
+def _json_default(value):
+    """
+    json representation of non standard types
+    """
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    msg = 'Object of type {} is not JSON serializable'.format(type(value).__name__)
+    raise TypeError(msg)
+
+
+class JsonLinesWriter:
+    """
+    Buffered JSON Lines writer
+    """
+    _encoders = ['auto', 'orjson', 'json']
+
+    def __init__(self, out=None, buffer_size=1 << 20, encoder='json'):
+        """
+        out: path, binary file object or None for stdout
+        buffer_size: bytes collected before one write call
+        encoder: json - stdlib json with the same format as
+            QSHParser.frame_to_json, orjson - compact orjson format,
+            auto - orjson if installed, json otherwise
+        """
+        if encoder not in self._encoders:
+            msg = 'Unknown encoder {}, use one of {}'.format(encoder, self._encoders)
+            raise ValueError(msg)
+
+        if encoder == 'orjson' and orjson is None:
+            msg = 'orjson is not installed'
+            raise ImportError(msg)
+
+        if out is None or out == '-':
+            self._out = sys.stdout.buffer
+            self._own = False
+        elif isinstance(out, (str, bytes, os.PathLike)):
+            self._out = open(out, 'wb')
+            self._own = True
+        else:
+            self._out = out
+            self._own = False
+
+        self._buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+        self.records = 0
+
+        if orjson is not None and encoder != 'json':
+            self._encode = self._encode_orjson
+        else:
+            self._encode = json.JSONEncoder(default=_json_default).encode
+
+    @staticmethod
+    def _encode_orjson(data):
+        """
+        one record by orjson
+        """
+        return orjson.dumps(data, default=_json_default,\
+            option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+
+    def write_text(self, text):
+        """
+        Add raw text (header, separators) to buffer
+        """
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self._buffer_size:
+            self.flush(False)
+
+    def write(self, data):
+        """
+        Add one record as json line
+        """
+        line = self._encode(data)
+        self._parts.append(line)
+        self._parts.append('\n')
+        self._size += len(line) + 1
+        self.records += 1
+        if self._size >= self._buffer_size:
+            self.flush(False)
+
+    def write_many(self, records):
+        """
+        Add records from iterable
+        return: records number written
+        """
+        encode = self._encode
+        parts = self._parts
+        size = self._size
+        written = 0
+
+        for data in records:
+            line = encode(data)
+            parts.append(line)
+            parts.append('\n')
+            size += len(line) + 1
+            written += 1
+            if size >= self._buffer_size:
+                self._size = size
+                self.flush(False)
+                parts = self._parts
+                size = 0
+
+        self._size = size
+        self.records += written
+        return written
+
+    def flush(self, flush_out=True):
+        """
+        Write buffer to output
+        flush_out: flush output object too
+        """
+        if self._parts:
+            self._out.write(''.join(self._parts).encode('utf-8'))
+            self._parts = []
+            self._size = 0
+        if flush_out:
+            self._out.flush()
+
+    def close(self):
+        """
+        flush and close owned file
+        """
+        self.flush()
+        if self._own:
+            self._out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_json_lines(path, out=None, timestamps='datetime', encoder='json',\
+    header=True):
+    """
+    Write file as --read_file text: header and json line per frame
+    path: qsh file
+    out, encoder: see JsonLinesWriter
+    header: write file header before frames
+    return: frames number
+    """
+    qsh = QSHParser(path, timestamps=timestamps)
+    qsh.touch()
+    with JsonLinesWriter(out, encoder=encoder) as writer:
+        if header:
+            writer.write_text(str(qsh) + '\n\n' + '-'*50 + '\n\n')
+        return writer.write_many(qsh)
+
+
+def _parquet_schema(columns, metadata):
+    """
+    arrow schema of parquet file
+    columns: list of (name, arrow type) after timestamp and instrument
+    """
+    _fields = [('timestamp', pa.timestamp('ms', tz='UTC')),\
+        ('instrument', pa.dictionary(pa.int8(), pa.string()))] + columns
+    return pa.schema(_fields, metadata=metadata)
+
+def _dictionary(indices, values):
+    """
+    dictionary encoded column from numpy indices
+    """
+    return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int8()),\
+        pa.array(values, type=pa.string()))
+
+def _trades_tables(qsh, schema, batch_size):
+    """
+    Trades batches as arrow tables
+    """
+    _tool = [schema.metadata[b'qsh.tool'].decode()]
+    for batch in qsh.read_trades_columnar(batch_size):
+        yield pa.Table.from_arrays([pa.array(batch['timestamp'], type=pa.timestamp('ms', tz='UTC'),\
+            mask=batch['timestamp'] == MISSING_I8),\
+            _dictionary(np.zeros(len(batch), dtype='i1'), _tool),\
+            pa.array(batch['trade_number']), pa.array(batch['order_id']),\
+            pa.array(batch['price'], mask=batch['price'] == MISSING_I8), pa.array(batch['volume']),\
+            pa.array(batch['open_interest']), _dictionary(batch['side'], TRADE_SIDES),\
+            pa.array(batch['mask'])], schema=schema)
+
+def _stocks_tables(qsh, schema, batch_size):
+    """
+    Order book batches as arrow tables, one row per quote
+    """
+    _tool = [schema.metadata[b'qsh.tool'].decode()]
+    for batch in qsh.read_stocks_columnar(batch_size):
+        volume = batch['volume']
+        side = np.where(volume > 0, 1, np.where(volume < 0, 2, 0)).astype('i1')
+        timestamp = np.repeat(batch['timestamp'], np.diff(batch['offsets']))
+        yield pa.Table.from_arrays([pa.array(timestamp, type=pa.timestamp('ms', tz='UTC')),\
+            _dictionary(np.zeros(len(volume), dtype='i1'), _tool),\
+            pa.array(batch['frame_index']), pa.array(batch['price']),\
+            pa.array(volume), _dictionary(side, QUOTE_SIDES)], schema=schema)
+
+def write_parquet(path, out_dir, batch_size=65536, compression='zstd'):
+    """
+    Convert qsh file into parquet file, one row group per batch
+    Trades columns: timestamp (exchange time), instrument, trade_number,
+        order_id, price, volume, open_interest, side, mask - see
+        QSHParser.read_trades_columnar, MISSING_I8 timestamp and price are null.
+    Stock columns: timestamp (frame time), instrument, frame_index, price,
+        volume (signed as in file), side - one row per quote delta.
+    Stream instrument (Stream._tool) and header are in schema metadata.
+    path: qsh file
+    out_dir: output directory, file name is qsh file name with .parquet
+    batch_size: rows (trades) or frames (quotes) in row group
+    return: parquet file path
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required for parquet export')
+
+    qsh = QSHParser(path)
+    try:
+        qsh.touch()
+        _header = qsh._header.data
+        _stream = qsh._stream.data
+        metadata = {'qsh.tool': _stream['tool'], 'qsh.stream': _stream['type'],\
+            'qsh.app_name': _header['app_name'], 'qsh.user_comment': _header['user_comment'],\
+            'qsh.record_start_time': _header['record_start_time'].isoformat(),\
+            'qsh.source': os.path.basename(path)}
+
+        if isinstance(qsh._pyload, Trades):
+            schema = _parquet_schema([('trade_number', pa.int64()), ('order_id', pa.int64()),\
+                ('price', pa.int64()), ('volume', pa.int64()), ('open_interest', pa.int64()),\
+                ('side', pa.dictionary(pa.int8(), pa.string())), ('mask', pa.uint8())], metadata)
+            tables = _trades_tables(qsh, schema, batch_size)
+        elif isinstance(qsh._pyload, Stocks):
+            schema = _parquet_schema([('frame_index', pa.int64()), ('price', pa.int64()),\
+                ('volume', pa.int64()), ('side', pa.dictionary(pa.int8(), pa.string()))],\
+                metadata)
+            tables = _stocks_tables(qsh, schema, batch_size)
+        else:
+            msg = 'Unsupported stream {} for parquet export'.format(_stream['type'])
+            raise FileSignatureError(msg)
+
+        name = os.path.basename(path)
+        for ext in ['.gz', '.qsh']:
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+        out_path = os.path.join(out_dir, name + '.parquet')
+        tmp_path = out_path + '.tmp'
+
+        os.makedirs(out_dir, exist_ok=True)
+        try:
+            with pq.ParquetWriter(tmp_path, schema, compression=compression) as writer:
+                for table in tables:
+                    writer.write_table(table)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, out_path)
+    finally:
+        qsh._io_stream.close()
+    return out_path
+
+def to_parquet(source, out_dir, workers=None, batch_size=65536):
+    """
+    Convert many files in worker processes
+    source: file, directory or glob pattern, see qsh_pool.expand_paths
+    return: generator of (qsh path, parquet path) in files order
+    """
+    from qsh_pool import map_files
+    return map_files(partial(write_parquet, out_dir=out_dir, batch_size=batch_size),\
+        source, workers)
+
+
+class TestJsonLines(unittest.TestCase):
+    """
+    json lines writer tests
+    """
+    def setUp(self):
+        """
+        bundled files
+        """
+        self.source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+
+    def _etalon(self, path, frames):
+        """
+        frame_to_json lines of first frames
+        """
+        qsh = QSHParser(path)
+        qsh.touch()
+        out = []
+        for _ in range(frames):
+            qsh.read()
+            out.append(qsh.frame_to_json() + '\n')
+        qsh._io_stream.close()
+        return ''.join(out)
+
+    def test_same_as_frame_to_json(self):
+        """
+        default json encoder output is the same as frame_to_json
+        """
+        from io import BytesIO
+        for name in ['Trades', 'Quotes']:
+            path = os.path.join(self.source, 'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name))
+            qsh = QSHParser(path)
+            qsh.touch()
+            self.addCleanup(qsh._io_stream.close)
+            out = BytesIO()
+            writer = JsonLinesWriter(out, buffer_size=4096)
+            for _ in range(2000):
+                writer.write(qsh.read())
+            writer.flush()
+            self.assertEqual(writer.records, 2000)
+            self.assertEqual(out.getvalue().decode(), self._etalon(path, 2000))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_encoder(self):
+        """
+        orjson encoder gives the same records
+        """
+        from io import BytesIO
+        path = os.path.join(self.source, 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        qsh = QSHParser(path)
+        qsh.touch()
+        self.addCleanup(qsh._io_stream.close)
+        out = BytesIO()
+        with JsonLinesWriter(out, buffer_size=1000, encoder='orjson') as writer:
+            self.assertEqual(writer.write_many(qsh.read() for _ in range(500)), 500)
+
+        lines = out.getvalue().decode().splitlines()
+        etalon = self._etalon(path, 500).splitlines()
+        self.assertEqual(len(lines), 500)
+        for line, etalon_line in zip(lines, etalon):
+            self.assertDictEqual(json.loads(line), json.loads(etalon_line))
+
+
+@unittest.skipIf(pa is None or np is None, 'pyarrow and numpy are required')
+class TestParquet(unittest.TestCase):
+    """
+    parquet export tests
+    """
+    def setUp(self):
+        """
+        bundled files and output directory
+        """
+        import tempfile
+        self.source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        remove output
+        """
+        import shutil
+        shutil.rmtree(self.out_dir)
+
+    def test_trades(self):
+        """
+        columns are the same as columnar reading
+        """
+        path = os.path.join(self.source, 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        out_path = write_parquet(path, self.out_dir, batch_size=10000)
+        self.assertEqual(out_path, os.path.join(self.out_dir,\
+            'GAZP.Qscalp.Trades.2015-03-02.parquet'))
+
+        parquet = pq.ParquetFile(out_path)
+        self.assertEqual(parquet.metadata.num_row_groups, 5)
+        self.assertEqual(parquet.schema_arrow.metadata[b'qsh.tool'], b'SmartCOM:GAZP:::0.01')
+
+        qsh = QSHParser(path)
+        qsh.touch()
+        etalon = np.concatenate(list(qsh.read_trades_columnar()))
+        table = parquet.read()
+        for name in ['trade_number', 'order_id', 'price', 'volume', 'open_interest', 'mask']:
+            self.assertTrue(np.array_equal(table[name].to_numpy(), etalon[name]))
+        self.assertTrue(np.array_equal(table['timestamp'].cast('int64').to_numpy(),\
+            etalon['timestamp']))
+        self.assertListEqual(table['side'].to_pylist(),\
+            [TRADE_SIDES[side] for side in etalon['side'].tolist()])
+        self.assertEqual(set(table['instrument'].to_pylist()), {'SmartCOM:GAZP:::0.01'})
+
+    def test_missing(self):
+        """
+        timestamp and price before first value are null
+        """
+        from qsh_writer import QSHWriter
+        path = os.path.join(self.out_dir, 'missing.qsh')
+        start = 1425279600000
+        with QSHWriter(path, [('Deals', 'A')], start) as writer:
+            writer.write_trade(start, volume=5)
+            writer.write_trade(start + 10, 15000, 3, 'ASK', start + 10)
+
+        table = pq.read_table(write_parquet(path, self.out_dir))
+        self.assertListEqual(table['price'].to_pylist(), [None, 15000])
+        self.assertListEqual(table['timestamp'].cast('int64').to_pylist(), [None, start + 10])
+
+    def test_stream_closed(self):
+        """
+        file is closed when it is rejected
+        """
+        import gc
+        import warnings
+        from qsh_writer import QSHWriter
+        path = os.path.join(self.out_dir, 'multi.qsh')
+        start = 1425279600000
+        with QSHWriter(path, [('Stock', 'A'), ('Deals', 'A')], start) as writer:
+            writer.write_quotes(start, [15000], [3])
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            self.assertRaises(FileSignatureError, write_parquet, path, self.out_dir)
+            gc.collect()
+        self.assertFalse([item for item in caught if item.category is ResourceWarning])
+        self.assertListEqual(os.listdir(self.out_dir), ['multi.qsh'])
+
+    def test_quotes(self):
+        """
+        one row per quote of frames
+        """
+        path = os.path.join(self.source, 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+        table = pq.read_table(write_parquet(path, self.out_dir))
+
+        qsh = QSHParser(path)
+        qsh.touch()
+        rows = []
+        for _ in range(300):
+            data = qsh.read()
+            rows.extend((quote['rate'], quote['volume']) for quote in data['quotes'])
+        qsh._io_stream.close()
+
+        head = table.slice(0, len(rows))
+        self.assertListEqual(list(zip(head['price'].to_pylist(), head['volume'].to_pylist())),\
+            rows)
+        self.assertListEqual(head['side'].to_pylist(), [QUOTE_SIDES[1 if volume > 0 else\
+            (2 if volume < 0 else 0)] for _, volume in rows])
+        self.assertEqual(head['frame_index'][len(rows) - 1].as_py(), 299)
+
+
+if __name__ == "__main__":
+    unittest.main()
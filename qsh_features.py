@@ -0,0 +1,215 @@
+"""
+    Признаки стакана на равномерной сетке времени (например, каждые 100 мс)
+    по кадрам потока котировок (Stock).
+
+    Кадры читаются колоночно (QSHParser.read_stocks_columnar) и только
+    обновляют стакан (order_book.OrderBook), признаки считаются лишь
+    в точках сетки, одинаковые строки между кадрами размножаются numpy.
+    Значение в точке сетки t - состояние стакана после всех кадров
+    со временем <= t. Точки сетки кратны шагу от 1970-01-01 UTC, время -
+    миллисекунды unix epoch.
+
+    Признаки (K - число уровней):
+        time - точка сетки, i8;
+        bid, ask - лучшие цены, f8, NaN при пустой стороне;
+        bid_volume, ask_volume - объем лучших уровней, i8;
+        spread, mid - спред и середина, f8;
+        bid_depth, ask_depth - накопленный объем по K уровням, i8 (n, K);
+        imbalance - (bid_depth - ask_depth) / (bid_depth + ask_depth), f8 (n, K).
+"""
+import os
+import unittest
+from itertools import accumulate
+
+from qsh_parser import QSHParser, Stocks, FileSignatureError, np
+from order_book import OrderBook, iter_books
+
+FEATURES = ['time', 'bid', 'ask', 'bid_volume', 'ask_volume', 'spread', 'mid',\
+    'bid_depth', 'ask_depth', 'imbalance']
+
+
+def _row(book, levels):
+    """
+    bid, ask, bid volume, ask volume, cumulative depths of book
+    """
+    nan = float('nan')
+    bids, asks = book.top_n(levels)
+    out = [bids[0][0] if bids else nan, asks[0][0] if asks else nan,\
+        bids[0][1] if bids else 0, asks[0][1] if asks else 0]
+    for side in (bids, asks):
+        depth = list(accumulate(volume for _, volume in side))
+        out.extend(depth + [depth[-1] if depth else 0] * (levels - len(depth)))
+    return out
+
+
+def _chunk(rows, firsts, counts, step_ms, levels):
+    """
+    Feature arrays of runs of equal rows
+    """
+    counts = np.array(counts, dtype='i8')
+    total = int(counts.sum())
+    runs = np.repeat(np.array(rows, dtype='f8'), counts, axis=0)
+    _starts = np.repeat(np.cumsum(counts) - counts, counts)
+    time = np.repeat(np.array(firsts, dtype='i8'), counts) +\
+        (np.arange(total, dtype='i8') - _starts) * step_ms
+
+    bid_depth = np.ascontiguousarray(runs[:, 4:4 + levels], dtype='i8')
+    ask_depth = np.ascontiguousarray(runs[:, 4 + levels:], dtype='i8')
+    depth = bid_depth + ask_depth
+    imbalance = np.divide(bid_depth - ask_depth, depth, out=np.zeros(depth.shape),\
+        where=depth > 0)
+    bid = np.ascontiguousarray(runs[:, 0])
+    ask = np.ascontiguousarray(runs[:, 1])
+    return {'time': time, 'bid': bid, 'ask': ask,\
+        'bid_volume': runs[:, 2].astype('i8'), 'ask_volume': runs[:, 3].astype('i8'),\
+        'spread': ask - bid, 'mid': (ask + bid) / 2,\
+        'bid_depth': bid_depth, 'ask_depth': ask_depth, 'imbalance': imbalance}
+
+
+def iter_features(parser, step_ms=100, levels=5, start=None, end=None, batch_size=65536):
+    """
+    Book features on time grid by chunks
+    parser: QSHParser of Stock stream, touch is called if required
+    step_ms: grid step in milliseconds
+    levels: depth levels number K
+    start, end: grid range in epoch ms, by default from first to last frame
+    batch_size: frames number decoded at once
+    return: generator of dicts of numpy arrays, see FEATURES
+    """
+    if np is None:
+        raise ImportError('numpy is required for book features')
+
+    if step_ms <= 0 or levels <= 0:
+        msg = 'Grid step and levels should be positive, got {} and {}'.format(\
+            step_ms, levels)
+        raise ValueError(msg)
+
+    if parser._stream_dt is None:
+        parser.touch()
+
+    if not isinstance(parser._pyload, Stocks):
+        msg = 'File {} is not an order book stream'.format(parser._io_stream.name)
+        raise FileSignatureError(msg)
+
+    book = OrderBook()
+    apply = book.apply
+    #next grid point and last frame time
+    grid = None if start is None else -(-start // step_ms) * step_ms
+    last = None
+    rows, firsts, counts = [], [], []
+
+    batches = parser.read_stocks_columnar(batch_size)
+    for batch in batches:
+        offsets = batch['offsets'].tolist()
+        prices = batch['price'].tolist()
+        volumes = batch['volume'].tolist()
+
+        for i, timestamp in enumerate(batch['timestamp'].tolist()):
+            if end is not None and timestamp > end:
+                break
+            if grid is None:
+                grid = -(-timestamp // step_ms) * step_ms
+            elif timestamp > grid:
+                count = (timestamp - 1 - grid) // step_ms + 1
+                rows.append(_row(book, levels))
+                firsts.append(grid)
+                counts.append(count)
+                grid += count * step_ms
+            apply(prices[offsets[i]:offsets[i + 1]], volumes[offsets[i]:offsets[i + 1]],\
+                timestamp)
+            last = timestamp
+        else:
+            if rows:
+                yield _chunk(rows, firsts, counts, step_ms, levels)
+                rows, firsts, counts = [], [], []
+            continue
+        batches.close()
+        parser._io_stream.close()
+        break
+
+    limit = end if end is not None else last
+    if grid is not None and limit is not None and grid <= limit:
+        rows.append(_row(book, levels))
+        firsts.append(grid)
+        counts.append((limit - grid) // step_ms + 1)
+    if rows:
+        yield _chunk(rows, firsts, counts, step_ms, levels)
+
+
+def sample_book(parser, step_ms=100, levels=5, start=None, end=None, batch_size=65536):
+    """
+    Book features on time grid as contiguous arrays, see iter_features
+    return: dict of numpy arrays
+    """
+    chunks = list(iter_features(parser, step_ms, levels, start, end, batch_size))
+    if not chunks:
+        out = {name: np.empty(0, dtype='f8' if name in ['bid', 'ask', 'spread',\
+            'mid'] else 'i8') for name in FEATURES[:7]}
+        out.update({name: np.empty((0, levels), dtype='f8' if name == 'imbalance'\
+            else 'i8') for name in FEATURES[7:]})
+        return out
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in FEATURES}
+
+
+@unittest.skipIf(np is None, 'numpy is required')
+class TestFeatures(unittest.TestCase):
+    """
+    book features tests
+    """
+    def setUp(self):
+        """
+        bundled quotes
+        """
+        self.path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            '20150302', 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+
+    def test_grid(self):
+        """
+        features are equal to book state of last frame before grid point
+        """
+        states = []
+        parser = QSHParser(self.path)
+        self.addCleanup(parser._io_stream.close)
+        for book in iter_books(parser):
+            states.append((book.timestamp, _row(book, 3)))
+            if book.frames >= 3000:
+                break
+        start, end = states[0][0] - 250, states[-1][0] - 1
+
+        features = sample_book(QSHParser(self.path), 50, 3, start, end, batch_size=700)
+        self.assertEqual(features['time'][0], -(-start // 50) * 50)
+        self.assertTrue(np.all(np.diff(features['time']) == 50))
+        self.assertLessEqual(features['time'][-1], end)
+        self.assertTrue(features['bid_depth'].flags['C_CONTIGUOUS'])
+
+        index = -1
+        for i, point in enumerate(features['time'].tolist()):
+            while index + 1 < len(states) and states[index + 1][0] <= point:
+                index += 1
+            if index < 0:
+                self.assertTrue(np.isnan(features['bid'][i]))
+                self.assertEqual(features['bid_depth'][i].sum(), 0)
+                continue
+            row = states[index][1]
+            self.assertListEqual([features['bid'][i], features['ask'][i],\
+                features['bid_volume'][i], features['ask_volume'][i]], row[:4])
+            self.assertListEqual(features['bid_depth'][i].tolist(), row[4:7])
+            self.assertListEqual(features['ask_depth'][i].tolist(), row[7:])
+            self.assertAlmostEqual(features['imbalance'][i, 2],\
+                (row[6] - row[9]) / (row[6] + row[9]))
+        self.assertGreaterEqual(index, 2990)
+
+    def test_whole_file(self):
+        """
+        grid covers file, book is not crossed in main session
+        """
+        features = sample_book(QSHParser(self.path), 1000, 5)
+        self.assertGreater(len(features['time']), 30000)
+        self.assertTrue(np.all(features['spread'][:30000] > 0))
+        self.assertTrue(np.allclose(features['mid'] * 2, features['bid'] + features['ask'],\
+            equal_nan=True))
+        self.assertEqual(features['imbalance'].shape, (len(features['time']), 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+    Слияние многих файлов qsh в один поток, упорядоченный по времени кадра.
+
+    Слияние k-путевое по куче: в куче лежит по одному кадру от каждого
+    источника. Каждый источник разбирается пачками (упреждающее чтение),
+    размер пачек и буферов чтения файлов выбирается так, чтобы вся
+    буферизация укладывалась в заданный объем памяти.
+"""
+import os
+import heapq
+import unittest
+from datetime import datetime
+
+from qsh_parser import QSHParser, ByteCursor
+
+#оценка памяти на один разобранный кадр (словарь), байт
+FRAME_BYTES = 1024
+
+
+def iter_frames(parser, number=0, start=None, end=None, read_ahead=1):
+    """
+    Frames of one parser with epoch ms of frame time
+    parser: QSHParser, touch is called if required
+    number: source number in merged output
+    start, end: frame time range, see QSHParser.iter_range
+    read_ahead: frames decoded at once
+    return: generator of (time_ms, number, data)
+    """
+    if parser._stream_dt is None:
+        parser.touch()
+
+    _growing = parser._stream_dt._base
+    _frame_time = parser._frame_time
+    frames = parser.iter_range(start, end)
+
+    if read_ahead <= 1:
+        for data in frames:
+            yield _frame_time(_growing._last), number, data
+        return
+
+    while True:
+        chunk = []
+        for data in frames:
+            chunk.append((_frame_time(_growing._last), number, data))
+            if len(chunk) >= read_ahead:
+                break
+        if not chunk:
+            return
+        yield from chunk
+
+
+def buffer_sizes(sources, max_bytes, read_ahead=None):
+    """
+    Per source file read buffer size and read ahead frames number
+    for memory cap: half of source share is for file buffer (4 KiB - 1 MiB)
+    """
+    budget = max(max_bytes // sources, 1)
+    io_size = min(1 << 20, max(budget // 2, 1 << 12))
+    if read_ahead is None:
+        read_ahead = max((budget - io_size) // FRAME_BYTES, 1)
+    return io_size, read_ahead
+
+def merge(parsers, max_bytes=256 << 20, read_ahead=None, start=None, end=None):
+    """
+    One time ordered stream of frames of all parsers, frames with the same
+    time are ordered by source number
+    parsers: QSHParser list, source number is index in list
+    max_bytes: memory for buffering of all sources - file read buffers
+        and decoded frames (FRAME_BYTES per frame estimate)
+    read_ahead: frames decoded per source at once, by default it is
+        derived from max_bytes
+    start, end: frame time range, see QSHParser.iter_range
+    return: generator of (time_ms, source, data)
+    """
+    if not parsers:
+        return iter(())
+
+    io_size, read_ahead = buffer_sizes(len(parsers), max_bytes, read_ahead)
+    for parser in parsers:
+        _cursor = parser._io_stream
+        if type(_cursor) is ByteCursor and _cursor._chunk_size and\
+            _cursor._chunk_size > io_size:
+            #keep already buffered bytes, next reads use smaller blocks
+            _cursor._chunk_size = io_size
+
+    return heapq.merge(*[iter_frames(parser, number, start, end, read_ahead)\
+        for number, parser in enumerate(parsers)], key=lambda item: item[:2])
+
+
+class TestMerge(unittest.TestCase):
+    """
+    merge tests
+    """
+    def setUp(self):
+        """
+        bundled files
+        """
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+        self.paths = [os.path.join(source, 'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name))\
+            for name in ['Quotes', 'Trades']]
+
+    def _parser(self, path):
+        """
+        parser closed after test
+        """
+        parser = QSHParser(path)
+        self.addCleanup(parser._io_stream.close)
+        return parser
+
+    def test_merge(self):
+        """
+        merge is the same as sort of all frames
+        """
+        end = datetime(2015, 3, 2, 10, 30)
+        etalon = []
+        for number, path in enumerate(self.paths + self.paths[1:]):
+            etalon.extend(iter_frames(self._parser(path), number, end=end))
+        etalon.sort(key=lambda item: item[:2])
+
+        merged = list(merge([self._parser(path) for path in self.paths + self.paths[1:]],\
+            max_bytes=1 << 20, end=end))
+        self.assertGreater(len(merged), 10000)
+        self.assertListEqual(merged, etalon)
+
+    def test_memory(self):
+        """
+        small memory cap makes small buffers
+        """
+        self.assertEqual(buffer_sizes(2, 64 << 10), (16 << 10, 16))
+        self.assertEqual(buffer_sizes(1000, 256 << 20), (134217, 131))
+        self.assertEqual(buffer_sizes(10, 1 << 30), (1 << 20, 103833))
+
+        parsers = [self._parser(path) for path in self.paths]
+        frames = merge(parsers, max_bytes=64 << 10)
+        self.assertEqual(parsers[0]._io_stream._chunk_size, 16 << 10)
+        self.assertEqual(next(frames)[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
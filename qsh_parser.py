@@ -7,14 +7,49 @@
 import os
 import sys
 import json
+import mmap
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
 from  collections  import namedtuple
 import struct
 from datetime import datetime, timedelta, date
 import pytz
 from leb_128 import Uleb128, Sleb128
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 LOCAL_TZ = pytz.timezone('Europe/Moscow')
 
+#миллисекунд от 0001-01-01 до 1970-01-01
+EPOCH_MS = 62135596800000
+
+#timestamp и price сделок до первого появления поля в потоке: минимум int64,
+#как NaT у datetime64 (остальные поля до первого значения равны 0)
+MISSING_I8 = -(1 << 63)
+
+TRADES_DTYPE = [('timestamp', 'i8'), ('trade_number', 'i8'), ('order_id', 'i8'),\
+    ('price', 'i8'), ('volume', 'i8'), ('open_interest', 'i8'),\
+    ('side', 'i1'), ('mask', 'u1')]
+
+ORDLOG_DTYPE = [('timestamp', 'i8'), ('flags', 'i4'), ('order_id', 'i8'),\
+    ('price', 'i8'), ('amount', 'i8'), ('amount_rest', 'i8'), ('deal_id', 'i8'),\
+    ('deal_price', 'i8'), ('open_interest', 'i8'), ('mask', 'u1')]
+
+#флаги записи потока OrdLog
+ORDLOG_FLAGS = {'NonZeroReplAct': 1, 'FlowStart': 2, 'Add': 4, 'Fill': 8, 'Buy': 16,\
+    'Sell': 32, 'Snapshot': 64, 'Quote': 128, 'Counter': 256, 'NonSystem': 512,\
+    'EndOfTransaction': 1024, 'FillOrKill': 2048, 'Moved': 4096, 'Canceled': 8192,\
+    'CanceledGroup': 16384, 'CrossTrade': 32768}
+
+MESSAGE_TYPES = {1: 'INFO', 2: 'WARNING', 3: 'ERROR'}
+
+#типы потоков
+STREAM_TYPES = {16: 'Stock', 32: 'Deals', 80: 'Messages', 96: 'AuxInfo', 112: 'OrdLog'}
+
 class General(Exception):
     """
     general exceprion
@@ -44,38 +79,367 @@ class TouchMethodNoCall(General):
     def __init__(self, msg):
         super().__init__(msg)
 
-class BaseTypes:
+class ByteCursor:
     """
-    Base types - a don`t require to save condition
+    Read-only stream over one bytes buffer filled by large chunks.
+    All numbers are decoded from integer offset into the buffer, so
+    there are no per-value io calls.
     """
-    data_types = dict.fromkeys(\
-        ['_byte', '_uint16', '_uint32', '_int64', '_datetime', '_double'])
+    _leb_max_len = 16
+    _chunk_size = 1 << 20
 
-    def __init__(self):
+    _byte = struct.Struct('<B')
+    _int64 = struct.Struct('<q')
+    _double = struct.Struct('<d')
+
+    def __init__(self, raw, chunk_size=None):
+        """
+        raw: binary file like object
+        chunk_size: bytes number to read at once, 0 - read whole file
+        """
+        if chunk_size is not None:
+            self._chunk_size = chunk_size
+
+        self._raw = raw
+        self._buf = b''
+        self._base = 0
+        self._pos = 0
+        self._end = 0
+        self._eof = False
+        self._mark = None
+
+        self._uleb128 = Uleb128(4)
+        self._sleb128 = Sleb128(8)
+
+    @property
+    def name(self):
+        """
+        file name
+        """
+        return getattr(self._raw, 'name', None)
+
+    @property
+    def closed(self):
+        """
+        is raw stream closed
+        """
+        return self._raw.closed
+
+    def close(self):
+        """
+        close raw stream
+        """
+        self._raw.close()
+
+    def tell(self):
+        """
+        absolute cursor position
+        """
+        return self._base + self._pos
+
+    def seekable(self):
+        """
+        can cursor go back
+        """
+        return getattr(self._raw, 'seekable', lambda: False)()
+
+    def seek(self, offset):
+        """
+        Move cursor to absolute position, not seekable stream goes only forward
+        """
+        if self._base <= offset <= self._base + self._end:
+            self._pos = offset - self._base
+
+        elif self.seekable():
+            self._raw.seek(offset)
+            self._buf = b''
+            self._base = offset
+            self._pos = self._end = 0
+            self._eof = False
+
+        elif offset > self.tell():
+            while self.tell() < offset and \
+                self.read(min(offset - self.tell(), self._chunk_size or offset)):
+                pass
+
+        else:
+            msg = 'Can`t seek back to {} in {}'.format(offset, self.name)
+            raise General(msg)
+
+        return self.tell()
+
+    def mark(self):
+        """
+        Keep bytes from current position in buffer until unmark,
+        so seek back to it works for not seekable stream too
+        return: marked position
+        """
+        self._mark = self.tell()
+        return self._mark
+
+    def unmark(self):
+        """
+        Allow to drop marked bytes on next fill
+        """
+        self._mark = None
+
+    def _fill(self, size):
+        """
+        Move rest of buffer to begin and read next chunk
+        size: minimal bytes number required after cursor
+        """
+        if self._eof:
+            return
+
+        if self._chunk_size:
+            chunk = self._raw.read(max(size, self._chunk_size))
+        else:
+            chunk = self._raw.read()
+
+        if len(chunk) < size or not self._chunk_size:
+            self._eof = True
+
+        _keep = self._pos if self._mark is None else min(self._pos, self._mark - self._base)
+        self._base += _keep
+        self._buf = self._buf[_keep:self._end] + chunk
+        self._pos -= _keep
+        self._end = len(self._buf)
+
+    def _unpack(self, fmt):
+        """
+        Unpack fixed size value
+        """
+        if self._end - self._pos < fmt.size:
+            self._fill(fmt.size)
+
+        try:
+            out = fmt.unpack_from(self._buf, self._pos)[0]
+        except struct.error as excpt:
+            msg = \
+            'Got exception - {0}, details:\n\t- cursor position {1}\n;\t- file {2}'.\
+            format(excpt, self.tell(), self.name)
+            raise Exception(msg)
+
+        self._pos += fmt.size
+        return out
+
+    def read(self, size=-1):
+        """
+        Read bytes
+        """
+        if size < 0:
+            self._fill(0)
+            while not self._eof:
+                self._fill(self._end - self._pos + self._chunk_size)
+            size = self._end - self._pos
+
+        elif self._end - self._pos < size:
+            self._fill(size)
+
+        out = self._buf[self._pos:self._pos + size]
+        self._pos += len(out)
+        return out
+
+    def read_byte(self):
+        """
+        Read byte
+        """
+        return self._unpack(self._byte)
+
+    def read_int64(self):
+        """
+        Read int_64
+        """
+        return self._unpack(self._int64)
+
+    def read_double(self):
+        """
+        Read double
+        """
+        return self._unpack(self._double)
+
+    def read_uleb(self):
+        """
+        Read uleb 128
+        """
+        if self._end - self._pos < self._leb_max_len:
+            self._fill(self._leb_max_len)
+
+        out, self._pos = self._uleb128.decode_from_buffer(self._buf, self._pos)
+        return out
+
+    def read_sleb(self):
+        """
+        Read sleb 128
+        """
+        if self._end - self._pos < self._leb_max_len:
+            self._fill(self._leb_max_len)
+
+        out, self._pos = self._sleb128.decode_from_buffer(self._buf, self._pos)
+        return out
+
+    def read_string(self):
+        """
+        Read utf8 encoded byte array
+        """
+        return str(self.read(self.read_uleb()), 'utf-8')
+
+    def read_raw_string(self):
+        """
+        Read string bytes without decoding
+        """
+        return self.read(self.read_uleb())
+
+
+class MappedCursor(ByteCursor):
+    """
+    Cursor over memory mapped file - whole file is one buffer shared with
+    page cache, raw fields are returned as zero-copy memoryview slices
+    """
+    def __init__(self, raw):
+        """
+        raw: binary file object with fileno
+        """
+        super().__init__(raw, chunk_size=0)
+
+        if os.fstat(raw.fileno()).st_size == 0:
+            raw.close()
+            msg = 'Empty file {}'.format(self.name)
+            raise FileSignatureError(msg)
+
+        self._map = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._map)
+        self._end = len(self._buf)
+        self._eof = True
+
+    def close(self):
+        """
+        unmap file, if caller still keeps slices map is freed with them
+        """
+        self._buf.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._raw.close()
+
+
+class InflateReader:
+    """
+    File like reader over gzip or zlib compressed stream.
+    Data is inflated by chunks on demand - no more than requested
+    bytes number is kept in memory.
+    """
+    _gzip_magic = b'\x1f\x8b'
+    _chunk_size = 1 << 16
+
+    def __init__(self, raw, wbits):
+        """
+        raw: binary file like object with compressed data
+        wbits: zlib wbits for this container
+        """
+        self._raw = raw
+        self._wbits = wbits
+        self._decomp = zlib.decompressobj(wbits)
+        self._pending = b''
+        self._eof = False
+
+    @classmethod
+    def detect(cls, raw):
+        """
+        Check magic bytes, return zlib wbits or None for raw data
+        """
+        if hasattr(raw, 'peek'):
+            magic = raw.peek(2)[:2]
+        else:
+            magic = raw.read(2)
+            raw.seek(0)
+
+        if magic == cls._gzip_magic:
+            return 16 + zlib.MAX_WBITS
+
+        if len(magic) == 2 and (magic[0] & 15) == 8 and \
+            ((magic[0] << 8) | magic[1]) % 31 == 0:
+            return zlib.MAX_WBITS
+
+        return None
+
+    @property
+    def name(self):
         """
-            init  - setup data types and their params for decoding
+        file name
         """
-        for inst in self.data_types:
-            self.__dict__[inst] = namedtuple(inst, ['cursor_step', 'unpack_code'])
+        return getattr(self._raw, 'name', None)
 
-        self._byte.cursor_step = 1
-        self._byte.unpack_code = 'B'
+    @property
+    def closed(self):
+        """
+        is raw stream closed
+        """
+        return self._raw.closed
+
+    def close(self):
+        """
+        close raw stream
+        """
+        self._raw.close()
+
+    def read(self, size=-1):
+        """
+        Read up to size inflated bytes
+        """
+        chunks = []
+        left = size
+
+        while left != 0 and not self._eof:
+            data = self._decomp.unconsumed_tail
+            if not data:
+                data = self._pending or self._raw.read(self._chunk_size)
+                self._pending = b''
+
+            if not data:
+                if not self._decomp.eof:
+                    msg = 'Compressed file {} is truncated'.format(self.name)
+                    raise FileSignatureError(msg)
+                self._eof = True
+                break
+
+            if self._decomp.eof:
+                #next gzip member, anything else is trailing garbage
+                if data[:2] != self._gzip_magic:
+                    self._eof = True
+                    break
+                self._decomp = zlib.decompressobj(self._wbits)
 
-        self._uint16.cursor_step = 2
-        self._uint16.unpack_code = None
+            part = self._decomp.decompress(data, max(left, 0))
+            if self._decomp.eof:
+                self._pending = self._decomp.unused_data
 
-        self._uint32.cursor_step = 4
-        self._uint32.unpack_code = None
+            chunks.append(part)
+            if left > 0:
+                left -= len(part)
 
-        self._int64.cursor_step = 8
-        self._int64.unpack_code = 'q'
+        return b''.join(chunks)
 
-        self._double.cursor_step = self._int64.cursor_step
-        self._double.unpack_code = 'd'
 
-        self._datetime.cursor_step = self._int64.cursor_step
-        self._datetime.unpack_code = self._int64.unpack_code
+DataType = namedtuple('DataType', ['cursor_step', 'unpack_code'])
+
+class BaseTypes:
+    """
+    Base types - a don`t require to save condition
+    Data types params are shared by all instances.
+    """
+    _byte = DataType(1, 'B')
+    _uint16 = DataType(2, None)
+    _uint32 = DataType(4, None)
+    _int64 = DataType(8, 'q')
+    _double = DataType(8, 'd')
+    _datetime = _int64
 
+    def __init__(self):
+        """
+            init  - setup leb128 decoders
+        """
         self._uleb128 = Uleb128(self._uint32.cursor_step)
         self._sleb128 = Sleb128(self._int64.cursor_step)
 
@@ -107,6 +471,8 @@ class BaseTypes:
         """
         Read uint_16
         """
+        if isinstance(stream, ByteCursor):
+            return stream.read_byte()
         return self._read('_byte', stream)
 
     def read_uint16(self, stream):
@@ -127,6 +493,8 @@ class BaseTypes:
         """
         Read int_64
         """
+        if isinstance(stream, ByteCursor):
+            return stream.read_int64()
         return self._read('_int64', stream)
 
 
@@ -134,6 +502,8 @@ class BaseTypes:
         """
         Read int_64
         """
+        if isinstance(stream, ByteCursor):
+            return stream.read_double()
         return self._read('_double', stream)
 
 
@@ -147,7 +517,7 @@ class BaseTypes:
         из .NET версии 4. Сохраняется в поле типа int64
         """
         out = None
-        nano_seconds = self._read('_int64', stream)
+        nano_seconds = self.read_int64(stream)
         if nano_seconds:
             out = (datetime(1, 1, 1) + timedelta(microseconds=nano_seconds/10))
         return out.replace(tzinfo=pytz.utc).astimezone(LOCAL_TZ)
@@ -157,6 +527,8 @@ class BaseTypes:
         """
         Read uleb 128
         """
+        if isinstance(stream, ByteCursor):
+            return stream.read_uleb()
         return self._uleb128.decode_from_stream(stream, 'read', 1)
 
 
@@ -164,6 +536,8 @@ class BaseTypes:
         """
         Read sleb 128
         """
+        if isinstance(stream, ByteCursor):
+            return stream.read_sleb()
         return self._sleb128.decode_from_stream(stream, 'read', 1)
 
 
@@ -173,6 +547,8 @@ class BaseTypes:
         Тип String является комплексным и состоит из следующих компонентов:
         - uleb128 - длинна массива - число бит для чтения
         """
+        if isinstance(stream, ByteCursor):
+            return stream.read_string()
         return bytes.decode(stream.read(self.read_uleb(stream)))
 
 
@@ -197,6 +573,18 @@ class RelativeType(BaseTypes):
         self._last = self.read_sleb(stream) + self._last
         return self._last
 
+    def get_state(self):
+        """
+        decoder state
+        """
+        return self._last
+
+    def set_state(self, state):
+        """
+        restore decoder state
+        """
+        self._last = state
+
 class Growing(BaseTypes):
     """
     It requires to stope last step value
@@ -227,6 +615,18 @@ class Growing(BaseTypes):
         self._last = self._last + _tmp
         return self._last
 
+    def get_state(self):
+        """
+        decoder state
+        """
+        return self._last
+
+    def set_state(self, state):
+        """
+        restore decoder state
+        """
+        self._last = state
+
 class GrowingDateTime:
     """
     It requires to store last step value
@@ -240,14 +640,25 @@ class GrowingDateTime:
         Сохраняется в поле типа Growing.
 
         start_time: начало отсчета
+        _absolute: последнее абсолютное значение (больше двух суток)
         """
         if start_time:
-            self._start = start_time
+            self._initial = start_time
         else:
-            self._start = datetime(1, 1, 1)
+            self._initial = datetime(1, 1, 1)
 
+        self._absolute = None
         self._base = Growing()
 
+    @property
+    def _start(self):
+        """
+        start time, absolute value replaces initial one
+        """
+        if self._absolute is None:
+            return self._initial
+        return datetime(1, 1, 1) + timedelta(milliseconds=self._absolute)
+
     def read(self, stream):
         """
         После долгих экспериментов остановился на следующей схеме:
@@ -256,13 +667,52 @@ class GrowingDateTime:
         """
         delta = timedelta(microseconds=(self._base.read(stream)*1000))
         if delta.days > 1:
-            self._start = datetime(1, 1, 1) + delta
-            out = self._start
+            self._absolute = self._base._last
+            out = datetime(1, 1, 1) + delta
         else:
             out = self._start + delta
 
         return out
 
+    @property
+    def current(self):
+        """
+        datetime of last read value
+        """
+        delta = timedelta(milliseconds=self._base._last)
+        if delta.days > 1:
+            return self._start
+        return self._start + delta
+
+    def skip(self, stream):
+        """
+        Same as read, but return milliseconds number without datetime building
+        """
+        out = self._base.read(stream)
+        if out >= 172800000:
+            self._absolute = out
+
+        return out
+
+    def get_state(self):
+        """
+        decoder state
+        """
+        return [self._base._last, self._absolute]
+
+    def set_state(self, state):
+        """
+        restore decoder state
+        """
+        self._base._last, self._absolute = state
+
+class Field:
+    """
+    One struct field, sub attrs are set by AbsStruct.set_attr
+    """
+    __slots__ = ('value', 'data_type', 'bit_mask', 'read')
+
+
 class AbsStruct:
     """
     abstruct
@@ -278,7 +728,10 @@ class AbsStruct:
         set attr
         """
         for key in attr_list:
-            setattr(self, key, namedtuple(key, sub_attr_list))
+            field = Field()
+            for sub_attr in sub_attr_list:
+                setattr(field, sub_attr, None)
+            setattr(self, key, field)
 
 
 class Stock(AbsStruct):
@@ -328,7 +781,7 @@ class Stocks(AbsStruct):
     one frame sotcks set
     """
     _attrs = ['_number', '_quote', '_timestamp']
-    _sub_attrs = ['value', 'date_type']
+    _sub_attrs = ['value', 'data_type']
 
     def __init__(self):
         """
@@ -363,12 +816,133 @@ class Stocks(AbsStruct):
         """
         return {'timestamp':self._timestamp.value, 'quotes':self._quote.value}
 
+    def skip(self, stream):
+        """
+        Read frame quotes updating state only
+        """
+        rate = self._quote.data_type._rate.data_type
+
+        if isinstance(stream, ByteCursor):
+            read_sleb = stream.read_sleb
+            last = rate._last
+            for _ in range(read_sleb()):
+                last += read_sleb()
+                read_sleb()
+            rate._last = last
+            return
+
+        read_sleb = self._number.data_type.read_sleb
+        for _ in range(read_sleb(stream)):
+            rate.read(stream)
+            read_sleb(stream)
+
+    def read_record(self, stream, growing_dt, record=None):
+        """
+        Read frame quotes into StocksRecord without dicts
+        stream: ByteCursor
+        growing_dt: frame GrowingDateTime, frame header is already read
+        record: record to fill, new one by default
+        """
+        if record is None:
+            record = StocksRecord()
+            record.rates, record.volumes = [], []
+        else:
+            record.rates.clear()
+            record.volumes.clear()
+
+        record.start = growing_dt._start
+        record.time_ms = growing_dt._base._last
+
+        rate = self._quote.data_type._rate.data_type
+        read_sleb = stream.read_sleb
+        rates, volumes = record.rates, record.volumes
+        last = rate._last
+
+        for _ in range(read_sleb()):
+            last += read_sleb()
+            rates.append(last)
+            volumes.append(read_sleb())
+
+        rate._last = last
+        return record
+
+    def get_state(self):
+        """
+        decoder state
+        """
+        return self._quote.data_type._rate.data_type.get_state()
+
+    def set_state(self, state):
+        """
+        restore decoder state
+        """
+        self._quote.data_type._rate.data_type.set_state(state)
+
+    def read_columns(self, stream, growing_dt, frames, start_ms, utc_offset_ms=0,\
+        first_index=0):
+        """
+        Read up to frames number of frames into flat CSR like arrays:
+            frame_index, price, volume - one item per quote,
+            timestamp - frame time (ms since 1970-01-01 UTC), one per frame,
+            offsets - quotes of frame i are in [offsets[i], offsets[i + 1]).
+        stream: ByteCursor
+        growing_dt: frame GrowingDateTime
+        start_ms: record start time as unix epoch ms
+        utc_offset_ms: time zone offset for absolute frame time
+        first_index: index of first read frame
+        return: dict of numpy arrays or None at end of file
+        """
+        frame_index, price, volume = array('q'), array('q'), array('q')
+        timestamp, offsets = array('q'), array('q', [0])
+
+        _rate = self._quote.data_type._rate.data_type
+        last_rate = _rate._last
+        number = 0
+
+        read_sleb = stream.read_sleb
+        skip_frame = growing_dt.skip
+        local_ms = EPOCH_MS + utc_offset_ms
+        index = first_index
+
+        for index in range(first_index, first_index + frames):
+            try:
+                _ms = skip_frame(stream)
+            except StopIteration:
+                break
+
+            timestamp.append(_ms - local_ms if _ms >= 172800000 else start_ms + _ms)
+            number = read_sleb()
+            for _ in range(number):
+                last_rate += read_sleb()
+                price.append(last_rate)
+                volume.append(read_sleb())
+                frame_index.append(index)
+
+            offsets.append(len(price))
+
+        if not timestamp:
+            return None
+
+        _rate._last = last_rate
+        self._number.value = number
+        self._quote.value = [{'rate': _price, 'volume': _volume} for _price, _volume\
+            in zip(price[offsets[-2]:], volume[offsets[-2]:])]
+        if number:
+            self._quote.data_type._rate.value = last_rate
+            self._quote.data_type._volume.value = volume[-1]
+        self._timestamp.value = growing_dt.current
+
+        return {name: np.frombuffer(column, dtype='i8') for name, column in\
+            [('frame_index', frame_index), ('timestamp', timestamp),\
+            ('offsets', offsets), ('price', price), ('volume', volume)]}
+
     def __repr__(self):
         """
         reprint
         """
         _tmp = self.data
-        _tmp['timestamp'] = _tmp.get('timestamp').isoformat()
+        if isinstance(_tmp.get('timestamp'), datetime):
+            _tmp['timestamp'] = _tmp.get('timestamp').isoformat()
         return json.dumps(_tmp)
 
 
@@ -376,11 +950,14 @@ class Trades(AbsStruct):
     """
     Trades stream
     """
-    def __init__(self):
+    def __init__(self, utc_offset_ms=None):
         """
         create data struct
+        utc_offset_ms: exchange time zone offset, if it is set exchange time
+            is unix epoch ms instead of datetime
         """
         super().__init__()
+        self._utc_offset_ms = utc_offset_ms
         self.set_attr(['_trade_type', '_exchange_date_time', '_exchange_trade_number',\
             '_bid_number', '_transaction_price', '_transaction_volume', '_open_interest'],\
             ['value', 'data_type', 'bit_mask'])
@@ -412,11 +989,21 @@ class Trades(AbsStruct):
         self._open_interest.bit_mask = 128
         self._open_interest.value = None
 
+        #exchange time was skipped and not converted to datetime yet
+        self._lazy_time = False
+
 
     def read(self, stream):
         """
         stream
         """
+        if self._utc_offset_ms is not None:
+            self.skip(stream)
+            return
+
+        if self._lazy_time:
+            self._resolve_time()
+
         mask = self._base.read_byte(stream)
 
         self._set_trade_direction(mask, stream)
@@ -440,46 +1027,919 @@ class Trades(AbsStruct):
                 raise TypeError(msg)
 
 
-    def _set_trade_direction(self, mask, stream):
+    _state_keys = ['_exchange_trade_number', '_bid_number', '_transaction_price',\
+        '_open_interest']
+
+    def skip(self, stream):
         """
-        Устанавливаем направление сделки
-        mask: маска
+        Same as read, but exchange time is not converted to datetime
+        return: record mask
         """
-        if (mask & self._trade_type.bit_mask) == 0:
-            self._trade_type.value = 'UNKNOWN'
+        mask = self._base.read_byte(stream)
+        self._set_trade_direction(mask, stream)
 
-        elif (mask & self._trade_type.bit_mask) == 1:
-            self._trade_type.value = 'ASK'
+        if mask & 4:
+            self._exchange_date_time.data_type.skip(stream)
+            self._lazy_time = True
 
-        elif (mask & self._trade_type.bit_mask) == 2:
-            self._trade_type.value = 'BID'
+        if mask & 8:
+            self._exchange_trade_number.value =\
+                self._exchange_trade_number.data_type.read(stream)
 
-        else:
-            msg = 'Can`t defaune trade direction file: {} - position: {}'.\
-                format(stream.name, stream.tell())
-            raise TypeError(msg)
+        if mask & 16:
+            self._bid_number.value = self._bid_number.data_type.read(stream)
 
-    @property
-    def data(self):
+        if mask & 32:
+            self._transaction_price.value = self._transaction_price.data_type.read(stream)
+
+        if mask & 64:
+            self._transaction_volume.value = self._base.read_sleb(stream)
+
+        if mask & 128:
+            self._open_interest.value = self._open_interest.data_type.read(stream)
+
+        return mask
+
+    def read_record(self, stream, record=None):
         """
-        Convert all data to dict
+        Read trade into TradeRecord without dict and datetime building
+        record: record to fill, new one by default
         """
-        out = {}
-        for key in ['_trade_type', '_exchange_date_time', '_exchange_trade_number',\
-        '_bid_number', '_transaction_price', '_transaction_volume', '_open_interest']:
-            tmp = getattr(self, key).value
-            out[key.strip('_')] = tmp
+        if record is None:
+            record = TradeRecord()
 
-        return out
+        record.mask = self.skip(stream)
 
-    def __repr__(self):
+        if self._lazy_time or self._exchange_date_time.value is not None:
+            record.time_ms = self._time_ms()
+        else:
+            record.time_ms = None
+
+        record.exchange_trade_number = self._exchange_trade_number.value
+        record.bid_number = self._bid_number.value
+        record.transaction_price = self._transaction_price.value
+        record.transaction_volume = self._transaction_volume.value
+        record.open_interest = self._open_interest.value
+        return record
+
+    def _time_ms(self):
         """
-        Вывод данных об одной сделке
+        exchange time as milliseconds since 0001-01-01
         """
-        _tmp = self.data
-        _tmp['exchange_date_time'] = _tmp.get('exchange_date_time').isoformat()
-        return json.dumps(_tmp)
-
+        _dt = self._exchange_date_time.data_type
+        _last = _dt._base._last
+        if _last >= 172800000:
+            return _last
+        return (_dt._absolute or 0) + _last
+
+    def _resolve_time(self):
+        """
+        Convert skipped exchange time to datetime or epoch ms
+        """
+        if self._utc_offset_ms is None:
+            self._exchange_date_time.value = self._exchange_date_time.data_type.current
+        else:
+            self._exchange_date_time.value = self._time_ms() - EPOCH_MS - self._utc_offset_ms
+        self._lazy_time = False
+
+    def get_state(self):
+        """
+        decoder state
+        """
+        return {'time': self._exchange_date_time.data_type.get_state(),\
+            'time_set': self._lazy_time or self._exchange_date_time.value is not None,\
+            'lasts': [getattr(self, key).data_type.get_state() for key in self._state_keys],\
+            'values': [getattr(self, key).value for key in\
+                self._state_keys + ['_transaction_volume']]}
+
+    def set_state(self, state):
+        """
+        restore decoder state
+        """
+        self._exchange_date_time.data_type.set_state(state['time'])
+        self._exchange_date_time.value = None
+        self._lazy_time = state['time_set']
+
+        for key, last in zip(self._state_keys, state['lasts']):
+            getattr(self, key).data_type.set_state(last)
+
+        for key, value in zip(self._state_keys + ['_transaction_volume'], state['values']):
+            getattr(self, key).value = value
+
+    def read_columns(self, stream, growing_dt, out, utc_offset_ms=0, frame_time=None):
+        """
+        Read frames of trades stream straight into numpy structured array
+        with TRADES_DTYPE, state is kept in self as after read
+        stream: ByteCursor
+        growing_dt: frame GrowingDateTime
+        out: array to fill
+        utc_offset_ms: exchange time zone offset
+        frame_time: int64 array to fill with GrowingDateTime ms of frames
+        return: number of filled rows, less than len(out) at end of file
+        """
+        timestamp, trade_number, order_id, price, volume, open_interest, side, masks =\
+            [out[name] for name in out.dtype.names]
+
+        _dt = self._exchange_date_time.data_type._base
+        _number = self._exchange_trade_number.data_type
+        _bid = self._bid_number.data_type
+        _price = self._transaction_price.data_type
+        _oi = self._open_interest.data_type
+
+        last_dt, last_number, last_bid = _dt._last, _number._last, _bid._last
+        last_price, last_oi = _price._last, _oi._last
+        last_volume = self._transaction_volume.value or 0
+        shift = EPOCH_MS + utc_offset_ms
+        time_seen = self._lazy_time or self._exchange_date_time.value is not None
+        price_seen = self._transaction_price.value is not None
+
+        read_byte = stream.read_byte
+        read_uleb = stream.read_uleb
+        read_sleb = stream.read_sleb
+        skip_frame = growing_dt.skip
+        seen = 0
+
+        size = 0
+        for size in range(len(out)):
+            try:
+                _ms = skip_frame(stream)
+            except StopIteration:
+                break
+
+            if frame_time is not None:
+                frame_time[size] = _ms
+
+            mask = read_byte()
+            if (mask & 3) == 3:
+                msg = 'Can`t defaune trade direction file: {} - position: {}'.\
+                    format(stream.name, stream.tell())
+                raise TypeError(msg)
+
+            if mask & 4:
+                _tmp = read_uleb()
+                if _tmp > 268435454:
+                    _tmp = read_sleb()
+                last_dt += _tmp
+
+            if mask & 8:
+                _tmp = read_uleb()
+                if _tmp > 268435454:
+                    _tmp = read_sleb()
+                last_number += _tmp
+
+            if mask & 16:
+                last_bid += read_sleb()
+
+            if mask & 32:
+                last_price += read_sleb()
+
+            if mask & 64:
+                last_volume = read_sleb()
+
+            if mask & 128:
+                last_oi += read_sleb()
+
+            seen |= mask
+            timestamp[size] = last_dt - shift
+            trade_number[size] = last_number
+            order_id[size] = last_bid
+            price[size] = last_price
+            volume[size] = last_volume
+            open_interest[size] = last_oi
+            side[size] = mask & 3
+            masks[size] = mask
+        else:
+            size = len(out)
+
+        if size:
+            #rows before first exchange time and price have no such values
+            for column, bit, was_seen in [(timestamp, 4, time_seen), (price, 32, price_seen)]:
+                if not was_seen:
+                    _first = np.flatnonzero(masks[:size] & bit)
+                    column[:_first[0] if len(_first) else size] = MISSING_I8
+
+            _dt._last, _number._last, _bid._last = last_dt, last_number, last_bid
+            _price._last, _oi._last = last_price, last_oi
+            self._trade_type.value = ['UNKNOWN', 'ASK', 'BID'][side[size - 1]]
+
+            for key, value in [('_exchange_trade_number', last_number),\
+                ('_bid_number', last_bid), ('_transaction_price', last_price),\
+                ('_transaction_volume', last_volume), ('_open_interest', last_oi)]:
+                attr = getattr(self, key)
+                if seen & attr.bit_mask:
+                    attr.value = value
+
+            if seen & self._exchange_date_time.bit_mask:
+                if last_dt >= 172800000:
+                    self._exchange_date_time.data_type._absolute = last_dt
+                self._resolve_time()
+
+        return size
+
+    def _set_trade_direction(self, mask, stream):
+        """
+        Устанавливаем направление сделки
+        mask: маска
+        """
+        if (mask & self._trade_type.bit_mask) == 0:
+            self._trade_type.value = 'UNKNOWN'
+
+        elif (mask & self._trade_type.bit_mask) == 1:
+            self._trade_type.value = 'ASK'
+
+        elif (mask & self._trade_type.bit_mask) == 2:
+            self._trade_type.value = 'BID'
+
+        else:
+            msg = 'Can`t defaune trade direction file: {} - position: {}'.\
+                format(stream.name, stream.tell())
+            raise TypeError(msg)
+
+    @property
+    def data(self):
+        """
+        Convert all data to dict
+        """
+        if self._lazy_time:
+            self._resolve_time()
+
+        out = {}
+        for key in ['_trade_type', '_exchange_date_time', '_exchange_trade_number',\
+        '_bid_number', '_transaction_price', '_transaction_volume', '_open_interest']:
+            tmp = getattr(self, key).value
+            out[key.strip('_')] = tmp
+
+        return out
+
+    def __repr__(self):
+        """
+        Вывод данных об одной сделке
+        """
+        _tmp = self.data
+        if isinstance(_tmp.get('exchange_date_time'), datetime):
+            _tmp['exchange_date_time'] = _tmp.get('exchange_date_time').isoformat()
+        return json.dumps(_tmp)
+
+
+class TradeRecord:
+    """
+    One trade without dict: decoded numbers are kept in slots,
+    direction label and exchange time are converted only on access
+    time_ms: exchange time, milliseconds since 0001-01-01
+    """
+    __slots__ = ('mask', 'time_ms', 'exchange_trade_number', 'bid_number',\
+        'transaction_price', 'transaction_volume', 'open_interest')
+
+    _directions = ('UNKNOWN', 'ASK', 'BID')
+
+    @property
+    def trade_type(self):
+        """
+        trade direction
+        """
+        return self._directions[self.mask & 3]
+
+    @property
+    def exchange_date_time(self):
+        """
+        exchange time as naive local datetime
+        """
+        if self.time_ms is None:
+            return None
+        return datetime(1, 1, 1) + timedelta(milliseconds=self.time_ms)
+
+    @property
+    def data(self):
+        """
+        Same dict as Trades.data
+        """
+        return {'trade_type': self.trade_type,\
+            'exchange_date_time': self.exchange_date_time,\
+            'exchange_trade_number': self.exchange_trade_number,\
+            'bid_number': self.bid_number,\
+            'transaction_price': self.transaction_price,\
+            'transaction_volume': self.transaction_volume,\
+            'open_interest': self.open_interest}
+
+    def __repr__(self):
+        """
+        json as Trades
+        """
+        _tmp = self.data
+        _tmp['exchange_date_time'] = _tmp.get('exchange_date_time').isoformat()
+        return json.dumps(_tmp)
+
+
+class StocksRecord:
+    """
+    One order book frame without dicts: rates and volumes lists,
+    frame datetime and quotes dicts are built only on access
+    start: frame time origin, time_ms: Growing frame time value
+    """
+    __slots__ = ('start', 'time_ms', 'rates', 'volumes')
+
+    @property
+    def timestamp(self):
+        """
+        frame time
+        """
+        if self.time_ms >= 172800000:
+            return self.start
+        return self.start + timedelta(milliseconds=self.time_ms)
+
+    @property
+    def quotes(self):
+        """
+        quotes dicts as in Stocks.data
+        """
+        return [{'rate': rate, 'volume': volume} for rate, volume in\
+            zip(self.rates, self.volumes)]
+
+    @property
+    def data(self):
+        """
+        Same dict as Stocks.data
+        """
+        return {'timestamp': self.timestamp, 'quotes': self.quotes}
+
+    def __repr__(self):
+        """
+        json as Stocks
+        """
+        _tmp = self.data
+        _tmp['timestamp'] = _tmp.get('timestamp').isoformat()
+        return json.dumps(_tmp)
+
+
+class MaskedStream(AbsStruct):
+    """
+    Base of streams with presence mask of fields (OrdLog, AuxInfo):
+    decoded numbers are kept in plain attributes, dict and datetime
+    are built only by data property
+    """
+    #bit of exchange time in presence mask
+    _time_bit = 1
+    #attributes which values are kept between records
+    _state_keys = []
+
+    def __init__(self, utc_offset_ms=None):
+        """
+        utc_offset_ms: exchange time zone offset, if it is set exchange time
+            is unix epoch ms instead of datetime
+        _seen: mask of fields that were in any record
+        """
+        super().__init__()
+        self._utc_offset_ms = utc_offset_ms
+        self._time = GrowingDateTime()
+        self._mask = 0
+        self._seen = 0
+
+    def _read_growing(self, stream, last):
+        """
+        Growing value after last one
+        """
+        _tmp = self._base.read_uleb(stream)
+        if _tmp > 268435454:
+            _tmp = self._base.read_sleb(stream)
+        return last + _tmp
+
+    def _time_ms(self):
+        """
+        exchange time as milliseconds since 0001-01-01, None before first one
+        """
+        if not self._seen & self._time_bit:
+            return None
+        _last = self._time._base._last
+        if _last >= 172800000:
+            return _last
+        return (self._time._absolute or 0) + _last
+
+    def read(self, stream):
+        """
+        read record, numbers only - see data
+        """
+        self.skip(stream)
+
+    def get_state(self):
+        """
+        decoder state
+        """
+        return {'time': self._time.get_state(), 'mask': self._mask, 'seen': self._seen,\
+            'values': [getattr(self, key) for key in self._state_keys]}
+
+    def set_state(self, state):
+        """
+        restore decoder state
+        """
+        self._time.set_state(state['time'])
+        self._mask = state['mask']
+        self._seen = state['seen']
+        for key, value in zip(self._state_keys, state['values']):
+            setattr(self, key, value)
+
+    def __repr__(self):
+        """
+        json of record
+        """
+        return _record_json(self.data)
+
+
+def _record_json(data):
+    """
+    json of record dict, datetimes in iso format
+    """
+    return json.dumps({key: value.isoformat() if isinstance(value, datetime) else value\
+        for key, value in data.items()})
+
+
+class OrdLog(MaskedStream):
+    """
+    Order log stream (OrdLog), one record per order action, values
+    of absent fields are kept from previous record:
+        маска наличия данных - byte,
+        флаги записи - uleb128 (ORDLOG_FLAGS),
+        время - GrowingDateTime (бит 1),
+        номер заявки - Growing для добавления заявки, иначе Relative (бит 2),
+            оба от номера последней добавленной заявки, добавление без бита 2
+            получает следующий номер,
+        цена - Relative (бит 4),
+        объем - leb128 (бит 8),
+        остаток - leb128 (бит 16), номер сделки - Growing (бит 32),
+        цена сделки - Relative (бит 64), открытый интерес - Relative (бит 128) -
+        только для записей сведения (флаг Fill).
+    Остаток для добавления заявки равен объему, для снятия - 0.
+    """
+    _state_keys = ['_flags', '_order_id', '_last_order_id', '_price', '_amount',\
+        '_amount_rest', '_deal_id', '_deal_price', '_open_interest']
+
+    def __init__(self, utc_offset_ms=None):
+        """
+        create decoder
+        """
+        super().__init__(utc_offset_ms)
+        for key in self._state_keys:
+            setattr(self, key, 0)
+
+    def skip(self, stream):
+        """
+        Decode record numbers without dict and datetime building
+        return: record mask
+        """
+        base = self._base
+        mask = base.read_byte(stream)
+        flags = base.read_uleb(stream)
+
+        if mask & 1:
+            self._time.skip(stream)
+
+        if mask & 2:
+            if flags & ORDLOG_FLAGS['Add']:
+                self._last_order_id = self._read_growing(stream, self._last_order_id)
+                self._order_id = self._last_order_id
+            else:
+                self._order_id = self._last_order_id + base.read_sleb(stream)
+        elif flags & ORDLOG_FLAGS['Add']:
+            self._last_order_id += 1
+            self._order_id = self._last_order_id
+
+        if mask & 4:
+            self._price += base.read_sleb(stream)
+
+        if mask & 8:
+            self._amount = base.read_sleb(stream)
+
+        if flags & ORDLOG_FLAGS['Fill']:
+            if mask & 16:
+                self._amount_rest = base.read_sleb(stream)
+            if mask & 32:
+                self._deal_id = self._read_growing(stream, self._deal_id)
+            if mask & 64:
+                self._deal_price += base.read_sleb(stream)
+            if mask & 128:
+                self._open_interest += base.read_sleb(stream)
+        elif flags & ORDLOG_FLAGS['Add']:
+            self._amount_rest = self._amount
+        else:
+            self._amount_rest = 0
+
+        self._mask = mask
+        self._flags = flags
+        self._seen |= mask
+        return mask
+
+    def read_record(self, stream, record=None):
+        """
+        Read record into OrdLogRecord without dict and datetime building
+        record: record to fill, new one by default
+        """
+        if record is None:
+            record = OrdLogRecord()
+
+        record.mask = self.skip(stream)
+        record.time_ms = self._time_ms()
+        record.utc_offset_ms = self._utc_offset_ms
+        record.flags = self._flags
+        record.order_id = self._order_id
+        record.price = self._price
+        record.amount = self._amount
+        record.amount_rest = self._amount_rest
+        record.deal_id = self._deal_id
+        record.deal_price = self._deal_price
+        record.open_interest = self._open_interest
+        return record
+
+    def read_columns(self, stream, growing_dt, out, utc_offset_ms=0):
+        """
+        Read frames of order log stream straight into numpy structured array
+        with ORDLOG_DTYPE, state is kept in self as after read
+        stream: ByteCursor
+        growing_dt: frame GrowingDateTime
+        out: array to fill
+        utc_offset_ms: exchange time zone offset
+        return: number of filled rows, less than len(out) at end of file
+        """
+        timestamp, flags_col, order_id, price, amount, amount_rest, deal_id,\
+            deal_price, open_interest, masks = [out[name] for name in out.dtype.names]
+
+        _dt = self._time._base
+        last_dt, last_flags, last_order, last_price = _dt._last, self._flags,\
+            self._order_id, self._price
+        last_added = self._last_order_id
+        last_amount, last_rest, last_deal = self._amount, self._amount_rest, self._deal_id
+        last_deal_price, last_oi = self._deal_price, self._open_interest
+        shift = EPOCH_MS + utc_offset_ms
+        add, fill = ORDLOG_FLAGS['Add'], ORDLOG_FLAGS['Fill']
+
+        read_byte = stream.read_byte
+        read_uleb = stream.read_uleb
+        read_sleb = stream.read_sleb
+        skip_frame = growing_dt.skip
+        seen = self._seen
+        mask = self._mask
+
+        size = 0
+        for size in range(len(out)):
+            try:
+                skip_frame(stream)
+            except StopIteration:
+                break
+
+            mask = read_byte()
+            last_flags = read_uleb()
+
+            if mask & 1:
+                _tmp = read_uleb()
+                if _tmp > 268435454:
+                    _tmp = read_sleb()
+                last_dt += _tmp
+
+            if mask & 2:
+                if last_flags & add:
+                    _tmp = read_uleb()
+                    if _tmp > 268435454:
+                        _tmp = read_sleb()
+                    last_added += _tmp
+                    last_order = last_added
+                else:
+                    last_order = last_added + read_sleb()
+            elif last_flags & add:
+                last_added += 1
+                last_order = last_added
+
+            if mask & 4:
+                last_price += read_sleb()
+
+            if mask & 8:
+                last_amount = read_sleb()
+
+            if last_flags & fill:
+                if mask & 16:
+                    last_rest = read_sleb()
+                if mask & 32:
+                    _tmp = read_uleb()
+                    if _tmp > 268435454:
+                        _tmp = read_sleb()
+                    last_deal += _tmp
+                if mask & 64:
+                    last_deal_price += read_sleb()
+                if mask & 128:
+                    last_oi += read_sleb()
+            elif last_flags & add:
+                last_rest = last_amount
+            else:
+                last_rest = 0
+
+            seen |= mask
+            timestamp[size] = last_dt - shift
+            flags_col[size] = last_flags
+            order_id[size] = last_order
+            price[size] = last_price
+            amount[size] = last_amount
+            amount_rest[size] = last_rest
+            deal_id[size] = last_deal
+            deal_price[size] = last_deal_price
+            open_interest[size] = last_oi
+            masks[size] = mask
+        else:
+            size = len(out)
+
+        if last_dt >= 172800000:
+            self._time._absolute = last_dt
+        _dt._last = last_dt
+        self._flags, self._order_id, self._price = last_flags, last_order, last_price
+        self._last_order_id = last_added
+        self._amount, self._amount_rest, self._deal_id = last_amount, last_rest, last_deal
+        self._deal_price, self._open_interest = last_deal_price, last_oi
+        self._seen, self._mask = seen, mask
+        return size
+
+    @property
+    def data(self):
+        """
+        Convert record to dict, deal fields are None for not fill records
+        """
+        fill = self._flags & ORDLOG_FLAGS['Fill']
+        return {'exchange_date_time': _record_time(self._time_ms(), self._utc_offset_ms),\
+            'flags': self._flags, 'order_id': self._order_id, 'price': self._price,\
+            'amount': self._amount, 'amount_rest': self._amount_rest,\
+            'deal_id': self._deal_id if fill else None,\
+            'deal_price': self._deal_price if fill else None,\
+            'open_interest': self._open_interest if fill else None}
+
+
+class AuxInfo(MaskedStream):
+    """
+    Aux info stream (AuxInfo):
+        маска наличия данных - byte,
+        время - GrowingDateTime (бит 1),
+        объем заявок на продажу и на покупку - Relative (биты 2 и 4),
+        открытый интерес - Relative (бит 8),
+        цена последней сделки - Relative (бит 16),
+        верхний и нижний лимиты цены - Relative, гарантийное обеспечение -
+        double (бит 32),
+        курс - double (бит 64),
+        сообщение - String (бит 128), относится только к своей записи.
+    """
+    _state_keys = ['_ask_total', '_bid_total', '_open_interest', '_price',\
+        '_hi_limit', '_lo_limit', '_deposit', '_rate']
+
+    def __init__(self, utc_offset_ms=None):
+        """
+        create decoder
+        """
+        super().__init__(utc_offset_ms)
+        for key in self._state_keys:
+            setattr(self, key, 0)
+        self._deposit = self._rate = 0.0
+        self._message = None
+
+    def skip(self, stream):
+        """
+        Decode record without dict and datetime building
+        return: record mask
+        """
+        base = self._base
+        mask = base.read_byte(stream)
+
+        if mask & 1:
+            self._time.skip(stream)
+        if mask & 2:
+            self._ask_total += base.read_sleb(stream)
+        if mask & 4:
+            self._bid_total += base.read_sleb(stream)
+        if mask & 8:
+            self._open_interest += base.read_sleb(stream)
+        if mask & 16:
+            self._price += base.read_sleb(stream)
+        if mask & 32:
+            self._hi_limit += base.read_sleb(stream)
+            self._lo_limit += base.read_sleb(stream)
+            self._deposit = base.read_double(stream)
+        if mask & 64:
+            self._rate = base.read_double(stream)
+        self._message = base.read_string(stream) if mask & 128 else None
+
+        self._mask = mask
+        self._seen |= mask
+        return mask
+
+    def read_record(self, stream, record=None):
+        """
+        Read record into AuxInfoRecord without dict and datetime building
+        record: record to fill, new one by default
+        """
+        if record is None:
+            record = AuxInfoRecord()
+
+        self.skip(stream)
+        record.time_ms = self._time_ms()
+        record.utc_offset_ms = self._utc_offset_ms
+        record.values = self._values()
+        return record
+
+    def _values(self):
+        """
+        field values, None for fields not received yet
+        """
+        seen = self._seen
+        return (self._price if seen & 16 else None,\
+            self._ask_total if seen & 2 else None,\
+            self._bid_total if seen & 4 else None,\
+            self._open_interest if seen & 8 else None,\
+            self._hi_limit if seen & 32 else None,\
+            self._lo_limit if seen & 32 else None,\
+            self._deposit if seen & 32 else None,\
+            self._rate if seen & 64 else None,\
+            self._message)
+
+    @property
+    def data(self):
+        """
+        Convert record to dict
+        """
+        out = {'exchange_date_time': _record_time(self._time_ms(), self._utc_offset_ms)}
+        out.update(zip(AuxInfoRecord._keys, self._values()))
+        return out
+
+
+class Messages(AbsStruct):
+    """
+    Messages stream:
+        время - DateTime (int64 .NET ticks, местное время),
+        тип сообщения - byte (MESSAGE_TYPES),
+        текст - String.
+    """
+    def __init__(self, utc_offset_ms=None):
+        """
+        utc_offset_ms: time zone offset, if it is set time is unix epoch ms
+        """
+        super().__init__()
+        self._utc_offset_ms = utc_offset_ms
+        self._time_ms = None
+        self._message_type = None
+        self._text = None
+
+    def skip(self, stream):
+        """
+        Read message without datetime building
+        return: message type
+        """
+        self._time_ms = self._base.read_int64(stream) // 10000
+        self._message_type = self._base.read_byte(stream)
+        self._text = self._base.read_string(stream)
+        return self._message_type
+
+    read = skip
+
+    def read_record(self, stream, record=None):
+        """
+        Read message into MessageRecord
+        """
+        if record is None:
+            record = MessageRecord()
+
+        self.skip(stream)
+        record.time_ms = self._time_ms
+        record.utc_offset_ms = self._utc_offset_ms
+        record.message_type = self._message_type
+        record.text = self._text
+        return record
+
+    def get_state(self):
+        """
+        messages have no state between records
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        nothing to restore
+        """
+
+    @property
+    def data(self):
+        """
+        Convert message to dict
+        """
+        return {'date_time': _record_time(self._time_ms, self._utc_offset_ms),\
+            'message_type': MESSAGE_TYPES.get(self._message_type, self._message_type),\
+            'text': self._text}
+
+    def __repr__(self):
+        """
+        json of message
+        """
+        return _record_json(self.data)
+
+
+class OrdLogRecord:
+    """
+    One order log record without dict, exchange time is converted
+    only on access
+    time_ms: exchange time, milliseconds since 0001-01-01
+    """
+    __slots__ = ('mask', 'time_ms', 'utc_offset_ms', 'flags', 'order_id', 'price',\
+        'amount', 'amount_rest', 'deal_id', 'deal_price', 'open_interest')
+
+    def has_flag(self, name):
+        """
+        check ORDLOG_FLAGS flag by name
+        """
+        return bool(self.flags & ORDLOG_FLAGS[name])
+
+    @property
+    def exchange_date_time(self):
+        """
+        exchange time in parser timestamps mode
+        """
+        return _record_time(self.time_ms, self.utc_offset_ms)
+
+    @property
+    def data(self):
+        """
+        Same dict as OrdLog.data
+        """
+        fill = self.flags & ORDLOG_FLAGS['Fill']
+        return {'exchange_date_time': self.exchange_date_time, 'flags': self.flags,\
+            'order_id': self.order_id, 'price': self.price, 'amount': self.amount,\
+            'amount_rest': self.amount_rest,\
+            'deal_id': self.deal_id if fill else None,\
+            'deal_price': self.deal_price if fill else None,\
+            'open_interest': self.open_interest if fill else None}
+
+    def __repr__(self):
+        """
+        json as OrdLog
+        """
+        return _record_json(self.data)
+
+
+class AuxInfoRecord:
+    """
+    One aux info record without dict
+    values: field values in _keys order
+    """
+    __slots__ = ('time_ms', 'utc_offset_ms', 'values')
+
+    _keys = ('price', 'ask_total', 'bid_total', 'open_interest', 'hi_limit',\
+        'lo_limit', 'deposit', 'rate', 'message')
+
+    @property
+    def exchange_date_time(self):
+        """
+        exchange time in parser timestamps mode
+        """
+        return _record_time(self.time_ms, self.utc_offset_ms)
+
+    @property
+    def data(self):
+        """
+        Same dict as AuxInfo.data
+        """
+        out = {'exchange_date_time': self.exchange_date_time}
+        out.update(zip(self._keys, self.values))
+        return out
+
+    def __repr__(self):
+        """
+        json as AuxInfo
+        """
+        return _record_json(self.data)
+
+
+class MessageRecord:
+    """
+    One message without dict
+    """
+    __slots__ = ('time_ms', 'utc_offset_ms', 'message_type', 'text')
+
+    @property
+    def data(self):
+        """
+        Same dict as Messages.data
+        """
+        return {'date_time': _record_time(self.time_ms, self.utc_offset_ms),\
+            'message_type': MESSAGE_TYPES.get(self.message_type, self.message_type),\
+            'text': self.text}
+
+    def __repr__(self):
+        """
+        json as Messages
+        """
+        return _record_json(self.data)
+
+
+def _record_time(time_ms, utc_offset_ms):
+    """
+    milliseconds since 0001-01-01 to naive local datetime or,
+    with utc_offset_ms, to unix epoch ms
+    """
+    if time_ms is None:
+        return None
+    if utc_offset_ms is None:
+        return datetime(1, 1, 1) + timedelta(milliseconds=time_ms)
+    return time_ms - EPOCH_MS - utc_offset_ms
+
 
 class Header(AbsStruct):
     """
@@ -488,6 +1948,7 @@ class Header(AbsStruct):
     _attrs = ['_signature', '_format_version', '_app_name', '_user_comment',\
             '_record_start_time', '_stream_count', '_head_len']
     _sub_attrs = ['value', 'read']
+    _signature_value = 'QScalp History Data'
 
     def __init__(self):
         """
@@ -517,6 +1978,11 @@ class Header(AbsStruct):
             _tmp = self._signature.read(stream)
             self._signature.value = self._signature.value + chr(_tmp)
 
+        if self._signature.value != self._signature_value:
+            msg = 'Bad file signature {!r} in {}'.format(\
+                self._signature.value, getattr(stream, 'name', None))
+            raise FileSignatureError(msg)
+
         for key in  ['_format_version', '_app_name', '_user_comment',\
             '_record_start_time', '_stream_count']:
             getattr(self, key).value = getattr(self, key).read(stream)
@@ -578,13 +2044,10 @@ class Stream(AbsStruct):
         read
         """
         _tmp = self._type.read(stream)
-        if _tmp not in [16, 32]:
+        if _tmp not in STREAM_TYPES:
             _msg = 'Unsupported stream type - {}'.format(_tmp)
             raise FileSignatureError(_msg)
-        if _tmp == 16:
-            self._type.value = 'Stock'
-        elif _tmp == 32:
-            self._type.value = 'Deals'
+        self._type.value = STREAM_TYPES[_tmp]
 
         self._tool.value = self._tool.read(stream)
 
@@ -634,7 +2097,7 @@ class Frame(AbsStruct):
         """
         self._grow_dt.value = self._grow_dt.read(stream)
         if not one_stream:
-            self._sub_attrs.value = self._sub_attrs.read(stream)
+            self._stream.value = self._stream.read(stream)
 
     @property
     def data(self):
@@ -657,6 +2120,85 @@ class Frame(AbsStruct):
         return json.dumps(_tmp)
 
 
+class FrameIndex:
+    """
+    Frame offsets with decoder state checkpoints of one file.
+    Saved as json sidecar file near qsh file (file.qsh.idx),
+    file size and modification time are used to detect stale index.
+    """
+    suffix = '.idx'
+    _version = 1
+
+    def __init__(self, every=1000, size=None, mtime=None):
+        """
+        every: frames number between checkpoints
+        size, mtime: indexed file stamp
+        frames: total frames number in file
+        checkpoints: [frame number, offset, time of previous frame, state]
+        """
+        self.every = every
+        self.size = size
+        self.mtime = mtime
+        self.frames = None
+        self.checkpoints = []
+        self._numbers = []
+        self._times = []
+
+    def add(self, frame, offset, time_ms, state):
+        """
+        add checkpoint
+        frame: number of next frame
+        offset: position of next frame in file
+        time_ms: epoch ms of previous frame, None for first frame
+        state: parser decoders state
+        """
+        self.checkpoints.append([frame, offset, time_ms, state])
+        self._numbers.append(frame)
+        self._times.append(float('-inf') if time_ms is None else time_ms)
+
+    def for_frame(self, number):
+        """
+        nearest checkpoint before frame
+        """
+        return self.checkpoints[max(bisect_right(self._numbers, number) - 1, 0)]
+
+    def for_time(self, time_ms):
+        """
+        last checkpoint all frames before which are earlier than time_ms
+        """
+        return self.checkpoints[max(bisect_left(self._times, time_ms) - 1, 0)]
+
+    def save(self, path):
+        """
+        write sidecar file
+        """
+        with open(path, 'w') as out:
+            json.dump({'version': self._version, 'every': self.every,\
+                'size': self.size, 'mtime': self.mtime, 'frames': self.frames,\
+                'checkpoints': self.checkpoints}, out)
+
+    @classmethod
+    def load(cls, path, size=None, mtime=None):
+        """
+        read sidecar file, None if it is absent or stale
+        """
+        try:
+            with open(path) as src:
+                data = json.load(src)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != cls._version or \
+            (size, mtime) != (data.get('size'), data.get('mtime')):
+            return None
+
+        index = cls(data['every'], data['size'], data['mtime'])
+        for checkpoint in data['checkpoints']:
+            index.add(*checkpoint)
+        index.frames = data['frames']
+        return index
+
+
 class QSHParser:
     """
         Парсер:
@@ -671,65 +2213,615 @@ class QSHParser:
                 - заголовок кадра n,
                 - данные кадра n,
     """
-    def __init__(self, path_to_file):
+    _backends = {'file': ByteCursor, 'mmap': MappedCursor}
+
+    _timestamps = ['datetime', 'ms']
+
+    def __init__(self, path_to_file, backend='file', timestamps='datetime'):
         """
         path_to_file - путь к файлу формата qsh
+        backend - file: чтение файла блоками, mmap: отображение файла в память
+        timestamps - datetime: время кадров и сделок в datetime,
+            ms: целое число миллисекунд unix epoch (UTC) без построения
+            datetime, перевод в московское время - epoch_ms_to_local
+        Сжатые gzip/zlib файлы распаковываются потоком по мере чтения,
+        отобразить в память их нельзя - для них backend не учитывается.
         """
         if not os.path.exists(path_to_file):
             msg = u'Путь к файлу {0} не найден'.format(path_to_file)
             raise FileNotExists(msg)
 
-        self._io_stream = open(path_to_file, 'rb')
+        if backend not in self._backends:
+            msg = 'Unknown backend {}, use one of {}'.format(\
+                backend, sorted(self._backends))
+            raise ValueError(msg)
+
+        if timestamps not in self._timestamps:
+            msg = 'Unknown timestamps mode {}, use one of {}'.format(\
+                timestamps, self._timestamps)
+            raise ValueError(msg)
+
+        self._path = path_to_file
+        self._backend = backend
+        self._epoch_mode = timestamps == 'ms'
+        self._io_stream = self._open()
         self._header = Header()
         self._stream = Stream()
+        self._streams = [self._stream]
         self._stream_dt = None
         self._pyload = None
+        self._pyloads = []
+        self._multi = False
+        self._subscribed = None
+        self._frame = None
+        self._frame_count = 0
+        self._start_ms = None
+        self._offset_ms = None
+        self._index = None
         self._version = [4]
 
+    def _open(self):
+        """
+        Open file and make cursor for backend
+        """
+        _raw = open(self._path, 'rb')
+        _wbits = InflateReader.detect(_raw)
+        if _wbits is None:
+            return self._backends[self._backend](_raw)
+        return ByteCursor(InflateReader(_raw, _wbits))
+
     def touch(self):
         """
         Read header and stream
         """
         if self._stream_dt is None:
             self._header.read(self._io_stream)
-            if self._header.data.get('stream_count') > 1:
-                _msg = 'More than one stream in file {}'.format(self._stream.name)
+            _count = self._header.data.get('stream_count')
+            if _count < 1:
+                _msg = 'No streams in file {}'.format(self._io_stream.name)
                 raise FileSignatureError(_msg)
 
             self._stream_dt = GrowingDateTime(self._header.data.get('record_start_time'))
-            self._stream.read(self._io_stream)
+            self._start_ms, self._offset_ms = self._epoch_params()
+            self._frame = Frame(self._stream_dt)
 
-            if self._stream.data.get('type') == 'Stock':
-                self._pyload = Stocks()
+            self._streams = [Stream() for _ in range(_count)]
+            for _stream in self._streams:
+                _stream.read(self._io_stream)
+            self._pyloads = [self._make_pyload(_stream) for _stream in self._streams]
 
-            elif self._stream.data.get('type') == 'Deals':
-                self._pyload = Trades()
+            #в файле с несколькими потоками за заголовком кадра идет номер потока
+            self._multi = _count > 1
+            self._stream = self._streams[0]
+            self._pyload = self._pyloads[0]
+            self._frame._stream.value = 0
 
         _tmp = self._header.data.get('format_version')
         if _tmp not in self._version:
             raise Warning('{} are not support version {}'.\
                 format(self.__class__.__name__, _tmp))
 
+    def _make_pyload(self, stream):
+        """
+        Decoder of stream data
+        """
+        _type = stream.data.get('type')
+        if _type == 'Stock':
+            return Stocks()
+        _offset_ms = self._offset_ms if self._epoch_mode else None
+        return {'Deals': Trades, 'OrdLog': OrdLog, 'AuxInfo': AuxInfo,\
+            'Messages': Messages}[_type](_offset_ms)
+
+    def subscribe(self, *streams):
+        """
+        Read only frames of given streams, frames of other streams are
+        skipped without dicts building (decoders state is kept).
+        streams: stream numbers, types ('Stock', 'Deals') or instruments,
+            nothing - all streams
+        return: subscribed stream numbers
+        """
+        if self._stream_dt is None:
+            self.touch()
+
+        if not streams:
+            self._subscribed = None
+            return list(range(len(self._streams)))
+
+        _numbers = set()
+        for _item in streams:
+            _found = [number for number, _stream in enumerate(self._streams) if _item in\
+                (number, _stream.data.get('type'), _stream.data.get('tool'))]
+            if not _found:
+                _msg = 'Stream {!r} is not in file {}'.format(_item, self._io_stream.name)
+                raise ValueError(_msg)
+            _numbers.update(_found)
+
+        self._subscribed = frozenset(_numbers)
+        return sorted(_numbers)
+
+    @property
+    def stream_number(self):
+        """
+        stream number of last read frame
+        """
+        return self._frame._stream.value
+
+    def _select_stream(self):
+        """
+        Read stream number of multi stream frame and choose its decoder.
+        Frame of not subscribed stream is skipped.
+        return: True if frame data should be read
+        """
+        _number = self._io_stream.read_byte()
+        if _number >= len(self._pyloads):
+            _msg = 'Frame of unknown stream {} in {}'.format(_number, self._io_stream.name)
+            raise FileSignatureError(_msg)
+
+        self._frame._stream.value = _number
+        self._pyload = self._pyloads[_number]
+        if self._subscribed is None or _number in self._subscribed:
+            return True
+
+        self._pyload.skip(self._io_stream)
+        self._frame_count += 1
+        return False
+
     def read(self):
         """
-        Read one frame data
+        Read one frame data, in multi stream file data of next frame
+        of subscribed streams, see stream_number
         """
         if self._stream_dt is None:
             _msg = 'Call touch method at first'
             raise TouchMethodNoCall(_msg)
 
-        _frame = Frame(self._stream_dt)
-        _frame.read(self._io_stream)
+        _frame = self._frame
+        while True:
+            if self._epoch_mode:
+                _frame._grow_dt.value = self._frame_time(self._stream_dt.skip(self._io_stream))
+            else:
+                _frame.read(self._io_stream)
+
+            if not self._multi or self._select_stream():
+                return self._read_pyload(_frame.data.get('grow_dt'))
 
+    def iter_streams(self):
+        """
+        Iterate over frames of subscribed streams
+        return: generator of (stream number, data)
+        """
+        for data in self:
+            yield self._frame._stream.value, data
+
+    def _read_pyload(self, timestamp):
+        """
+        Read frame data after frame header
+        timestamp: frame time
+        """
         if self._pyload.__class__.__name__ == 'Stocks':
-            self._pyload.read(stream=self._io_stream,\
-                timestamp=_frame.data.get('grow_dt'))
+            self._pyload.read(stream=self._io_stream, timestamp=timestamp)
 
-        elif self._pyload.__class__.__name__ == 'Trades':
+        else:
             self._pyload.read(self._io_stream)
 
+        self._frame_count += 1
         return self._pyload.data
 
+    def iter_range(self, start=None, end=None):
+        """
+        Read frames with frame time in [start, end).
+        Frames before start are skipped without dicts and datetimes building,
+        reading stops at first frame after end - next read returns it.
+        Frames are scanned from current position. Before first frame is
+        read, if index is loaded or its sidecar file exists, parser seeks
+        to start at once.
+        start, end: epoch ms, aware datetime or naive Moscow time, None - no limit
+        """
+        if self._stream_dt is None:
+            self.touch()
+
+        _start = None if start is None else self._to_epoch_ms(start)
+        _end = None if end is None else self._to_epoch_ms(end)
+
+        if _start is not None and self._frame_count == 0:
+            if self._index is None:
+                self._index = FrameIndex.load(self._path + FrameIndex.suffix,\
+                    *self._file_stamp())
+            if self._index is not None:
+                self.seek_time(_start)
+
+        _stream = self._io_stream
+        _stream_dt = self._stream_dt
+
+        while True:
+            #frame after end is read back from buffer, stream may be not seekable
+            _offset = _stream.mark()
+            _state = _stream_dt.get_state()
+            try:
+                _time = self._frame_time(_stream_dt.skip(_stream))
+            except StopIteration:
+                _stream.close()
+                return
+            _stream.unmark()
+
+            if _end is not None and _time >= _end:
+                _stream.seek(_offset)
+                _stream_dt.set_state(_state)
+                return
+
+            if self._multi and not self._select_stream():
+                continue
+
+            if _start is not None and _time < _start:
+                self._pyload.skip(_stream)
+                self._frame_count += 1
+                continue
+
+            self._frame._grow_dt.value = _time if self._epoch_mode else _stream_dt.current
+            yield self._read_pyload(self._frame._grow_dt.value)
+
+    def read_record(self, record=None):
+        """
+        Read one frame into compact record (TradeRecord or StocksRecord)
+        without dicts, datetimes are built only on record fields access.
+        record: record to refill, new one by default
+        """
+        if self._stream_dt is None:
+            _msg = 'Call touch method at first'
+            raise TouchMethodNoCall(_msg)
+
+        self._stream_dt.skip(self._io_stream)
+        while self._multi and not self._select_stream():
+            self._stream_dt.skip(self._io_stream)
+
+        if isinstance(self._pyload, Stocks):
+            record = self._pyload.read_record(self._io_stream, self._stream_dt, record)
+        else:
+            record = self._pyload.read_record(self._io_stream, record)
+
+        self._frame_count += 1
+        return record
+
+    def iter_records(self, reuse=False):
+        """
+        Iterate over frames as compact records
+        reuse: refill one record object (flyweight) instead of new ones,
+            then record is valid only till next step
+        """
+        record = None
+        while True:
+            try:
+                record = self.read_record(record if reuse else None)
+            except StopIteration:
+                self._io_stream.close()
+                return
+            yield record
+
+    def read_trades_columnar(self, batch_size=65536, frame_time=False):
+        """
+        Read trades stream by batches into numpy structured arrays, without
+        dict per trade. Columns (TRADES_DTYPE):
+            timestamp - exchange time, milliseconds since 1970-01-01 UTC;
+            trade_number, order_id, price, volume, open_interest - int64,
+                absent field keeps previous value (0 before first value);
+            timestamp and price are MISSING_I8 before first value in stream;
+            side - 0: UNKNOWN, 1: ASK, 2: BID;
+            mask - presence bits of record, see Trades bit masks.
+        batch_size: rows number in one array
+        frame_time: yield (batch, frame_time) pairs, frame_time - int64
+            array of frame times in milliseconds since 1970-01-01 UTC
+        """
+        return self._read_struct_columnar(Trades, TRADES_DTYPE, batch_size, frame_time)
+
+    def read_ordlog_columnar(self, batch_size=65536):
+        """
+        Read order log stream by batches into numpy structured arrays, without
+        dict per record. Columns (ORDLOG_DTYPE):
+            timestamp - exchange time, milliseconds since 1970-01-01 UTC;
+            flags - ORDLOG_FLAGS bits;
+            order_id, price, amount, amount_rest - int64;
+            deal_id, deal_price, open_interest - int64, values of last fill
+                record, they are meaningful only if flags has Fill;
+            mask - presence bits of record, see OrdLog.
+        batch_size: rows number in one array
+        """
+        return self._read_struct_columnar(OrdLog, ORDLOG_DTYPE, batch_size)
+
+    def _read_struct_columnar(self, pyload_class, dtype, batch_size, frame_time=False):
+        """
+        Batches of one stream file decoded by pyload read_columns
+        """
+        if np is None:
+            raise ImportError('numpy is required for columnar reading')
+
+        if self._stream_dt is None:
+            _msg = 'Call touch method at first'
+            raise TouchMethodNoCall(_msg)
+
+        if self._multi or not isinstance(self._pyload, pyload_class):
+            _msg = 'File {} is not a one {} stream file'.format(\
+                self._io_stream.name, pyload_class.__name__)
+            raise FileSignatureError(_msg)
+
+        return self._struct_batches(dtype, batch_size, frame_time)
+
+    def _struct_batches(self, dtype, batch_size, frame_time=False):
+        """
+        generator of read_columns batches, (batch, frame_time) pairs
+        if frame_time is set
+        """
+        _start_ms, _offset_ms = self._epoch_params()
+        _frames = {}
+
+        while True:
+            _batch = np.empty(batch_size, dtype=dtype)
+            if frame_time:
+                _frames['frame_time'] = np.empty(batch_size, dtype='i8')
+            _size = self._pyload.read_columns(self._io_stream, self._stream_dt,\
+                _batch, _offset_ms, **_frames)
+            self._frame_count += _size
+
+            if _size and frame_time:
+                _ms = _frames['frame_time'][:_size]
+                _ms = np.where(_ms >= 172800000, _ms - EPOCH_MS - _offset_ms,\
+                    _start_ms + _ms)
+                yield (_batch if _size == batch_size else _batch[:_size].copy()), _ms
+            elif _size:
+                yield _batch if _size == batch_size else _batch[:_size].copy()
+
+            if _size < batch_size:
+                self._io_stream.close()
+                return
+
+    def read_stocks_columnar(self, batch_size=65536):
+        """
+        Read order book stream by batches of frames into flat numpy arrays,
+        without dict per quote, see Stocks.read_columns for format.
+        frame_index is number of frame in file.
+        batch_size: frames number in one batch
+        """
+        if np is None:
+            raise ImportError('numpy is required for columnar reading')
+
+        if self._stream_dt is None:
+            _msg = 'Call touch method at first'
+            raise TouchMethodNoCall(_msg)
+
+        if self._multi or not isinstance(self._pyload, Stocks):
+            _msg = 'File {} is not a one order book stream file'.format(self._io_stream.name)
+            raise FileSignatureError(_msg)
+
+        while True:
+            _batch = self._pyload.read_columns(self._io_stream, self._stream_dt,\
+                batch_size, self._start_ms, self._offset_ms, self._frame_count)
+
+            if _batch is not None:
+                self._frame_count += len(_batch['timestamp'])
+                yield _batch
+
+            if _batch is None or len(_batch['timestamp']) < batch_size:
+                self._io_stream.close()
+                return
+
+    def read_columns(self, cache=None):
+        """
+        Whole file as numpy arrays:
+            Trades - {'trades': structured array}, see read_trades_columnar;
+            OrdLog - {'ordlog': structured array}, see read_ordlog_columnar;
+            Stock - frame_index, timestamp, offsets, price, volume,
+                see Stocks.read_columns, offsets are file wide.
+        cache: DecodeCache or cache directory path - arrays are stored
+            after first decode and memory mapped by next calls
+        """
+        if cache is not None:
+            from qsh_cache import DecodeCache
+            if not isinstance(cache, DecodeCache):
+                cache = DecodeCache(cache)
+            #cache decodes file by own parser, as after full read stream is closed
+            self._io_stream.close()
+            return cache.get(self._path, self._backend)
+
+        if self._stream_dt is None:
+            self.touch()
+
+        for _class, _name, _dtype in [(Trades, 'trades', TRADES_DTYPE),\
+            (OrdLog, 'ordlog', ORDLOG_DTYPE)]:
+            if isinstance(self._pyload, _class):
+                _batches = list(self._read_struct_columnar(_class, _dtype, 65536))
+                if not _batches:
+                    return {_name: np.empty(0, dtype=_dtype)}
+                return {_name: np.concatenate(_batches)}
+
+        _batches = list(self.read_stocks_columnar())
+        if not _batches:
+            return {name: np.zeros(int(name == 'offsets'), dtype='i8') for name in\
+                ['frame_index', 'timestamp', 'offsets', 'price', 'volume']}
+
+        out = {name: np.concatenate([batch[name] for batch in _batches]) for name in\
+            ['frame_index', 'timestamp', 'price', 'volume']}
+        _bases = np.cumsum([0] + [len(batch['price']) for batch in _batches[:-1]])
+        out['offsets'] = np.concatenate([batch['offsets'][:-1] + _base for batch, _base in\
+            zip(_batches, _bases.tolist())] + [np.array([len(out['price'])], dtype='i8')])
+        return out
+
+    def _epoch_params(self):
+        """
+        Record start time as unix epoch milliseconds and exchange
+        time zone offset in milliseconds
+        """
+        _start = self._header.data.get('record_start_time')
+        _offset_ms = int(_start.utcoffset().total_seconds()) * 1000
+        _start_ms = (_start.replace(tzinfo=None) - datetime(1, 1, 1)) //\
+            timedelta(milliseconds=1) - EPOCH_MS - _offset_ms
+        return _start_ms, _offset_ms
+
+    def get_state(self):
+        """
+        decoders state before next frame
+        """
+        return [self._stream_dt.get_state()] + [_pyload.get_state() for _pyload in self._pyloads]
+
+    def set_state(self, state):
+        """
+        restore decoders state
+        """
+        self._stream_dt.set_state(state[0])
+        for _pyload, _state in zip(self._pyloads, state[1:]):
+            _pyload.set_state(_state)
+
+    def _skip_frame(self):
+        """
+        Read frame updating decoders state only
+        return: frame time as epoch ms
+        """
+        _ms = self._stream_dt.skip(self._io_stream)
+        if self._multi:
+            self._pyload = self._pyloads[self._io_stream.read_byte()]
+        self._pyload.skip(self._io_stream)
+        self._frame_count += 1
+        return self._frame_time(_ms)
+
+    def _frame_time(self, value):
+        """
+        GrowingDateTime milliseconds of frame to epoch ms
+        """
+        if value >= 172800000:
+            return value - EPOCH_MS - self._offset_ms
+        return self._start_ms + value
+
+    def _to_epoch_ms(self, timestamp):
+        """
+        epoch ms, aware datetime or naive local (Moscow) datetime to epoch ms
+        """
+        if isinstance(timestamp, datetime):
+            if timestamp.tzinfo is None:
+                timestamp = LOCAL_TZ.localize(timestamp)
+            return int(round(timestamp.timestamp() * 1000))
+        return int(timestamp)
+
+    def _file_stamp(self):
+        """
+        size and modification time of file
+        """
+        _stat = os.stat(self._path)
+        return _stat.st_size, _stat.st_mtime
+
+    def build_index(self, every=1000, save=True):
+        """
+        Build frame index by one pass over file, current position is kept.
+        every: frames number between checkpoints
+        save: write sidecar file near qsh file
+        """
+        _parser = QSHParser(self._path, self._backend)
+        _parser.touch()
+        _index = FrameIndex(every, *self._file_stamp())
+        _time_ms = None
+
+        while True:
+            if _parser._frame_count % every == 0:
+                _index.add(_parser._frame_count, _parser._io_stream.tell(),\
+                    _time_ms, _parser.get_state())
+            try:
+                _time_ms = _parser._skip_frame()
+            except StopIteration:
+                break
+
+        _index.frames = _parser._frame_count
+        _parser._io_stream.close()
+
+        if save:
+            _index.save(self._path + FrameIndex.suffix)
+
+        self._index = _index
+        return _index
+
+    def load_index(self, every=1000):
+        """
+        Load sidecar index or build it if absent or stale.
+        If file directory is read only index is kept in memory only.
+        """
+        _index = FrameIndex.load(self._path + FrameIndex.suffix, *self._file_stamp())
+        if _index is None:
+            _index = self.build_index(every, save=False)
+            try:
+                _index.save(self._path + FrameIndex.suffix)
+            except OSError:
+                pass
+
+        self._index = _index
+        return _index
+
+    def seek_frame(self, number):
+        """
+        Move to frame by number, next read returns this frame
+        """
+        if self._stream_dt is None:
+            self.touch()
+
+        _index = self._index or self.load_index()
+        if not 0 <= number <= _index.frames:
+            _msg = 'Frame {} is out of file {} with {} frames'.format(\
+                number, self._path, _index.frames)
+            raise IndexError(_msg)
+
+        _checkpoint = _index.for_frame(number)
+
+        if self._io_stream.closed or not _checkpoint[0] <= self._frame_count <= number:
+            self.restore_checkpoint(_checkpoint)
+
+        while self._frame_count < number:
+            self._skip_frame()
+
+        return number
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Move to index checkpoint and restore decoders state
+        checkpoint: [frame number, offset, time, state] from FrameIndex
+        """
+        if self._stream_dt is None:
+            self.touch()
+
+        _frame, _offset, _, _state = checkpoint
+        if self._io_stream.closed or \
+            (not self._io_stream.seekable() and _offset < self._io_stream.tell()):
+            self._io_stream = self._open()
+
+        self._io_stream.seek(_offset)
+        self.set_state(_state)
+        self._frame_count = _frame
+
+    def seek_time(self, timestamp):
+        """
+        Move to first frame with time not less than timestamp
+        timestamp: epoch ms, aware datetime or naive Moscow time
+        return: frame number
+        """
+        if self._stream_dt is None:
+            self.touch()
+
+        _index = self._index or self.load_index()
+        _target = self._to_epoch_ms(timestamp)
+        self.seek_frame(_index.for_time(_target)[0])
+
+        _stream = self._io_stream
+        while True:
+            #decoders state before frame, overshoot goes back to it in buffer
+            _offset = _stream.mark()
+            _state = self.get_state()
+            try:
+                _time = self._skip_frame()
+            except StopIteration:
+                _stream.unmark()
+                return self._frame_count
+            _stream.unmark()
+
+            if _time >= _target:
+                _stream.seek(_offset)
+                self.set_state(_state)
+                self._frame_count -= 1
+                return self._frame_count
+
     def frame_to_json(self):
         """
         Convert pyload to json
@@ -743,7 +2835,8 @@ class QSHParser:
         if self._stream_dt is None:
             _rest = '\n\tNo inforamtion, call touch method.'
         else:
-            _rest = '\n' + str(self._header) + '\n' + str(self._stream)
+            _rest = '\n' + str(self._header) + ''.join('\n' + str(_stream)\
+                for _stream in self._streams)
         return  'File: {}, cursor position: {}'.\
             format(self._io_stream.name, self._io_stream.tell()) + _rest
 
@@ -754,22 +2847,88 @@ class QSHParser:
         while True:
             try:
                 yield self.read()
-            except StopIteration as i_stop:
+            except StopIteration:
                 self._io_stream.close()
-                raise StopIteration
+                return
 
 
-def _read_mode(path_to_file):
+def epoch_ms_to_local(values):
+    """
+    Convert unix epoch ms to Moscow time at output edge
+    values: int, iterable or numpy array
+    return: aware datetime for int, list of them for iterable,
+        datetime64[ms] array of Moscow wall clock time for numpy array,
+        MISSING_I8 values are NaT
+    Time zone is looked up once per hour of values.
+    """
+    if np is not None and isinstance(values, np.ndarray):
+        _missing = values == MISSING_I8
+        _values = np.where(_missing, 0, values)
+        _hours, _inverse = np.unique(_values // 3600000, return_inverse=True)
+        _offsets = np.array([_local_tz_for_hour(hour)[1] //\
+            timedelta(milliseconds=1) for hour in _hours.tolist()], dtype='i8')
+        return np.where(_missing, MISSING_I8, _values + _offsets[_inverse]).\
+            astype('datetime64[ms]')
+
+    if isinstance(values, int):
+        return epoch_ms_to_local([values])[0]
+
+    out = []
+    _cache = {}
+    for value in values:
+        _hour = value // 3600000
+        _tz = _cache.get(_hour)
+        if _tz is None:
+            _tz = _cache[_hour] = _local_tz_for_hour(_hour)
+        out.append((datetime(1970, 1, 1) + timedelta(\
+            milliseconds=value) + _tz[1]).replace(tzinfo=_tz[0]))
+    return out
+
+def _local_tz_for_hour(hour):
+    """
+    Moscow (tzinfo, utc offset) for hour since epoch
+    """
+    _local = LOCAL_TZ.fromutc(datetime(1970, 1, 1) + timedelta(hours=hour))
+    return _local.tzinfo, _local.utcoffset()
+
+def _read_mode(path_to_file, timestamps='datetime', out=None, encoder='json'):
     """
     read from file
     path_to_file: full path to file
+    timestamps: datetime or ms
+    out: output file, stdout by default
+    encoder: json - frame_to_json format, orjson - compact and faster
     """
-    qsh = QSHParser(path_to_file)
-    qsh.touch()
-    print(qsh)
-    print('\n' + '-'*50 + '\n')
-    for data in qsh:
-        print(qsh.frame_to_json())
+    from qsh_export import write_json_lines
+    try:
+        write_json_lines(path_to_file, out, timestamps, encoder)
+    except BrokenPipeError:
+        #downstream tool closed pipe (head and so on)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+def _read_dir_mode(source, workers=None):
+    """
+    read files in parallel, output is in files order
+    source: directory or glob pattern
+    workers: processes number
+    """
+    from qsh_pool import dump_json_files
+    try:
+        for _ in dump_json_files(source, workers=workers and int(workers)):
+            pass
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+def _to_parquet_mode(source, out_dir, workers=None):
+    """
+    convert files to parquet in parallel
+    source: file, directory or glob pattern
+    out_dir: output directory
+    workers: processes number
+    """
+    from qsh_export import to_parquet
+    for path, out_path in to_parquet(source, out_dir, workers and int(workers)):
+        print(path, '->', out_path)
 
 def _run_unittests():
     """
@@ -895,6 +3054,495 @@ BytesIO(b'1\xff\x82\x01\x01\xa1~\x01A\x01\xee~\x03\xa4\x7f\x01U\x03\x94~\x01\xcc
             stocks.read(self.stocks_data, self.base_time)
             self.assertTrue(len(stocks.data.get('quotes')) == stocks._number.value)
 
+        def test_j_byte_cursor(self):
+            """
+            test buffered cursor gives same values as stream, even on chunk bounds
+            """
+            cursor = ByteCursor(BytesIO(self.header_data.getvalue()), chunk_size=3)
+            header = Header()
+            header.read(cursor)
+            self.header.read(self.header_data)
+            self.assertDictEqual(header.data, self.header.data)
+
+            cursor = ByteCursor(BytesIO(self.stocks_data.getvalue()), chunk_size=5)
+            stocks = Stocks()
+            stocks.read(cursor, self.base_time)
+            etalon = Stocks()
+            etalon.read(self.stocks_data, self.base_time)
+            self.assertEqual(stocks.data, etalon.data)
+            self.assertEqual(cursor.tell(), self.stocks_data.tell())
+
+            #absolute time is two numbers, marked frame start is kept on refill
+            frame = Uleb128(1).encode_minimal(268435455) +\
+                Sleb128(1).encode_minimal(63560000000000)
+            for pad in range(24):
+                raw = BytesIO(zlib.compress(bytes(pad) + frame + bytes(64)))
+                cursor = ByteCursor(InflateReader(raw, InflateReader.detect(raw)), chunk_size=1)
+                for _ in range(pad):
+                    cursor.read_uleb()
+                growing_dt = GrowingDateTime()
+                offset = cursor.mark()
+                self.assertEqual(growing_dt.skip(cursor), 63560000000000)
+                cursor.unmark()
+                self.assertEqual(cursor.seek(offset), pad)
+                growing_dt.set_state([0, None])
+                self.assertEqual(growing_dt.skip(cursor), 63560000000000)
+
+        def test_k_mmap_backend(self):
+            """
+            test mmap backend gives same frames as file backend
+            """
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+            etalon = QSHParser(path)
+            mapped = QSHParser(path, backend='mmap')
+            etalon.touch()
+            mapped.touch()
+            self.assertEqual(str(etalon), str(mapped))
+            for _ in range(1000):
+                self.assertDictEqual(etalon.read(), mapped.read())
+
+            self.assertIsInstance(mapped._io_stream.read(4), memoryview)
+            etalon._io_stream.close()
+            mapped._io_stream.close()
+
+        def test_l_compressed_input(self):
+            """
+            test gzip and zlib files are read as raw one
+            """
+            import gzip
+            import tempfile
+
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+            with open(path, 'rb') as raw:
+                data = raw.read()
+
+            for packed in [gzip.compress(data), zlib.compress(data)]:
+                with tempfile.NamedTemporaryFile(suffix='.qsh') as tmp:
+                    tmp.write(packed)
+                    tmp.flush()
+
+                    etalon = QSHParser(path)
+                    inflated = QSHParser(tmp.name)
+                    etalon.touch()
+                    inflated.touch()
+                    self.assertIsInstance(inflated._io_stream._raw, InflateReader)
+                    self.assertListEqual(list(etalon), list(inflated))
+
+            self.assertRaises(FileSignatureError, Header().read,\
+                BytesIO(gzip.compress(self.header_data.getvalue())))
+
+        @unittest.skipIf(np is None, 'numpy is not installed')
+        def test_m_trades_columnar(self):
+            """
+            test columnar trades are the same as dicts
+            """
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+            etalon = QSHParser(path)
+            columnar = QSHParser(path)
+            etalon.touch()
+            columnar.touch()
+
+            sides = {'UNKNOWN': 0, 'ASK': 1, 'BID': 2}
+            batches = list(columnar.read_trades_columnar(batch_size=10000))
+            self.assertTrue(all(len(batch) == 10000 for batch in batches[:-1]))
+
+            rows = np.concatenate(batches)
+            dicts = list(etalon)
+            self.assertEqual(len(rows), len(dicts))
+
+            for row, data in zip(rows[::97], dicts[::97]):
+                self.assertEqual(row['side'], sides[data['trade_type']])
+                self.assertEqual(row['price'], data['transaction_price'])
+                self.assertEqual(row['volume'], data['transaction_volume'])
+                self.assertEqual(row['timestamp'], int(LOCAL_TZ.localize(\
+                    data['exchange_date_time']).timestamp() * 1000))
+
+        def test_o_frame_index(self):
+            """
+            test seek by index gives same frames as sequential reading
+            """
+            import tempfile
+
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+            etalon = QSHParser(path)
+            etalon.touch()
+            frames, times = [], []
+            for data in etalon:
+                frames.append(data)
+                times.append(etalon._frame.data.get('grow_dt'))
+
+            parser = QSHParser(path)
+            self.addCleanup(parser._io_stream.close)
+            index = parser.build_index(every=5000, save=False)
+            self.assertEqual(index.frames, len(frames))
+
+            with tempfile.TemporaryDirectory() as tmp:
+                index.save(os.path.join(tmp, 'index.idx'))
+                loaded = FrameIndex.load(os.path.join(tmp, 'index.idx'), index.size, index.mtime)
+                self.assertListEqual(loaded.checkpoints, json.loads(json.dumps(index.checkpoints)))
+                self.assertIsNone(FrameIndex.load(os.path.join(tmp, 'index.idx')))
+
+            parser._index = loaded
+            for number in [12345, 5000, 40000, 3, 4]:
+                parser.seek_frame(number)
+                self.assertDictEqual(parser.read(), frames[number])
+
+            number = parser.seek_time(times[20000])
+            self.assertDictEqual(parser.read(), frames[number])
+            self.assertEqual(times[number], times[20000])
+            self.assertLess(times[number - 1], times[20000])
+
+        def test_q_records(self):
+            """
+            test records give same data as dicts
+            """
+            for name in ['Trades', 'Quotes']:
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                    '20150302', 'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name))
+                etalon = QSHParser(path)
+                parser = QSHParser(path)
+                self.addCleanup(etalon._io_stream.close)
+                self.addCleanup(parser._io_stream.close)
+                etalon.touch()
+                parser.touch()
+
+                for reuse in [False, True]:
+                    records = parser.iter_records(reuse=reuse)
+                    for _ in range(2000):
+                        record = next(records)
+                        self.assertDictEqual(record.data, etalon.read())
+                        self.assertEqual(str(record), etalon.frame_to_json())
+
+                self.assertFalse(hasattr(record, '__dict__'))
+
+        def test_r_epoch_ms(self):
+            """
+            test epoch ms timestamps mode
+            """
+            for name, key in [('Trades', 'exchange_date_time'), ('Quotes', 'timestamp')]:
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                    '20150302', 'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name))
+                etalon = QSHParser(path)
+                parser = QSHParser(path, timestamps='ms')
+                self.addCleanup(etalon._io_stream.close)
+                self.addCleanup(parser._io_stream.close)
+                etalon.touch()
+                parser.touch()
+
+                frames = [etalon.read() for _ in range(500)]
+                epoch = [parser.read() for _ in range(500)]
+                values = [data[key] for data in epoch]
+                times = epoch_ms_to_local(values)
+
+                for data, data_ms, local in zip(frames, epoch, times):
+                    self.assertIsInstance(data_ms[key], int)
+                    self.assertEqual(local.replace(tzinfo=None),\
+                        data[key].replace(tzinfo=None))
+                    data_ms[key] = data[key]
+                    self.assertDictEqual(data, data_ms)
+
+                self.assertEqual(str(epoch_ms_to_local(values[-1])), str(times[-1]))
+                if np is not None:
+                    self.assertEqual(epoch_ms_to_local(np.array(values))[-1],\
+                        np.datetime64(times[-1].replace(tzinfo=None)))
+
+        def test_p_iter_range(self):
+            """
+            test time range reading
+            """
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+            etalon = QSHParser(path)
+            self.addCleanup(etalon._io_stream.close)
+            etalon.touch()
+            frames = []
+            for data in etalon:
+                frames.append(data)
+                if len(frames) == 3000:
+                    break
+
+            start, end = frames[1000]['timestamp'], frames[2000]['timestamp']
+            parser = QSHParser(path)
+            self.addCleanup(parser._io_stream.close)
+            parser.touch()
+            self.assertListEqual(list(parser.iter_range(start, end)),\
+                [data for data in frames if start <= data['timestamp'] < end])
+            self.assertDictEqual(parser.read(), frames[2000])
+
+            #index is used at first frame only, later range is read from current frame
+            parser = QSHParser(path)
+            self.addCleanup(parser._io_stream.close)
+            parser.touch()
+            parser.build_index(every=500, save=False)
+            self.assertListEqual(list(parser.iter_range(start, end)),\
+                [data for data in frames if start <= data['timestamp'] < end])
+            parser = QSHParser(path)
+            self.addCleanup(parser._io_stream.close)
+            parser.touch()
+            parser.build_index(every=500, save=False)
+            for _ in range(1500):
+                parser.read()
+            self.assertListEqual(list(parser.iter_range(start, end)),\
+                [data for data in frames[1500:] if start <= data['timestamp'] < end])
+
+        @unittest.skipIf(np is None, 'numpy is not installed')
+        def test_n_stocks_columnar(self):
+            """
+            test columnar order book frames are the same as dicts
+            """
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+            etalon = QSHParser(path)
+            columnar = QSHParser(path)
+            self.addCleanup(etalon._io_stream.close)
+            self.addCleanup(columnar._io_stream.close)
+            etalon.touch()
+            columnar.touch()
+
+            batches = columnar.read_stocks_columnar(batch_size=700)
+            first, second = next(batches), next(batches)
+            self.assertEqual(len(first['offsets']), 701)
+            self.assertEqual(second['frame_index'][0], 700)
+
+            for batch in [first, second]:
+                for i, _ms in enumerate(batch['timestamp']):
+                    data = etalon.read()
+                    _from, _to = batch['offsets'][i], batch['offsets'][i + 1]
+                    self.assertEqual(_ms, int(data['timestamp'].timestamp() * 1000))
+                    self.assertListEqual(data['quotes'], [{'rate': rate, 'volume': volume}\
+                        for rate, volume in zip(batch['price'][_from:_to],\
+                            batch['volume'][_from:_to])])
+
+            self.assertDictEqual(etalon.read(), columnar.read())
+
+        def test_s_multi_stream(self):
+            """
+            test multi stream file made from bundled files
+            """
+            import heapq
+            import tempfile
+
+            def leb(value, signed=False):
+                out = bytearray()
+                while True:
+                    byte = value & 127
+                    value >>= 7
+                    if (not signed and not value) or (signed and\
+                        value in (0, -1) and bool(byte & 64) == (value == -1)):
+                        out.append(byte)
+                        return bytes(out)
+                    out.append(byte | 128)
+
+            frames = 3000
+            paths = [os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name))\
+                for name in ['Quotes', 'Trades']]
+            etalons, sources, heads = [], [], []
+            for number, path in enumerate(paths):
+                with open(path, 'rb') as src:
+                    raw = src.read()
+                parser = QSHParser(path)
+                self.addCleanup(parser._io_stream.close)
+                parser.touch()
+                heads.append(raw[parser._header.data['head_len']:parser._io_stream.tell()])
+                items = []
+                for order in range(frames):
+                    time_ms = parser._frame_time(parser._stream_dt.skip(parser._io_stream))
+                    begin = parser._io_stream.tell()
+                    parser._pyload.skip(parser._io_stream)
+                    items.append((time_ms, number, order, raw[begin:parser._io_stream.tell()]))
+                sources.append(items)
+                etalon = QSHParser(path)
+                self.addCleanup(etalon._io_stream.close)
+                etalon.touch()
+                etalons.append([etalon.read() for _ in range(frames)])
+
+            merged = QSHParser(paths[0])
+            self.addCleanup(merged._io_stream.close)
+            merged.touch()
+            head_len = merged._header.data['head_len']
+            with open(paths[0], 'rb') as src:
+                out = bytearray(src.read(head_len))
+            out[head_len - 1] = len(paths)
+            for head in heads:
+                out += head
+
+            last = 0
+            order = []
+            for time_ms, number, _, payload in heapq.merge(*sources):
+                delta = time_ms - merged._start_ms - last
+                last += delta
+                out += leb(delta) if 0 <= delta <= 268435454 else leb(268435455) +\
+                    leb(delta, True)
+                out += bytes([number]) + payload
+                order.append(number)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'multi.qsh')
+                with open(path, 'wb') as dst:
+                    dst.write(out)
+
+                qsh = QSHParser(path)
+                qsh.touch()
+                self.assertEqual([stream.data['type'] for stream in qsh._streams],\
+                    ['Stock', 'Deals'])
+                read = {0: [], 1: []}
+                for number, data in qsh.iter_streams():
+                    read[number].append(data)
+                self.assertEqual(qsh._frame_count, 2*frames)
+                self.assertListEqual(read[0], etalons[0])
+                self.assertListEqual(read[1], etalons[1])
+
+                qsh = QSHParser(path)
+                self.assertListEqual(qsh.subscribe('Deals'), [1])
+                self.assertListEqual(list(qsh), etalons[1])
+                self.assertRaises(ValueError, qsh.subscribe, 'OrdLog')
+
+                qsh = QSHParser(path)
+                qsh.touch()
+                qsh.build_index(every=500, save=False)
+                qsh.seek_frame(order.index(1, 4000))
+                self.assertEqual(qsh.read(), etalons[1][order[:4000].count(1)])
+                qsh._io_stream.close()
+
+                frame = Frame(GrowingDateTime(qsh._header.data['record_start_time']))
+                qsh = QSHParser(path)
+                qsh.touch()
+                frame.read(qsh._io_stream, one_stream=False)
+                self.assertEqual(frame.data['stream'], order[0])
+                qsh._io_stream.close()
+
+        def test_t_other_streams(self):
+            """
+            test OrdLog, AuxInfo and Messages streams
+            """
+            import tempfile
+            uleb, sleb = Uleb128(1).encode_minimal, Sleb128(1).encode_minimal
+
+            def string(text):
+                raw = text.encode('utf-8')
+                return uleb(len(raw)) + raw
+
+            def growing(delta):
+                return uleb(delta) if 0 <= delta <= 268435454 else uleb(268435455) + sleb(delta)
+
+            start = datetime(2015, 3, 2, 10, 0)
+            time_ms = (start - datetime(1, 1, 1)) // timedelta(milliseconds=1)
+            ordlog = [
+                bytes([15]) + uleb(20) + growing(time_ms) + uleb(1000) + sleb(15000) + sleb(10),
+                bytes([251]) + uleb(24) + uleb(5) + sleb(0) + sleb(4) + sleb(6) +\
+                    uleb(500) + sleb(15000) + sleb(7),
+                bytes([2]) + uleb(8192) + sleb(1)]
+            aux = [
+                bytes([255]) + growing(time_ms + 1) + sleb(100) + sleb(200) + sleb(7) +\
+                    sleb(15000) + sleb(16000) + sleb(14000) + struct.pack('<d', 1234.5) +\
+                    struct.pack('<d', 1.0) + string('hi'),
+                bytes([16]) + sleb(-10)]
+            messages = [struct.pack('<q', time_ms * 10000) + bytes([2]) + string('Привет')]
+
+            ordlog_data = [
+                {'exchange_date_time': start, 'flags': 20, 'order_id': 1000, 'price': 15000,\
+                    'amount': 10, 'amount_rest': 10, 'deal_id': None, 'deal_price': None,\
+                    'open_interest': None},
+                {'exchange_date_time': start + timedelta(milliseconds=5), 'flags': 24,\
+                    'order_id': 1000, 'price': 15000, 'amount': 4, 'amount_rest': 6,\
+                    'deal_id': 500, 'deal_price': 15000, 'open_interest': 7},
+                {'exchange_date_time': start + timedelta(milliseconds=5), 'flags': 8192,\
+                    'order_id': 1001, 'price': 15000, 'amount': 4, 'amount_rest': 0,\
+                    'deal_id': None, 'deal_price': None, 'open_interest': None}]
+            aux_data = [
+                {'exchange_date_time': start + timedelta(milliseconds=1), 'price': 15000,\
+                    'ask_total': 100, 'bid_total': 200, 'open_interest': 7, 'hi_limit': 16000,\
+                    'lo_limit': 14000, 'deposit': 1234.5, 'rate': 1.0, 'message': 'hi'},
+                {'exchange_date_time': start + timedelta(milliseconds=1), 'price': 14990,\
+                    'ask_total': 100, 'bid_total': 200, 'open_interest': 7, 'hi_limit': 16000,\
+                    'lo_limit': 14000, 'deposit': 1234.5, 'rate': 1.0, 'message': None}]
+            messages_data = [{'date_time': start, 'message_type': 'WARNING', 'text': 'Привет'}]
+
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+                '20150302', 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+            qsh = QSHParser(path)
+            self.addCleanup(qsh._io_stream.close)
+            qsh.touch()
+            head_len = qsh._header.data['head_len']
+            with open(path, 'rb') as src:
+                head = bytearray(src.read(head_len))
+
+            def write(tmp, name, streams, frames):
+                head[head_len - 1] = len(streams)
+                out = bytes(head) + b''.join(bytes([kind]) + string('TEST') for kind in streams)
+                for number, payload in frames:
+                    out += uleb(0) + (bytes([number]) if len(streams) > 1 else b'') + payload
+                path = os.path.join(tmp, name)
+                with open(path, 'wb') as dst:
+                    dst.write(out)
+                return path
+
+            frames = [(0, ordlog[0]), (1, aux[0]), (2, messages[0]), (0, ordlog[1]),\
+                (1, aux[1]), (0, ordlog[2])]
+            with tempfile.TemporaryDirectory() as tmp:
+                path = write(tmp, 'multi.qsh', [112, 96, 80], frames)
+                qsh = QSHParser(path)
+                qsh.touch()
+                self.assertListEqual([stream.data['type'] for stream in qsh._streams],\
+                    ['OrdLog', 'AuxInfo', 'Messages'])
+                read = {0: [], 1: [], 2: []}
+                for number, data in qsh.iter_streams():
+                    read[number].append(data)
+                self.assertListEqual(read[0], ordlog_data)
+                self.assertListEqual(read[1], aux_data)
+                self.assertListEqual(read[2], messages_data)
+
+                qsh = QSHParser(path)
+                qsh.touch()
+                records = [qsh.read_record().data for _ in frames]
+                qsh._io_stream.close()
+                self.assertListEqual(records[2:3], messages_data)
+                self.assertListEqual([record for record, (number, _) in zip(records, frames)\
+                    if number == 0], ordlog_data)
+                self.assertListEqual([record for record, (number, _) in zip(records, frames)\
+                    if number == 1], aux_data)
+
+                qsh = QSHParser(path, timestamps='ms')
+                qsh.subscribe('OrdLog')
+                self.assertListEqual([data['exchange_date_time'] for data in qsh],\
+                    [qsh._to_epoch_ms(data['exchange_date_time']) for data in ordlog_data])
+
+                path = write(tmp, 'ordlog.qsh', [112], [item for item in frames if not item[0]])
+                qsh = QSHParser(path)
+                qsh.touch()
+                batch = next(qsh.read_ordlog_columnar())
+                self.assertListEqual(batch['amount_rest'].tolist(), [10, 6, 0])
+                self.assertListEqual(batch['deal_id'].tolist(), [0, 500, 500])
+                self.assertListEqual(batch['timestamp'].tolist(),\
+                    [qsh._to_epoch_ms(data['exchange_date_time']) for data in ordlog_data])
+                self.assertRaises(FileSignatureError, qsh.read_trades_columnar)
+                qsh._io_stream.close()
+
+                #add A, add B, cancel A, add C, add D without number, cancel C:
+                #numbers of not added orders are relative to last added one
+                orders = [bytes([2]) + uleb(4) + growing(100), bytes([2]) + uleb(4) + growing(5),\
+                    bytes([2]) + uleb(8192) + sleb(-5), bytes([2]) + uleb(4) + growing(1),\
+                    bytes([0]) + uleb(4), bytes([2]) + uleb(8192) + sleb(-1)]
+                ids = [100, 105, 100, 106, 107, 106]
+                path = write(tmp, 'orders.qsh', [112], [(0, order) for order in orders])
+                qsh = QSHParser(path)
+                qsh.touch()
+                self.assertListEqual([data['order_id'] for data in qsh], ids)
+                qsh = QSHParser(path)
+                qsh.touch()
+                self.assertListEqual(next(qsh.read_ordlog_columnar())['order_id'].tolist(), ids)
+                qsh._io_stream.close()
+                qsh = QSHParser(path)
+                qsh.build_index(every=3, save=False)
+                qsh.seek_frame(3)
+                self.assertListEqual([qsh.read()['order_id'] for _ in range(3)], ids[3:])
+                qsh._io_stream.close()
+
     suite = unittest.TestSuite()
     suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(TestTypeClassess))
     unittest.TextTestRunner().run(suite)
@@ -906,7 +3554,11 @@ def _if__name__is__main():
     arg = sys.argv
     help_msg = """Input next arguments:\n
         --run_self_test - for run unittests;\n
-        --read_file full_path_to_file - for read from file.\n"""
+        --read_file full_path_to_file [datetime|ms] [out_file] [json|orjson] - for read
+            from file, ms - time as unix epoch milliseconds, out_file - output file
+            or pipe (- for stdout), orjson - compact encoder if installed;\n
+        --read_dir dir_or_glob [workers] - for read files in parallel;\n
+        --to_parquet file_dir_or_glob out_dir [workers] - for convert to parquet.\n"""
 
     if len(arg) == 1:
         print(help_msg)
@@ -914,7 +3566,11 @@ def _if__name__is__main():
         if '--run_self_test' in arg[1]:
             _run_unittests()
         elif '--read_file' in arg[1]:
-            _read_mode(arg[2])
+            _read_mode(*arg[2:6])
+        elif '--read_dir' in arg[1]:
+            _read_dir_mode(*arg[2:4])
+        elif '--to_parquet' in arg[1]:
+            _to_parquet_mode(*arg[2:5])
         else:
             print(help_msg)
 
@@ -0,0 +1,312 @@
+"""
+    Параллельная обработка множества файлов qsh пулом процессов.
+
+    Файлы раздаются процессам ProcessPoolExecutor, результаты возвращаются
+    в порядке входных файлов, в обработке одновременно находится не больше
+    max_in_flight файлов - память ограничена их результатами.
+
+    Один большой файл тоже можно разобрать параллельно: первый быстрый
+    проход строит индекс кадров с состоянием декодера (FrameIndex), затем
+    участки между контрольными точками разбираются в разных процессах.
+"""
+import os
+import sys
+import json
+import glob
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from qsh_parser import QSHParser, InflateReader, FileNotExists
+
+QSH_PATTERNS = ['*.qsh', '*.qsh.gz']
+#keys of frame dicts with datetime values
+TIME_KEYS = ('timestamp', 'exchange_date_time', 'date_time')
+
+
+def expand_paths(source):
+    """
+    Files list from directory, glob pattern, file or list of them
+    source: path, pattern or iterable of them
+    return: sorted unique paths
+    """
+    if not isinstance(source, str):
+        out = []
+        for item in source:
+            out.extend(expand_paths(item))
+        return sorted(set(out))
+
+    if os.path.isdir(source):
+        out = []
+        for pattern in QSH_PATTERNS:
+            out.extend(glob.glob(os.path.join(source, pattern)))
+        return sorted(out)
+
+    if os.path.isfile(source):
+        return [source]
+
+    out = sorted(glob.glob(source))
+    if not out:
+        msg = u'Файлы по пути {0} не найдены'.format(source)
+        raise FileNotExists(msg)
+    return out
+
+
+def map_files(func, source, workers=None, max_in_flight=None):
+    """
+    Apply func to every file in worker processes
+    func: module level function of one argument - file path
+    source: see expand_paths
+    workers: processes number, cpu number by default
+    max_in_flight: files processed or waiting for caller at once,
+        twice workers number by default
+    return: generator of (path, result) in files order
+    """
+    for path, result in _imap_ordered(func, [(path,) for path in expand_paths(source)],\
+        workers, max_in_flight):
+        yield path[0], result
+
+
+def _imap_ordered(func, calls, workers=None, max_in_flight=None):
+    """
+    Run func(*args) for every args of calls in process pool
+    return: generator of (args, result) in calls order
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for args in calls:
+            if len(pending) >= max_in_flight:
+                done, future = pending.popleft()
+                yield done, future.result()
+            pending.append((args, pool.submit(func, *args)))
+
+        while pending:
+            done, future = pending.popleft()
+            yield done, future.result()
+
+
+def decode_range(path, checkpoint, stop, timestamps='datetime'):
+    """
+    Decode frames from checkpoint to stop frame number into json lines text:
+    one string is pickled to parent much faster than list of frame dicts
+    checkpoint: FrameIndex checkpoint
+    timestamps: see QSHParser
+    """
+    qsh = QSHParser(path, timestamps=timestamps)
+    qsh.restore_checkpoint(checkpoint)
+    out = []
+    while qsh._frame_count < stop:
+        qsh.read()
+        out.append(qsh.frame_to_json())
+    qsh._io_stream.close()
+    return '\n'.join(out) + '\n' if out else ''
+
+
+def frames_from_json(text, timestamps='datetime'):
+    """
+    Frame dicts of decode_range text, they are built on iteration
+    timestamps: see QSHParser, for datetime frame times are parsed back
+        from iso format
+    return: generator of frames equal to QSHParser ones
+    """
+    for line in text.split('\n'):
+        if not line:
+            continue
+        data = json.loads(line)
+        if timestamps == 'datetime':
+            for key in TIME_KEYS:
+                if isinstance(data.get(key), str):
+                    data[key] = datetime.fromisoformat(data[key])
+        yield data
+
+
+def read_parallel(path, workers=None, every=1000, as_json=False, max_in_flight=None,\
+    index=None, timestamps='datetime'):
+    """
+    Decode one file in worker processes
+    path: not compressed qsh file - compressed one can't be sought, every
+        worker would inflate it from the beginning
+    workers: processes number, cpu number by default
+    every: frames between index checkpoints for new index
+    index: FrameIndex of file, by default it is loaded or built by first pass
+    as_json: yield json lines text of ranges instead of frames
+    timestamps: see QSHParser
+    return: generator of frames (or text chunks) in file order
+    Workers send json text of ranges - pickling of it is negligible,
+    frames are built from it in caller process on iteration. as_json
+    reading scales about linearly with workers; frames reading is bounded
+    by json parsing in caller, it takes about 60% of sequential decoding
+    time of bundled files, so speedup is up to about 1.6 times and 2
+    workers give most of it.
+    """
+    workers = workers or os.cpu_count() or 1
+    qsh = QSHParser(path)
+    try:
+        if isinstance(qsh._io_stream._raw, InflateReader):
+            msg = 'Compressed file {} can`t be read in parallel, decompress it'\
+                ' or use map_files for many files'.format(path)
+            raise ValueError(msg)
+        index = index or qsh.load_index(every)
+    finally:
+        qsh._io_stream.close()
+
+    #several ranges per worker to even out uneven frames
+    step = max(len(index.checkpoints) // (4 * workers), 1)
+    starts = index.checkpoints[::step]
+    stops = [checkpoint[0] for checkpoint in starts[1:]] + [index.frames]
+
+    calls = [(path, start, stop, timestamps) for start, stop in zip(starts, stops)]
+    for _, text in _imap_ordered(decode_range, calls, workers, max_in_flight):
+        if as_json:
+            yield text
+        else:
+            yield from frames_from_json(text, timestamps)
+
+
+def dump_json(path, out_path):
+    """
+    Write file as --read_file text: header and json line per frame
+    out_path: output file
+    return: frames number
+    """
+    from qsh_export import write_json_lines
+    return write_json_lines(path, out_path)
+
+
+def dump_json_files(source, out=None, workers=None, max_in_flight=None):
+    """
+    --read_file text of many files in files order: workers write text of
+    files into temporary files, they are copied to out in order and removed,
+    so memory does not depend on files size
+    source: see expand_paths
+    out: binary file object, stdout by default
+    return: generator of (path, frames number)
+    """
+    out = out or sys.stdout.buffer
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = [(path, os.path.join(tmp, '{}.jsonl'.format(number)))\
+            for number, path in enumerate(expand_paths(source))]
+        for (path, text_path), frames in _imap_ordered(dump_json, calls, workers,\
+            max_in_flight):
+            with open(text_path, 'rb') as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+            os.remove(text_path)
+            yield path, frames
+
+
+def count_frames(path):
+    """
+    Frames number in file
+    """
+    qsh = QSHParser(path)
+    qsh.touch()
+    while True:
+        try:
+            qsh._skip_frame()
+        except StopIteration:
+            qsh._io_stream.close()
+            return qsh._frame_count
+
+
+class TestPool(unittest.TestCase):
+    """
+    pool tests
+    """
+    def setUp(self):
+        """
+        bundled files
+        """
+        self.source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+
+    def test_expand_paths(self):
+        """
+        directory and pattern give same files
+        """
+        paths = expand_paths(self.source)
+        self.assertEqual(len(paths), 2)
+        self.assertListEqual(paths, expand_paths(os.path.join(self.source, 'GAZP.*.qsh')))
+        self.assertListEqual(paths, expand_paths(paths[::-1]))
+        self.assertRaises(FileNotExists, expand_paths, os.path.join(self.source, '*.none'))
+
+    def test_map_files(self):
+        """
+        results are in files order
+        """
+        results = list(map_files(count_frames, self.source, workers=2, max_in_flight=1))
+        self.assertListEqual([path for path, _ in results], expand_paths(self.source))
+        self.assertListEqual([frames for _, frames in results], [123659, 41425])
+
+    def test_dump_json_files(self):
+        """
+        text of files is the same as --read_file one in files order
+        """
+        from io import BytesIO
+        from qsh_export import write_json_lines
+        out, etalon = BytesIO(), BytesIO()
+        results = list(dump_json_files(self.source, out, workers=2, max_in_flight=1))
+        self.assertListEqual([frames for _, frames in results], [123659, 41425])
+        for path, _ in results:
+            write_json_lines(path, etalon)
+        self.assertEqual(out.getvalue(), etalon.getvalue())
+
+    def test_read_parallel(self):
+        """
+        frames decoded in parallel are the same as sequential ones
+        """
+        path = os.path.join(self.source, 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        etalon = QSHParser(path)
+        etalon.touch()
+        frames = list(etalon)
+
+        parser = QSHParser(path)
+        self.addCleanup(parser._io_stream.close)
+        index = parser.build_index(every=1000, save=False)
+        self.assertListEqual(list(read_parallel(path, workers=2, index=index)), frames)
+
+        etalon = QSHParser(path, timestamps='ms')
+        etalon.touch()
+        self.assertListEqual(list(read_parallel(path, workers=2, index=index,\
+            timestamps='ms')), list(etalon))
+
+    def test_frames_from_json(self):
+        """
+        frames of range text are the same as parser ones
+        """
+        path = os.path.join(self.source, 'GAZP.Qscalp.Quotes.2015-03-02.qsh')
+        parser = QSHParser(path)
+        self.addCleanup(parser._io_stream.close)
+        index = parser.build_index(every=1000, save=False)
+        checkpoint, stop = index.checkpoints[3], index.checkpoints[4][0]
+
+        for timestamps in ['datetime', 'ms']:
+            etalon = QSHParser(path, timestamps=timestamps)
+            self.addCleanup(etalon._io_stream.close)
+            etalon.restore_checkpoint(checkpoint)
+            frames = [etalon.read() for _ in range(stop - checkpoint[0])]
+            text = decode_range(path, checkpoint, stop, timestamps)
+            self.assertListEqual(list(frames_from_json(text, timestamps)), frames)
+
+    def test_read_parallel_compressed(self):
+        """
+        compressed file is rejected before workers start
+        """
+        import gzip
+        import shutil
+        import tempfile
+
+        path = os.path.join(self.source, 'GAZP.Qscalp.Trades.2015-03-02.qsh')
+        with tempfile.TemporaryDirectory() as tmp:
+            packed = os.path.join(tmp, 'trades.qsh.gz')
+            with open(path, 'rb') as raw, gzip.open(packed, 'wb') as out:
+                shutil.copyfileobj(raw, out)
+            self.assertRaises(ValueError, next, read_parallel(packed, workers=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+    Воспроизведение файлов qsh в темпе реального времени.
+
+    Кадры нескольких файлов сливаются по времени кадра (куча), разбор идет
+    заранее в отдельном потоке с ограниченным буфером, а выдача кадров
+    привязана к монотонным часам с множителем скорости: 1 - реальное
+    время, 10 - в десять раз быстрее, None - без ожидания.
+"""
+import os
+import time
+import queue
+import threading
+import unittest
+from datetime import datetime
+
+from qsh_parser import QSHParser
+from qsh_merge import merge
+
+#конец данных в очереди
+_DONE = object()
+
+
+class Replay:
+    """
+    for time_ms, source, data in Replay(parsers, speed=10): ...
+    """
+    def __init__(self, parsers, speed=1.0, read_ahead=8192, chunk=256,\
+        start=None, end=None, spin=0.002, max_bytes=256 << 20):
+        """
+        parsers: QSHParser list, source number is index in list
+        speed: replay speed multiplier, None - as fast as possible
+        read_ahead: decoded frames buffered ahead of wall clock
+        chunk: frames passed from decoding thread at once
+        start, end: frame time range, epoch ms or datetime (Moscow if naive)
+        spin: last seconds before frame time are waited in busy loop,
+            sleep precision of os is worse than this
+        max_bytes: memory for merge buffers, see qsh_merge.merge
+        """
+        if speed is not None and speed <= 0:
+            msg = 'Replay speed should be positive, got {}'.format(speed)
+            raise ValueError(msg)
+
+        self._parsers = parsers
+        self.speed = speed
+        self._chunk = max(chunk, 1)
+        self._queue = queue.Queue(max(read_ahead // self._chunk, 1))
+        self._start = start
+        self._end = end
+        self._spin = spin
+        self._max_bytes = max_bytes
+        self._stop = threading.Event()
+        #max lateness of frame emission in seconds and late frames number
+        self.max_lag = 0.0
+        self.late = 0
+        self.frames = 0
+
+    def merged(self):
+        """
+        Frames of all parsers ordered by frame time without pacing
+        return: generator of (time_ms, source, data)
+        """
+        return merge(self._parsers, self._max_bytes, start=self._start, end=self._end)
+
+    def _produce(self):
+        """
+        Decode and merge frames in background thread
+        """
+        try:
+            chunk = []
+            for item in self.merged():
+                chunk.append(item)
+                if len(chunk) >= self._chunk:
+                    self._put(chunk)
+                    chunk = []
+                    if self._stop.is_set():
+                        return
+            if chunk:
+                self._put(chunk)
+            self._put(_DONE)
+        except BaseException as error:
+            self._put(error)
+
+    def _put(self, item):
+        """
+        put with periodic stop check
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _wait(self, due):
+        """
+        Wait till monotonic time due: sleep, then spin for precision
+        return: lateness in seconds
+        """
+        while True:
+            left = due - time.monotonic()
+            if left <= 0:
+                return -left
+            if left > self._spin:
+                time.sleep(left - self._spin)
+
+    def __iter__(self):
+        """
+        Paced frames
+        """
+        self._stop.clear()
+        worker = threading.Thread(target=self._produce, name='qsh-replay', daemon=True)
+        worker.start()
+
+        origin = None
+        scale = None if self.speed is None else 1.0 / (1000.0 * self.speed)
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is _DONE:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+
+                for item in chunk:
+                    if scale is not None:
+                        if origin is None:
+                            origin = (item[0], time.monotonic())
+                        lag = self._wait(origin[1] + (item[0] - origin[0]) * scale)
+                        if lag > self.max_lag:
+                            self.max_lag = lag
+                        if lag > 0.001:
+                            self.late += 1
+                    self.frames += 1
+                    yield item
+        finally:
+            self._stop.set()
+            worker.join()
+
+    def run(self, callback):
+        """
+        Call callback(time_ms, source, data) for every paced frame
+        return: frames number
+        """
+        for item in self:
+            callback(*item)
+        return self.frames
+
+
+class TestReplay(unittest.TestCase):
+    """
+    replay tests
+    """
+    def setUp(self):
+        """
+        bundled files
+        """
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+        self.paths = [os.path.join(source, 'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name))\
+            for name in ['Quotes', 'Trades']]
+        self.start = datetime(2015, 3, 2, 10, 0)
+        self.end = datetime(2015, 3, 2, 10, 0, 30)
+
+    def _parser(self, path):
+        """
+        parser closed after test
+        """
+        parser = QSHParser(path)
+        self.addCleanup(parser._io_stream.close)
+        return parser
+
+    def test_merge(self):
+        """
+        merged frames are time ordered and complete
+        """
+        replay = Replay([self._parser(path) for path in self.paths], speed=None,\
+            start=self.start, end=self.end)
+        items = list(replay)
+        self.assertListEqual(items, sorted(items, key=lambda item: item[:2]))
+
+        for number, path in enumerate(self.paths):
+            parser = self._parser(path)
+            self.assertListEqual([data for _, source, data in items if source == number],\
+                list(parser.iter_range(self.start, self.end)))
+
+    def test_pacing(self):
+        """
+        30 seconds at 300x take 0.1 second
+        """
+        replay = Replay([self._parser(path) for path in self.paths], speed=300,\
+            start=self.start, end=self.end)
+        began = time.monotonic()
+        items = list(replay)
+        elapsed = time.monotonic() - began
+        span = (items[-1][0] - items[0][0]) / 1000.0 / 300
+        self.assertGreaterEqual(elapsed, span)
+        self.assertLess(replay.max_lag, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,808 @@
+"""
+    Запись файлов qsh версии 4: заголовок, потоки, кадры, сделки (Deals)
+    и котировки (Stock).
+
+    Кодирование обратно разбору в qsh_parser:
+        - время кадра - Growing от времени начала записи в заголовке
+          (абсолютное время в мс от 0001-01-01 по Москве, если кадр
+          раньше начала или позже двух суток от него);
+        - Growing: uleb128(d) при 0 <= d <= 268435454,
+          иначе uleb128(268435455) и sleb128(d);
+        - Relative - sleb128 разности с предыдущим значением;
+        - числа кодируются кратчайшей последовательностью байт
+          (leb_128 encode_minimal), частые малые значения берутся из таблиц;
+          пачки кадров (write_trades, write_stocks) кодируются векторно numpy.
+
+    Поля сделки пишутся, если они заданы и изменились (или заданы маской),
+    поэтому выборка из файла (час, одна сторона) остается корректной.
+    Выборка котировок начинается снимком стакана на начало интервала.
+"""
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from leb_128 import Uleb128, Sleb128
+from qsh_parser import QSHParser, Trades, Stocks, FileSignatureError, STREAM_TYPES,\
+    TRADES_DTYPE, MISSING_I8, LOCAL_TZ, EPOCH_MS, np, epoch_ms_to_local, _local_tz_for_hour
+from order_book import OrderBook
+
+SIGNATURE = b'QScalp History Data'
+FORMAT_VERSION = 4
+
+#граница двух суток, меньшие значения Growing - от начала записи
+_DAYS_2_MS = 172800000
+_GROWING_MAX = 268435454
+
+_uleb128 = Uleb128(4)
+_sleb128 = Sleb128(8)
+#кодировки малых значений: uleb [0, 2**14), sleb [-2**13, 2**13)
+_ULEB = [_uleb128.encode_minimal(number) for number in range(1 << 14)]
+_SLEB = [_sleb128.encode_minimal(number) for number in range(-(1 << 13), 1 << 13)]
+_ESCAPE = _uleb128.encode_minimal(_GROWING_MAX + 1)
+
+#виды значений для encode_leb
+_ULEB_KIND, _SLEB_KIND, _RAW = 0, 1, 2
+
+_STREAM_CODES = {name: code for code, name in STREAM_TYPES.items()}
+_SIDES = {'UNKNOWN': 0, 'ASK': 1, 'BID': 2}
+
+
+def uleb(number):
+    """
+    shortest uleb128 bytes
+    """
+    if 0 <= number < 16384:
+        return _ULEB[number]
+    return _uleb128.encode_minimal(number)
+
+
+def sleb(number):
+    """
+    shortest sleb128 bytes
+    """
+    if -8192 <= number < 8192:
+        return _SLEB[number + 8192]
+    return _sleb128.encode_minimal(number)
+
+
+def growing(delta):
+    """
+    Growing bytes of difference with previous value
+    """
+    if 0 <= delta <= _GROWING_MAX:
+        return _ULEB[delta] if delta < 16384 else _uleb128.encode_minimal(delta)
+    return _ESCAPE + sleb(delta)
+
+
+def _growing_slots(deltas, present):
+    """
+    Growing as two slots: uleb of delta or escape, sleb of escaped delta
+    present: (rows, 2) bool array, second slot is cleared if not escaped
+    return: values (rows, 2), kinds (rows, 2)
+    """
+    escaped = (deltas < 0) | (deltas > _GROWING_MAX)
+    values = np.empty((len(deltas), 2), dtype='i8')
+    values[:, 0] = np.where(escaped, _GROWING_MAX + 1, deltas)
+    values[:, 1] = deltas
+    present[:, 1] &= escaped
+    kinds = np.empty((len(deltas), 2), dtype='i1')
+    kinds[:, 0], kinds[:, 1] = _ULEB_KIND, _SLEB_KIND
+    return values, kinds
+
+
+def encode_leb(values, kinds):
+    """
+    Vectorized shortest encoding of int64 array into one bytes sequence
+    kinds: per value _ULEB_KIND, _SLEB_KIND or _RAW (one byte as is)
+    """
+    values = np.asarray(values, dtype='i8')
+    signed = kinds == _SLEB_KIND
+    raw = kinds == _RAW
+    sizes = np.ones(len(values), dtype='i8')
+    for group in range(1, 10):
+        high = values >> (7 * group - 1)
+        more = np.where(signed, (high != 0) & (high != -1), (high >> 1) != 0) & ~raw
+        if not more.any():
+            break
+        sizes += more
+
+    ends = np.cumsum(sizes)
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype='u1')
+    starts = ends - sizes
+    out[starts] = np.where(raw, values, (values & 127) | ((sizes > 1) << 7))
+    #next groups are written only for values still having them
+    index = np.flatnonzero(sizes > 1)
+    for group in range(1, 10):
+        if not len(index):
+            break
+        rest = sizes[index]
+        out[starts[index] + group] = ((values[index] >> (7 * group)) & 127) |\
+            ((rest > group + 1) << 7)
+        index = index[rest > group + 1]
+    return out.tobytes()
+
+
+def string(text):
+    """
+    String bytes: uleb128 length and utf8
+    """
+    raw = text.encode('utf-8')
+    return uleb(len(raw)) + raw
+
+
+def _epoch_ms(value):
+    """
+    epoch ms of epoch ms, aware datetime or naive Moscow datetime
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = LOCAL_TZ.localize(value)
+        return int(round(value.timestamp() * 1000))
+    return int(value)
+
+
+class QSHWriter:
+    """
+    with QSHWriter(path, [('Deals', 'GAZP')], start) as writer:
+        writer.write_trade(time_ms, price, volume, 'BID')
+    """
+    def __init__(self, out, streams, record_start_time, app_name='qsh_parser',\
+        user_comment='', buffer_size=1 << 20):
+        """
+        out: path or binary file object
+        streams: list of (type, tool), type is Stock or Deals (name or code),
+            frame stream number is index in list
+        record_start_time: epoch ms, aware datetime or naive Moscow datetime
+        app_name, user_comment: header strings
+        buffer_size: bytes collected before write to out
+        """
+        if not streams or len(streams) > 255:
+            msg = 'Streams number should be from 1 to 255, got {}'.format(len(streams))
+            raise ValueError(msg)
+
+        self._types = []
+        for _type, _ in streams:
+            _type = STREAM_TYPES.get(_type, _type)
+            if _type not in ['Stock', 'Deals']:
+                msg = 'Writing of {} stream is not supported'.format(_type)
+                raise ValueError(msg)
+            self._types.append(_type)
+
+        self._own = isinstance(out, (str, bytes, os.PathLike))
+        self._out = open(out, 'wb') if self._own else out
+        self._buffer_size = buffer_size
+        self._multi = len(streams) > 1
+
+        self.start_ms = _epoch_ms(record_start_time)
+        self.offset_ms = int(_local_tz_for_hour(self.start_ms // 3600000)[1].\
+            total_seconds()) * 1000
+        #local ms from 0001-01-01 minus epoch ms
+        self._shift = EPOCH_MS + self.offset_ms
+
+        self._frame_last = 0
+        self._frame_absolute = False
+        #Stock: last rate; Deals: exchange time, number, order id, price,
+        #volume, open interest
+        self._states = [[0] if _type == 'Stock' else [0, 0, 0, 0, None, 0]\
+            for _type in self._types]
+        self.frames = 0
+
+        self._buf = bytearray(SIGNATURE)
+        self._buf.append(FORMAT_VERSION)
+        self._buf += string(app_name) + string(user_comment)
+        self._buf += struct.pack('<q', (self.start_ms + EPOCH_MS) * 10000)
+        self._buf.append(len(streams))
+        for (_, tool), _type in zip(streams, self._types):
+            self._buf.append(_STREAM_CODES[_type])
+            self._buf += string(tool)
+
+    def _check(self, stream, _type):
+        """
+        stream number of type
+        """
+        if self._types[stream] != _type:
+            msg = 'Stream {} is {}, not {}'.format(stream, self._types[stream], _type)
+            raise FileSignatureError(msg)
+
+    def _frame_value(self, time_ms):
+        """
+        GrowingDateTime value of frame time
+        """
+        value = time_ms - self.start_ms
+        if self._frame_absolute or not 0 <= value < _DAYS_2_MS:
+            #absolute time is kept: relative values would be counted from it
+            self._frame_absolute = True
+            value = time_ms + self._shift
+        return value
+
+    def _frame(self, buf, time_ms, stream):
+        """
+        frame header: time and stream number for multi stream file
+        """
+        value = self._frame_value(time_ms)
+        buf += growing(value - self._frame_last)
+        self._frame_last = value
+        if self._multi:
+            buf.append(stream)
+        self.frames += 1
+
+    def write_quotes(self, time_ms, prices, volumes, stream=0):
+        """
+        Write Stock frame
+        time_ms: frame time, epoch ms
+        prices, volumes: quote deltas - volume > 0 ask, < 0 bid, 0 remove
+        """
+        self._check(stream, 'Stock')
+        buf = self._buf
+        self._frame(buf, time_ms, stream)
+        state = self._states[stream]
+        last = state[0]
+        buf += sleb(len(prices))
+        for price, volume in zip(prices, volumes):
+            buf += sleb(price - last)
+            buf += sleb(volume)
+            last = price
+        state[0] = last
+        if len(buf) >= self._buffer_size:
+            self.flush()
+
+    def write_trade(self, time_ms, price=None, volume=None, side=0, exchange_ms=None,\
+        trade_number=None, order_id=None, open_interest=None, stream=0, mask=None):
+        """
+        Write Deals frame
+        time_ms: frame time, epoch ms
+        side: 0 or UNKNOWN, 1 or ASK, 2 or BID
+        exchange_ms: exchange time, epoch ms
+        price, volume, trade_number, order_id, open_interest: None - not written,
+            unchanged values are not written too
+        mask: record bits to write even if values are unchanged
+        """
+        self._check(stream, 'Deals')
+        side = _SIDES.get(side, side)
+        state = self._states[stream]
+        values = [None if exchange_ms is None else exchange_ms + self._shift,\
+            trade_number, order_id, price, volume, open_interest]
+
+        bits = side
+        for index, (bit, value) in enumerate(zip((4, 8, 16, 32, 64, 128), values)):
+            if value is not None and (value != state[index] or (mask or 0) & bit):
+                bits |= bit
+
+        buf = self._buf
+        self._frame(buf, time_ms, stream)
+        buf.append(bits)
+        if bits & 4:
+            buf += growing(values[0] - state[0])
+        if bits & 8:
+            buf += growing(values[1] - state[1])
+        for index, bit in [(2, 16), (3, 32)]:
+            if bits & bit:
+                buf += sleb(values[index] - state[index])
+        if bits & 64:
+            buf += sleb(values[4])
+        if bits & 128:
+            buf += sleb(values[5] - state[5])
+        for index, bit in enumerate((4, 8, 16, 32, 64, 128)):
+            if bits & bit:
+                state[index] = values[index]
+
+        if len(buf) >= self._buffer_size:
+            self.flush()
+
+    def _frame_values(self, times):
+        """
+        GrowingDateTime values of frame times array, absolute mode starts
+        at first time out of two days from record start
+        """
+        values = times - self.start_ms
+        if self._frame_absolute:
+            return times + self._shift
+        outside = np.flatnonzero((values < 0) | (values >= _DAYS_2_MS))
+        if len(outside):
+            self._frame_absolute = True
+            values[outside[0]:] = times[outside[0]:] + self._shift
+        return values
+
+    def _frame_slots(self, times, stream):
+        """
+        frame header slots (rows, 3): Growing time (2 slots), stream byte
+        return: values, kinds, present
+        """
+        values = self._frame_values(np.array(times, dtype='i8'))
+        deltas = np.diff(values, prepend=self._frame_last)
+        self._frame_last = int(values[-1])
+        self.frames += len(values)
+
+        slots = np.empty((len(values), 3), dtype='i8')
+        present = np.ones((len(values), 3), dtype=bool)
+        slots[:, 0:2], kinds = _growing_slots(deltas, present[:, 0:2])
+        slots[:, 2] = stream
+        present[:, 2] = self._multi
+        return slots, np.hstack([kinds, np.full((len(values), 1), _RAW)]), present
+
+    def write_trades(self, batch, frame_time=None, stream=0):
+        """
+        Write Deals frames of structured array with TRADES_DTYPE
+        (QSHParser.read_trades_columnar): fields of mask bits and changed
+        fields are written, frames are encoded vectorized, MISSING_I8
+        timestamp and price are not written
+        frame_time: frame times, exchange times by default
+        """
+        self._check(stream, 'Deals')
+        if not len(batch):
+            return
+
+        if frame_time is None and np.any(batch['timestamp'] == MISSING_I8):
+            msg = 'Frame time is required for trades without exchange time'
+            raise ValueError(msg)
+
+        state = self._states[stream]
+        size = len(batch)
+        frame, frame_kinds, frame_present = self._frame_slots(\
+            batch['timestamp'] if frame_time is None else frame_time, stream)
+
+        mask = batch['mask'].astype('i8')
+        deltas = []
+        for index, (bit, name) in enumerate(zip((4, 8, 16, 32, 64, 128), ['timestamp',\
+            'trade_number', 'order_id', 'price', 'volume', 'open_interest'])):
+            last = 0 if state[index] is None else state[index]
+            column = batch[name] + self._shift if bit == 4 else batch[name]
+            missing = None
+            if name in ['timestamp', 'price']:
+                missing = batch[name] == MISSING_I8
+                column = np.where(missing, last, column)
+            previous = np.concatenate(([last], column[:-1]))
+            changed = column != previous
+            if state[index] is None:
+                changed[0] = True
+            if missing is not None:
+                changed &= ~missing
+            mask |= changed * bit
+            deltas.append(column if bit == 64 else column - previous)
+            if missing is None or not missing[-1]:
+                state[index] = int(column[-1])
+
+        #frame (3), mask, time (2), number (2), order id, price, volume, oi
+        slots = np.empty((size, 12), dtype='i8')
+        kinds = np.full((size, 12), _SLEB_KIND, dtype='i1')
+        present = np.empty((size, 12), dtype=bool)
+        slots[:, :3], kinds[:, :3], present[:, :3] = frame, frame_kinds, frame_present
+        slots[:, 3], kinds[:, 3], present[:, 3] = mask, _RAW, True
+        for column, (index, bit) in enumerate([(4, 4), (6, 8)]):
+            present[:, index:index + 2] = (mask & bit).astype(bool)[:, None]
+            slots[:, index:index + 2], kinds[:, index:index + 2] =\
+                _growing_slots(deltas[column], present[:, index:index + 2])
+        for column, (index, bit) in enumerate([(8, 16), (9, 32), (10, 64), (11, 128)], 2):
+            slots[:, index] = deltas[column]
+            present[:, index] = (mask & bit).astype(bool)
+
+        self._buf += encode_leb(slots[present], kinds[present])
+        if len(self._buf) >= self._buffer_size:
+            self.flush()
+
+    def write_stocks(self, batch, stream=0):
+        """
+        Write Stock frames of QSHParser.read_stocks_columnar batch:
+        timestamp, offsets, price, volume; frames are encoded vectorized
+        """
+        self._check(stream, 'Stock')
+        times = batch['timestamp']
+        if not len(times):
+            return
+
+        state = self._states[stream]
+        frame, frame_kinds, frame_present = self._frame_slots(times, stream)
+        offsets = np.asarray(batch['offsets'], dtype='i8')
+        offsets = offsets - offsets[0]
+        counts = np.diff(offsets)
+        prices = np.asarray(batch['price'], dtype='i8')[:offsets[-1]]
+        volumes = np.asarray(batch['volume'], dtype='i8')[:offsets[-1]]
+
+        #frame: 3 frame slots and quotes number, then 2 slots per quote
+        frames = len(times)
+        starts = 4 * np.arange(frames, dtype='i8') + 2 * offsets[:-1]
+        total = 4 * frames + 2 * int(offsets[-1])
+        slots = np.empty(total, dtype='i8')
+        kinds = np.full(total, _SLEB_KIND, dtype='i1')
+        present = np.ones(total, dtype=bool)
+        for index in range(3):
+            slots[starts + index] = frame[:, index]
+            kinds[starts + index] = frame_kinds[:, index]
+            present[starts + index] = frame_present[:, index]
+        slots[starts + 3] = counts
+
+        if len(prices):
+            quote_frames = np.repeat(np.arange(frames), counts)
+            positions = starts[quote_frames] + 4 + 2 * (np.arange(len(prices)) -\
+                offsets[quote_frames])
+            slots[positions] = np.diff(prices, prepend=state[0])
+            slots[positions + 1] = volumes
+            state[0] = int(prices[-1])
+
+        self._buf += encode_leb(slots[present], kinds[present])
+        if len(self._buf) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        write buffer to out
+        """
+        if self._buf:
+            self._out.write(self._buf)
+            self._buf = bytearray()
+
+    def close(self):
+        """
+        flush and close own file
+        """
+        self.flush()
+        if self._own:
+            self._out.close()
+        else:
+            self._out.flush()
+
+    def __enter__(self):
+        """
+        context manager
+        """
+        return self
+
+    def __exit__(self, *args):
+        """
+        close on exit
+        """
+        self.close()
+
+
+def export(path, out_path, start=None, end=None, side=None, batch_size=65536):
+    """
+    Write subset of one stream Deals or Stock file
+    start, end: frame time range [start, end), epoch ms, aware datetime
+        or naive Moscow datetime, None - no limit
+    side: ASK or BID - trades of this side only or one side of order book
+    return: written frames number
+    """
+    if np is None:
+        raise ImportError('numpy is required for export')
+
+    if side is not None and side not in ['ASK', 'BID']:
+        msg = 'Unknown side {}, use ASK or BID'.format(side)
+        raise ValueError(msg)
+
+    _start = None if start is None else _epoch_ms(start)
+    _end = None if end is None else _epoch_ms(end)
+    tmp = out_path + '.tmp-{}'.format(os.getpid())
+
+    qsh = QSHParser(path)
+    try:
+        qsh.touch()
+        if qsh._multi or not isinstance(qsh._pyload, (Trades, Stocks)):
+            msg = 'File {} is not a one Deals or Stock stream file'.format(path)
+            raise FileSignatureError(msg)
+
+        header = qsh._header.data
+        stream = qsh._stream.data
+        with QSHWriter(tmp, [(stream['type'], stream['tool'])], header['record_start_time'],\
+            header['app_name'], header['user_comment']) as writer:
+            if isinstance(qsh._pyload, Trades):
+                _export_trades(qsh, writer, _start, _end, side, batch_size)
+            else:
+                _export_stocks(qsh, writer, _start, _end, side, batch_size)
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        qsh._io_stream.close()
+    return writer.frames
+
+
+def _export_trades(qsh, writer, start, end, side, batch_size):
+    """
+    trades rows of time range and side
+    """
+    for batch, frame_time in qsh.read_trades_columnar(batch_size, frame_time=True):
+        keep = np.ones(len(batch), dtype=bool)
+        if start is not None:
+            keep &= frame_time >= start
+        if end is not None:
+            keep &= frame_time < end
+        if side is not None:
+            keep &= batch['side'] == _SIDES[side]
+        writer.write_trades(batch[keep], frame_time[keep])
+        if end is not None and len(frame_time) and frame_time[-1] >= end:
+            return
+
+
+def _export_stocks(qsh, writer, start, end, side, batch_size):
+    """
+    quotes frames of time range, book snapshot at start;
+    for one side quotes of other side are dropped, they remove
+    levels of kept side at the same price
+    """
+    book = OrderBook()
+    #prices of kept side in written book
+    levels = set()
+    sign = {None: 0, 'ASK': 1, 'BID': -1}[side]
+    started = start is None
+
+    for batch in qsh.read_stocks_columnar(batch_size):
+        offsets = batch['offsets'].tolist()
+        prices = batch['price'].tolist()
+        volumes = batch['volume'].tolist()
+        for index, time_ms in enumerate(batch['timestamp'].tolist()):
+            if end is not None and time_ms >= end:
+                return
+            begin, stop = offsets[index], offsets[index + 1]
+            if not started:
+                if time_ms < start:
+                    book.apply(prices[begin:stop], volumes[begin:stop], time_ms)
+                    continue
+                started = True
+                snapshot = book.snapshot()
+                quotes = [(price, -volume) for price, volume in snapshot['bids']] +\
+                    [(price, volume) for price, volume in snapshot['asks']]
+                quotes = [item for item in quotes if sign * item[1] >= 0]
+                if quotes:
+                    writer.write_quotes(start, *zip(*quotes))
+                    levels.update(price for price, _ in quotes)
+
+            frame_prices, frame_volumes = prices[begin:stop], volumes[begin:stop]
+            if sign:
+                frame_prices, frame_volumes = [], []
+                for price, volume in zip(prices[begin:stop], volumes[begin:stop]):
+                    if volume * sign > 0:
+                        levels.add(price)
+                    elif price in levels:
+                        levels.discard(price)
+                        volume = 0
+                    else:
+                        continue
+                    frame_prices.append(price)
+                    frame_volumes.append(volume)
+                if not frame_prices:
+                    continue
+            writer.write_quotes(time_ms, frame_prices, frame_volumes)
+
+
+def write_synthetic(path, kind='Stock', frames=1000000, record_start_time=None,\
+    tool='SYNTH', seed=0, batch_size=65536):
+    """
+    Random walk file for load tests
+    kind: Stock or Deals
+    frames: frames number
+    record_start_time: by default 2015-03-02 10:00 Moscow
+    return: path
+    """
+    if np is None:
+        raise ImportError('numpy is required for synthetic files')
+
+    start = _epoch_ms(record_start_time or datetime(2015, 3, 2, 10))
+    rnd = np.random.default_rng(seed)
+    time_ms, price, number = start, 15000, 0
+
+    with QSHWriter(path, [(kind, tool)], start, user_comment='synthetic') as writer:
+        for first in range(0, frames, batch_size):
+            size = min(batch_size, frames - first)
+            times = time_ms + np.cumsum(rnd.integers(0, 50, size))
+            prices = price + np.cumsum(rnd.integers(-1, 2, size))
+            time_ms, price = int(times[-1]), int(prices[-1])
+
+            if kind == 'Deals':
+                batch = np.zeros(size, dtype=TRADES_DTYPE)
+                batch['timestamp'] = times - times % 1000
+                batch['trade_number'] = number + np.arange(1, size + 1)
+                batch['price'] = prices
+                batch['volume'] = rnd.integers(1, 100, size)
+                batch['side'] = rnd.integers(1, 3, size)
+                batch['mask'] = batch['side']
+                number += size
+                writer.write_trades(batch, times)
+                continue
+
+            #two quotes per frame: level near price and level removal
+            quotes = np.empty(2 * size, dtype='i8')
+            quotes[0::2] = prices + rnd.integers(1, 10, size) * np.where(\
+                rnd.integers(0, 2, size), 1, -1)
+            quotes[1::2] = prices + rnd.integers(10, 20, size)
+            volumes = np.empty(2 * size, dtype='i8')
+            volumes[0::2] = np.where(quotes[0::2] > prices, 1, -1) * rnd.integers(1, 1000, size)
+            volumes[1::2] = 0
+            writer.write_stocks({'timestamp': times, 'offsets': np.arange(0, 2 * size + 1, 2),\
+                'price': quotes, 'volume': volumes})
+    return path
+
+
+@unittest.skipIf(np is None, 'numpy is required')
+class TestWriter(unittest.TestCase):
+    """
+    writer tests
+    """
+    def setUp(self):
+        """
+        bundled files and temporary directory
+        """
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '20150302')
+        self.trades, self.quotes = [os.path.join(source,\
+            'GAZP.Qscalp.{}.2015-03-02.qsh'.format(name)) for name in ['Trades', 'Quotes']]
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        remove temporary files
+        """
+        shutil.rmtree(self.tmp)
+
+    def _frames(self, path, **kwargs):
+        """
+        all frames of file
+        """
+        qsh = QSHParser(path, **kwargs)
+        qsh.touch()
+        return list(qsh)
+
+    def test_leb(self):
+        """
+        table and growing encodings
+        """
+        for number in [0, 1, 63, 64, 8191, 8192, -8192, -8193, 16383, 16384, 1 << 40]:
+            self.assertEqual(sleb(number), _sleb128.encode_minimal(number))
+            if number >= 0:
+                self.assertEqual(uleb(number), _uleb128.encode_minimal(number))
+        self.assertEqual(growing(268435454), _uleb128.encode_minimal(268435454))
+        self.assertEqual(growing(-1), _ESCAPE + b'\x7f')
+
+        rnd = np.random.default_rng(1)
+        values = np.concatenate([rnd.integers(-1 << 62, 1 << 62, 1000) >>\
+            rnd.integers(0, 63, 1000), [0, -1, 63, 64, -64, -65, 127, 128, 200]])
+        kinds = np.where(values < 0, _SLEB_KIND, rnd.integers(0, 2, len(values)))
+        kinds[-3:] = _RAW
+        etalon = b''.join(bytes([value]) if kind == _RAW else (_sleb128 if kind ==\
+            _SLEB_KIND else _uleb128).encode_minimal(value) for value, kind in\
+            zip(values.tolist(), kinds.tolist()))
+        self.assertEqual(encode_leb(values, kinds), etalon)
+
+    def test_round_trip(self):
+        """
+        full re-export is the same file
+        """
+        for path in [self.trades, self.quotes]:
+            out = os.path.join(self.tmp, os.path.basename(path))
+            export(path, out)
+            with open(path, 'rb') as src, open(out, 'rb') as result:
+                self.assertEqual(src.read(), result.read())
+
+    def test_filter(self):
+        """
+        one hour of one side trades, one side of order book
+        """
+        start, end = datetime(2015, 3, 2, 12), datetime(2015, 3, 2, 13)
+        out = os.path.join(self.tmp, 'trades.qsh')
+        frames = export(self.trades, out, start, end, 'BID')
+
+        qsh = QSHParser(self.trades, timestamps='ms')
+        qsh.touch()
+        etalon = []
+        for data in qsh.iter_range(start, end):
+            if data['trade_type'] == 'BID':
+                etalon.append(data)
+        qsh._io_stream.close()
+        self.assertEqual(frames, len(etalon))
+        self.assertListEqual(self._frames(out, timestamps='ms'), etalon)
+
+        out = os.path.join(self.tmp, 'quotes.qsh')
+        export(self.quotes, out, start, end, 'ASK')
+        book = OrderBook()
+        qsh = QSHParser(self.quotes, timestamps='ms')
+        qsh.touch()
+        result = QSHParser(out, timestamps='ms')
+        result.touch()
+        filtered = OrderBook()
+        for data in qsh.iter_range(end=end):
+            quotes = data['quotes']
+            book.apply([quote['rate'] for quote in quotes],\
+                [quote['volume'] for quote in quotes], data['timestamp'])
+            if data['timestamp'] < _epoch_ms(start):
+                continue
+            for item in result.iter_range(end=data['timestamp'] + 1):
+                filtered.apply([quote['rate'] for quote in item['quotes']],\
+                    [quote['volume'] for quote in item['quotes']])
+                self.assertTrue(all(quote['volume'] >= 0 for quote in item['quotes']))
+            self.assertListEqual(filtered.top_n(10)[1], book.top_n(10)[1])
+            self.assertListEqual(filtered.top_n(10)[0], [])
+        qsh._io_stream.close()
+        result._io_stream.close()
+
+    def test_export_rejected(self):
+        """
+        bad side is rejected before file is opened, rejected file is closed
+        """
+        import gc
+        import warnings
+        out = os.path.join(self.tmp, 'out.qsh')
+        self.assertRaises(ValueError, export, os.path.join(self.tmp, 'none.qsh'), out,\
+            side='SELL')
+
+        path = os.path.join(self.tmp, 'multi.qsh')
+        with QSHWriter(path, [('Stock', 'A'), ('Deals', 'A')], datetime(2015, 3, 2, 10)):
+            pass
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            self.assertRaises(FileSignatureError, export, path, out)
+            gc.collect()
+        self.assertFalse([item for item in caught if item.category is ResourceWarning])
+        self.assertFalse(os.path.exists(out))
+
+    def test_synthetic(self):
+        """
+        synthetic files are readable
+        """
+        for kind in ['Stock', 'Deals']:
+            out = write_synthetic(os.path.join(self.tmp, kind + '.qsh'), kind, 5000,\
+                batch_size=1000)
+            frames = self._frames(out, timestamps='ms')
+            self.assertEqual(len(frames), 5000)
+
+        qsh = QSHParser(out)
+        qsh.touch()
+        times = np.concatenate([batch for _, batch in qsh.read_trades_columnar(\
+            frame_time=True)])
+        self.assertTrue(np.all(np.diff(times) >= 0))
+        self.assertEqual(times[0] // 1000, _epoch_ms(datetime(2015, 3, 2, 10)) // 1000)
+
+    def test_multi_stream(self):
+        """
+        two streams file with frames by write_trade and write_quotes
+        """
+        out = os.path.join(self.tmp, 'multi.qsh')
+        start = datetime(2015, 3, 2, 10)
+        with QSHWriter(out, [('Stock', 'A'), (32, 'A')], start) as writer:
+            writer.write_quotes(_epoch_ms(start) + 5, [100, 101], [-3, 4])
+            writer.write_trade(_epoch_ms(start) + 7, 101, 2, 'ASK',\
+                exchange_ms=_epoch_ms(start), stream=1)
+            writer.write_trade(_epoch_ms(start) + 9, 101, 2, 'BID', stream=1)
+
+        qsh = QSHParser(out, timestamps='ms')
+        qsh.touch()
+        items = list(qsh.iter_streams())
+        self.assertListEqual([number for number, _ in items], [0, 1, 1])
+        self.assertListEqual(items[0][1]['quotes'], [{'rate': 100, 'volume': -3},\
+            {'rate': 101, 'volume': 4}])
+        self.assertEqual(items[1][1]['exchange_date_time'], _epoch_ms(start))
+        self.assertEqual(items[2][1]['trade_type'], 'BID')
+        self.assertEqual(items[2][1]['transaction_price'], 101)
+
+    def test_missing_fields(self):
+        """
+        trades before first exchange time and price are MISSING_I8 and
+        re-export keeps them absent
+        """
+        path = os.path.join(self.tmp, 'missing.qsh')
+        start = _epoch_ms(datetime(2015, 3, 2, 10))
+        with QSHWriter(path, [('Deals', 'A')], start) as writer:
+            writer.write_trade(start, volume=5)
+            writer.write_trade(start + 10, 15000, 3, 'ASK', start + 10)
+            writer.write_trade(start + 20, 15010, 2, 'BID')
+
+        qsh = QSHParser(path)
+        qsh.touch()
+        batches = list(qsh.read_trades_columnar(batch_size=1))
+        batch = np.concatenate(batches)
+        self.assertListEqual(batch['timestamp'].tolist(), [MISSING_I8, start + 10, start + 10])
+        self.assertListEqual(batch['price'].tolist(), [MISSING_I8, 15000, 15010])
+        self.assertTrue(np.isnat(epoch_ms_to_local(batch['timestamp'])[0]))
+
+        out = os.path.join(self.tmp, 'missing_out.qsh')
+        export(path, out)
+        with open(path, 'rb') as src, open(out, 'rb') as result:
+            self.assertEqual(src.read(), result.read())
+
+        with QSHWriter(os.path.join(self.tmp, 'no_frame_time.qsh'), [('Deals', 'A')],\
+            start) as writer:
+            self.assertRaises(ValueError, writer.write_trades, batch)
+
+
+if __name__ == "__main__":
+    unittest.main()